@@ -4,28 +4,23 @@ import os
 import fire
 import torch
 import numpy as np
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 
 from tqdm import tqdm
 from pprint import pprint
 from torch.utils.data import DataLoader
 from torch.nn import functional
-from torchnet import meter
-from matplotlib.ticker import NullFormatter
-from sklearn import manifold
-from sklearn.metrics import roc_curve, roc_auc_score, average_precision_score
 
 from config import config
 from dataset import CollapseDataset, VB_Dataset, Dual_Dataset, ContextVB_Dataset
 from models import ResNet18, ResNet34, ResNet50, SkipResNet18, DensResNet18, GuideResNet18, Vgg16, AlexNet
 from models import densenet_collapse, ShallowVgg, DualNet, CustomedNet, ContextResNet18
-from models import FocalLoss, LabelSmoothing
-from utils import Visualizer, write_csv, write_json, draw_ROC
+from models import FocalLoss, LabelSmoothing, has_frozen, load_frozen, build_model, model_head
+from utils import Visualizer, write_csv, write_json, draw_ROC, Timeline
+from utils import inference, roc_2class, metrics_2class, confusion_metrics, metrics_3class, bootstrap_ci, ROCMeter, PredictionCache
 
 
 def train(**kwargs):
+    from torchnet import meter  # 只有训练时用到
     config.parse(kwargs)
     vis = Visualizer(port=2333, env=config.env)
     vis.log('Use config:')
@@ -80,7 +75,7 @@ def train(**kwargs):
     loss_meter = meter.AverageValueMeter()
     epoch_loss = meter.AverageValueMeter()
     train_cm = meter.ConfusionMeter(config.num_classes)
-    train_AUC = meter.AUCMeter()
+    train_AUC = ROCMeter(config.roc_bins if config.roc_bins else 10000)
 
     previous_avgse = 0
     # previous_AUC = 0
@@ -227,6 +222,7 @@ def train(**kwargs):
 
 
 def iter_train(**kwargs):
+    from torchnet import meter  # 只有训练时用到
     config.parse(kwargs)
 
     # ============================================ Visualization =============================================
@@ -248,12 +244,14 @@ def iter_train(**kwargs):
 
     train_dataloader = DataLoader(train_data, batch_size=config.batch_size, shuffle=True, num_workers=config.num_workers)
     val_dataloader = DataLoader(val_data, batch_size=config.batch_size, shuffle=False, num_workers=config.num_workers)
+    timeline = Timeline(config.timeline, trace_file=config.timeline_file, sync=config.use_gpu)
+    timeline.attach(train_dataloader)
+    timeline.attach(val_dataloader)
 
     # ============================================= Prepare Model ============================================
     # model = ResNet18(num_classes=config.num_classes)
     # model = ResNet34(num_classes=config.num_classes)
     # model = ResNet50(num_classes=config.num_classes)
-    model = Vgg16(num_classes=config.num_classes)
     # model = AlexNet(num_classes=config.num_classes)
     # model = densenet_collapse(num_classes=config.num_classes)
     # model = ShallowVgg(num_classes=config.num_classes)
@@ -263,6 +261,10 @@ def iter_train(**kwargs):
     # model = DensResNet18(num_classes=config.num_classes)
     # model = GuideResNet18(num_classes=config.num_classes)
     # print(model)
+    if config.arch:  # 命令行指定的模型优先
+        model = build_model(config.arch, num_classes=config.num_classes)
+    else:
+        model = Vgg16(num_classes=config.num_classes)
 
     if config.load_model_path:
         model.load(config.load_model_path)
@@ -321,31 +323,38 @@ def iter_train(**kwargs):
     train_iter = iter(train_dataloader)
     model.train()
     while iteration < config.max_iter:
-        try:
-            image, label, image_path = next(train_iter)
-        except:
-            train_iter = iter(train_dataloader)
-            image, label, image_path = next(train_iter)
+        with timeline.span('data'):
+            try:
+                image, label, image_path = next(train_iter)
+            except:
+                train_iter = iter(train_dataloader)
+                image, label, image_path = next(train_iter)
 
         iteration += 1
 
         # ------------------------------------ prepare input ------------------------------------
         if config.use_gpu:
-            image = image.cuda()
-            label = label.cuda()
+            with timeline.span('h2d'):
+                image = image.cuda()
+                label = label.cuda()
 
         # ---------------------------------- go through the model --------------------------------
-        score = model(image)
+        with timeline.span('forward'):
+            score = model(image)
 
         # ----------------------------------- backpropagate -------------------------------------
-        optimizer.zero_grad()
-        loss = criterion(score, label)
-        # loss = criterion(log_softmax(score, dim=1), label)  # LabelSmoothing
-        loss.backward()
-        optimizer.step()
+        with timeline.span('loss'):
+            optimizer.zero_grad()
+            loss = criterion(score, label)
+            # loss = criterion(log_softmax(score, dim=1), label)  # LabelSmoothing
+        with timeline.span('backward'):
+            loss.backward()
+        with timeline.span('optimizer'):
+            optimizer.step()
 
         # ------------------------------------ record loss ------------------------------------
-        loss_meter.add(loss.item())
+        with timeline.span('metrics'):
+            loss_meter.add(loss.item())
 
         if iteration % config.print_freq == 0:
             tqdm.write(f"iter: [{iteration}/{config.max_iter}] {config.save_model_name[:-4]} ==================================")
@@ -353,22 +362,24 @@ def iter_train(**kwargs):
             # *************************************** validate ***************************************
             if config.num_classes == 2:  # 2分类
                 model.eval()
-                train_cm, train_AUC, train_sp, train_se, train_T, train_accuracy = val_2class(model, train_dataloader, train_dist)
-                val_cm, val_AUC, val_sp, val_se, val_T, val_accuracy = val_2class(model, val_dataloader, val_dist)
+                with timeline.span('eval'):
+                    train_cm, train_AUC, train_sp, train_se, train_T, train_accuracy = val_2class(model, train_dataloader, train_dist)
+                    val_cm, val_AUC, val_sp, val_se, val_T, val_accuracy = val_2class(model, val_dataloader, val_dist)
                 # vis.plot('loss', loss_meter.value()[0])
 
                 model.train()
 
                 # ------------------------------------ save model ------------------------------------
                 if val_AUC > previous_AUC:  # 当测试集上的AUC升高时保存模型
-                    if config.parallel:
-                        if not os.path.exists(os.path.join('checkpoints', save_model_dir, save_model_name[:-4])):
-                            os.makedirs(os.path.join('checkpoints', save_model_dir, save_model_name[:-4]))
-                        model.module.save(os.path.join('checkpoints', save_model_dir, save_model_name[:-4], save_model_name))
-                    else:
-                        if not os.path.exists(os.path.join('checkpoints', save_model_dir, save_model_name[:-4])):
-                            os.makedirs(os.path.join('checkpoints', save_model_dir, save_model_name[:-4]))
-                        model.save(os.path.join('checkpoints', save_model_dir, save_model_name[:-4], save_model_name))
+                    with timeline.span('checkpoint'):
+                        if config.parallel:
+                            if not os.path.exists(os.path.join('checkpoints', save_model_dir, save_model_name[:-4])):
+                                os.makedirs(os.path.join('checkpoints', save_model_dir, save_model_name[:-4]))
+                            model.module.save(os.path.join('checkpoints', save_model_dir, save_model_name[:-4], save_model_name))
+                        else:
+                            if not os.path.exists(os.path.join('checkpoints', save_model_dir, save_model_name[:-4])):
+                                os.makedirs(os.path.join('checkpoints', save_model_dir, save_model_name[:-4]))
+                            model.save(os.path.join('checkpoints', save_model_dir, save_model_name[:-4], save_model_name))
                     previous_AUC = val_AUC
                     save_iter = iteration
 
@@ -406,20 +417,22 @@ def iter_train(**kwargs):
 
             elif config.num_classes == 3:  # 3分类
                 model.eval()
-                train_cm, train_mAP, train_sp, train_se, train_mAUC, train_accuracy = val_3class(model, train_dataloader, train_data_scale)
-                val_cm, val_mAP, val_sp, val_se, val_mAUC, val_accuracy = val_3class(model, val_dataloader, val_data_scale)
+                with timeline.span('eval'):
+                    train_cm, train_mAP, train_sp, train_se, train_mAUC, train_accuracy = val_3class(model, train_dataloader, train_data_scale)
+                    val_cm, val_mAP, val_sp, val_se, val_mAUC, val_accuracy = val_3class(model, val_dataloader, val_data_scale)
                 model.train()
 
                 # ------------------------------------ save model ------------------------------------
                 if val_mAP > previous_mAP:  # 当测试集上的mAP升高时保存模型
-                    if config.parallel:
-                        if not os.path.exists(os.path.join('checkpoints', save_model_dir, save_model_name[:-4])):
-                            os.makedirs(os.path.join('checkpoints', save_model_dir, save_model_name[:-4]))
-                        model.module.save(os.path.join('checkpoints', save_model_dir, save_model_name[:-4], save_model_name))
-                    else:
-                        if not os.path.exists(os.path.join('checkpoints', save_model_dir, save_model_name[:-4])):
-                            os.makedirs(os.path.join('checkpoints', save_model_dir, save_model_name[:-4]))
-                        model.save(os.path.join('checkpoints', save_model_dir, save_model_name[:-4], save_model_name))
+                    with timeline.span('checkpoint'):
+                        if config.parallel:
+                            if not os.path.exists(os.path.join('checkpoints', save_model_dir, save_model_name[:-4])):
+                                os.makedirs(os.path.join('checkpoints', save_model_dir, save_model_name[:-4]))
+                            model.module.save(os.path.join('checkpoints', save_model_dir, save_model_name[:-4], save_model_name))
+                        else:
+                            if not os.path.exists(os.path.join('checkpoints', save_model_dir, save_model_name[:-4])):
+                                os.makedirs(os.path.join('checkpoints', save_model_dir, save_model_name[:-4]))
+                            model.save(os.path.join('checkpoints', save_model_dir, save_model_name[:-4], save_model_name))
                     previous_mAP = val_mAP
                     save_iter = iteration
 
@@ -472,111 +485,33 @@ def iter_train(**kwargs):
                 print('Best mAP:', previous_mAP)
 
             loss_meter.reset()
+            if timeline.enabled:
+                print(timeline.report())
 
         # ------------------------------------ save record ------------------------------------
         if os.path.exists(os.path.join('checkpoints', save_model_dir, save_model_name.split('.')[0])):
-            write_json(file=os.path.join('checkpoints', save_model_dir, save_model_name.split('.')[0], 'process_record.json'), content=process_record)
+            with timeline.span('checkpoint'):
+                write_json(file=os.path.join('checkpoints', save_model_dir, save_model_name.split('.')[0], 'process_record.json'), content=process_record)
 
     # vis.log(f"Best Iter: {save_iter}")
     print("Best Iter:", save_iter)
+    timeline.save()
 
 
-def val_2class(model, dataloader, dist):
-    # ============================ Prepare Metrics ==========================
-    y_true, y_scores = [], []
+def get_score(model, image):
+    return model(image)
 
-    softmax = functional.softmax
-
-    # ================================ Validate ==============================
-    for i, (image, label, image_path) in tqdm(enumerate(dataloader)):
-
-        # ******************* prepare input and go through the model *******************
-        if config.use_gpu:
-            image = image.cuda()
-            label = label.cuda()
-        image.requires_grad = False
-        label.requires_grad = False
 
-        score = model(image)
-
-        # *********************** confusion matrix and AUC ***********************
-        positive_score = [item[1] for item in softmax(score, dim=1).data.cpu().numpy().tolist()]
-        y_true.extend(label.data.cpu().numpy().tolist())  # 用于sklearn计算AUC和ROC
-        y_scores.extend(positive_score)
-
-    # ************************** TPR, FPR, AUC ******************************
-    SKL_FPR, SKL_TPR, SKL_Thresholds = roc_curve(y_true, y_scores)
-    SKL_AUC = roc_auc_score(np.array(y_true), np.array(y_scores), average='weighted')
-
-    # ******************** Best SE, SP, Thresh, Matrix ***********************
-    best_index = np.argmax(SKL_TPR - SKL_FPR, axis=0)
-    best_SE, best_SP, best_T = SKL_TPR[best_index], 1 - SKL_FPR[best_index], SKL_Thresholds[best_index]
-    best_confusion_matrix = [[int(round(dist['0'] * best_SP)), int(round(dist['0'] * (1 - best_SP)))],
-                             [int(round(dist['1'] * (1 - best_SE))), int(round(dist['1'] * best_SE))]]
-
-    # *********************** accuracy and sensitivity ***********************
-    val_accuracy = 100. * sum([best_confusion_matrix[c][c] for c in range(config.num_classes)]) / np.sum(best_confusion_matrix)
-    # val_se = [100. * best_confusion_matrix[i][i] / np.sum(best_confusion_matrix[i]) for i in range(config.num_classes)]
-
-    return best_confusion_matrix, SKL_AUC, best_SP, best_SE, best_T, val_accuracy
+def val_2class(model, dataloader, dist):
+    predictions = inference(model, dataloader, get_score, config.num_classes, use_gpu=config.use_gpu,
+                            batch_size=config.eval_batch_size, roc_bins=config.roc_bins)
+    return metrics_2class(predictions, dist)
 
 
 def val_3class(model, dataloader, data_scale):
-    # ============================ Prepare Metrics ==========================
-    val_cm = meter.ConfusionMeter(config.num_classes)
-    val_mAP = meter.mAPMeter()
-    y_true_0, y_scores_0 = [], []
-    y_true_1, y_scores_1 = [], []
-    y_true_2, y_scores_2 = [], []
-
-    softmax = functional.softmax
-
-    # ================================ Validate ==============================
-    for i, (image, label, image_path) in tqdm(enumerate(dataloader)):
-
-        # ******************* prepare input and go through the model *******************
-        if config.use_gpu:
-            image = image.cuda()
-            label = label.cuda()
-
-        image.requires_grad = False
-        label.requires_grad = False
-
-        score = model(image)
-
-        # *********************** confusion matrix and mAP ***********************
-        one_hot = torch.zeros(label.size(0), 3).scatter_(1, label.data.cpu().unsqueeze(1), 1)
-
-        val_cm.add(softmax(score, dim=1).data, label.data)
-        val_mAP.add(softmax(score, dim=1).data, one_hot)
-
-        positive_score_0 = [item[0] for item in softmax(score, dim=1).data.cpu().numpy().tolist()]
-        positive_score_1 = [item[1] for item in softmax(score, dim=1).data.cpu().numpy().tolist()]
-        positive_score_2 = [item[2] for item in softmax(score, dim=1).data.cpu().numpy().tolist()]
-        label_0 = [1 if item == 0 else 0 for item in label.data.cpu().numpy().tolist()]
-        label_1 = [1 if item == 1 else 0 for item in label.data.cpu().numpy().tolist()]
-        label_2 = [1 if item == 2 else 0 for item in label.data.cpu().numpy().tolist()]
-
-        y_true_0.extend(label_0)  # 用于sklearn计算AUC和ROC
-        y_true_1.extend(label_1)
-        y_true_2.extend(label_2)
-        y_scores_0.extend(positive_score_0)
-        y_scores_1.extend(positive_score_1)
-        y_scores_2.extend(positive_score_2)
-
-    # *********************** accuracy and sensitivity ***********************
-    AUC_0 = roc_auc_score(np.array(y_true_0), np.array(y_scores_0), average='weighted')
-    AUC_1 = roc_auc_score(np.array(y_true_1), np.array(y_scores_1), average='weighted')
-    AUC_2 = roc_auc_score(np.array(y_true_2), np.array(y_scores_2), average='weighted')
-
-    val_cm = val_cm.value()
-    val_accuracy = 100. * sum([val_cm[c][c] for c in range(config.num_classes)]) / val_cm.sum()
-    val_sp = [100. * (val_cm.sum() - val_cm.sum(0)[i] - val_cm.sum(1)[i] + val_cm[i][i]) / (val_cm.sum() - val_cm.sum(1)[i])
-              for i in range(config.num_classes)]
-    val_se = [100. * val_cm[i][i] / val_cm.sum(1)[i] for i in range(config.num_classes)]
-    val_cm = val_cm / np.expand_dims(np.array(data_scale), axis=1)  # 计算指标时按照balance后的matrix来算，展示的时候还原
-
-    return val_cm.astype(dtype=np.int32), val_mAP.value().numpy(), val_sp, val_se, (AUC_0+AUC_1+AUC_2)/3, val_accuracy
+    predictions = inference(model, dataloader, get_score, config.num_classes, use_gpu=config.use_gpu,
+                            batch_size=config.eval_batch_size)
+    return metrics_3class(predictions, data_scale)
 
 
 def test_2class(**kwargs):
@@ -595,7 +530,16 @@ def test_2class(**kwargs):
     model = ShallowVgg(num_classes=config.num_classes)
     print(model)
 
-    if config.load_model_path:
+    if config.quantized:
+        from models import load_quantized  # torch.ao.quantization的FX只在用到int8模型时才import
+        model = load_quantized(config.load_model_path, backend=config.quantize_backend)
+        config.use_gpu, config.parallel = False, False  # int8模型只能在CPU上运行
+        print('Quantized model has been loaded!')
+    elif config.load_model_path and config.use_frozen and has_frozen(config.load_model_path):
+        model = load_frozen(config.load_model_path, map_location='cuda' if config.use_gpu else 'cpu')
+        config.parallel = False  # 冻结的推理图不支持DataParallel
+        print('Frozen model has been loaded!')
+    elif config.load_model_path:
         model.load(config.load_model_path)
         print('Model has been loaded!')
     else:
@@ -606,54 +550,30 @@ def test_2class(**kwargs):
         model = torch.nn.DataParallel(model, device_ids=[x for x in range(config.num_of_gpu)])
     model.eval()
 
-    # =========================================== Prepare Metrics =====================================
-    test_cm = meter.ConfusionMeter(config.num_classes)
-    test_AUC = meter.AUCMeter()
-    softmax = functional.softmax
-    results = []
-    y_true, y_scores = [], []
-
     # =========================================== Test ============================================
-    for i, (image, label, image_path) in tqdm(enumerate(test_dataloader)):
-        # ******************* prepare input and go through the model *******************
-        if config.use_gpu:
-            image = image.cuda()
-            label = label.cuda()
-        image.requires_grad = False
-        label.requires_grad = False
-
-        score = model(image)
-
-        # *************************** confusion matrix and AUC *************************
-        test_cm.add(softmax(score, dim=1).data, label.data)
-        positive_score = np.array([item[1] for item in softmax(score, dim=1).data.cpu().numpy().tolist()])
-        test_AUC.add(positive_score, label.data)  # torchnet计算AUC和ROC
+    cache = PredictionCache(config.cache_path, config.cache_max_mb).bind(
+        config.load_model_path, model, model_head(model), useRGB=config.useRGB, padding=config.padding,
+        tta=config.tta) if config.use_cache and config.load_model_path else None
+    predictions = inference(model, test_dataloader, get_score, config.num_classes, use_gpu=config.use_gpu,
+                            batch_size=config.eval_batch_size, tta=config.tta, cache=cache)
+    probs = predictions.probs.numpy()
 
-        y_true.extend(label.data.cpu().numpy().tolist())  # 用于sklearn计算AUC和ROC
-        y_scores.extend(positive_score.tolist())
-
-        # ******************************** record prediction results ******************************
-        for l, p, ip in zip(label.detach(), softmax(score, dim=1).detach(), image_path):
-            if p[1] < 0.5:
-                results.append((ip, int(l), 0, round(float(p[0]), 4), round(float(p[1]), 4)))
-            else:
-                results.append((ip, int(l), 1, round(float(p[0]), 4), round(float(p[1]), 4)))
+    # ******************************** record prediction results ******************************
+    results = [(ip, int(l), int(p[1] >= 0.5), round(float(p[0]), 4), round(float(p[1]), 4))
+               for ip, l, p in zip(predictions.paths, predictions.labels, probs)]
 
     # ************************** TPR, FPR, AUC ******************************
-    SKL_FPR, SKL_TPR, SKL_Thresholds = roc_curve(y_true, y_scores)
-    SKL_AUC = roc_auc_score(np.array(y_true), np.array(y_scores), average='weighted')
+    SKL_FPR, SKL_TPR, SKL_Thresholds, SKL_AUC, best_index = roc_2class(predictions)
 
-    TNet_AUC, TNet_TPR, TNet_FPR = test_AUC.value()
+    test_AUC = ROCMeter(config.roc_bins if config.roc_bins else 10000)
+    test_AUC.add(probs[:, 1], predictions.labels)  # 直方图计算AUC和ROC
+    Hist_AUC, Hist_TPR, Hist_FPR = test_AUC.value()
 
     # ******************** Best SE, SP, Thresh, Matrix ***********************
-    best_index = np.argmax(SKL_TPR - SKL_FPR, axis=0)
-    best_SE, best_SP, best_T = SKL_TPR[best_index], 1-SKL_FPR[best_index], SKL_Thresholds[best_index]
-    best_confusion_matrix = [[int(round(test_dist['0'] * best_SP)), int(round(test_dist['0'] * (1 - best_SP)))],
-                             [int(round(test_dist['1'] * (1 - best_SE))), int(round(test_dist['1'] * best_SE))]]
+    best_confusion_matrix, _, best_SP, best_SE, best_T, _ = metrics_2class(predictions, test_dist)
 
     # *********************** accuracy and sensitivity ***********************
-    test_accuracy = 100. * sum([test_cm.value()[c][c] for c in range(config.num_classes)]) / np.sum(test_cm.value())
-    test_se = [100. * test_cm.value()[i][i] / np.sum(test_cm.value()[i]) for i in range(config.num_classes)]
+    test_accuracy, _, test_se = confusion_metrics(predictions.cm)
 
     # ================================ Save and Print Prediction Results ===========================
     if config.result_file:
@@ -664,11 +584,18 @@ def test_2class(**kwargs):
 
     print('test_acc:', test_accuracy)
     print('test_avgse:', round(np.average(test_se), 4), 'train_se0:', round(test_se[0], 4), 'train_se1:', round(test_se[1], 4))
-    print('SKL_AUC:', SKL_AUC, 'TNet_AUC:', TNet_AUC)
+    print('SKL_AUC:', SKL_AUC, 'Hist_AUC:', Hist_AUC, '(error <=', round(test_AUC.error(), 6), ')')
     print('Best_SE:', best_SE, 'Best_SP:', best_SP, 'Best_Threshold:', best_T)
     print('test_cm:')
     print(best_confusion_matrix)
 
+    # ============================= Bootstrap Confidence Intervals =============================
+    if config.bootstrap:  # 按病人 / 脊骨重采样的95%置信区间
+        test_ci = bootstrap_ci(predictions, config.bootstrap, by=config.bootstrap_by, threshold=best_T)
+        write_json(os.path.join('results', config.load_model_path.split('/')[-1][:-4] + '_ci.json'), test_ci)
+        for name, interval in test_ci.items():
+            print(f'test_{name} 95% CI:', interval)
+
 
 def test_3class(**kwargs):
     config.parse(kwargs)
@@ -690,7 +617,16 @@ def test_3class(**kwargs):
     # model = ResNet50(num_classes=config.num_classes)
     # print(model)
 
-    if config.load_model_path:
+    if config.quantized:
+        from models import load_quantized  # torch.ao.quantization的FX只在用到int8模型时才import
+        model = load_quantized(config.load_model_path, backend=config.quantize_backend)
+        config.use_gpu, config.parallel = False, False  # int8模型只能在CPU上运行
+        print('Quantized model has been loaded!')
+    elif config.load_model_path and config.use_frozen and has_frozen(config.load_model_path):
+        model = load_frozen(config.load_model_path, map_location='cuda' if config.use_gpu else 'cpu')
+        config.parallel = False  # 冻结的推理图不支持DataParallel
+        print('Frozen model has been loaded!')
+    elif config.load_model_path:
         model.load(config.load_model_path)
         print('Model has been loaded!')
     else:
@@ -701,93 +637,21 @@ def test_3class(**kwargs):
         model = torch.nn.DataParallel(model, device_ids=list(range(config.num_of_gpu)))
     model.eval()
 
-    # ============================ Prepare Metrics ==========================
-    test_cm = meter.ConfusionMeter(config.num_classes)
-    test_mAP = meter.mAPMeter()
-    y_true_0, y_scores_0 = [], []
-    y_true_1, y_scores_1 = [], []
-    y_true_2, y_scores_2 = [], []
-    results = []
-    features, colors = [], []  # for t-SNE
-
-    softmax = functional.softmax
-
     # ================================== Test ===============================
-    for i, (image, label, image_path) in tqdm(enumerate(test_dataloader)):
-
-        # ******************* prepare input and go through the model *******************
-        if config.use_gpu:
-            image = image.cuda()
-            label = label.cuda()
-        image.requires_grad = False
-        label.requires_grad = False
-
-        score = model(image)
-
-        # *********************** t-SNE feature and colors ***********************
-        features.append(score.detach().cpu().numpy())
-        for c in label.cpu().numpy().tolist():
-            if c == 0:
-                colors.append('springgreen')
-            elif c == 1:
-                colors.append('mediumblue')
-            elif c == 2:
-                colors.append('red')
-            else:
-                raise ValueError
-
-        # *********************** confusion matrix and mAP ***********************
-        one_hot = torch.zeros(label.size(0), 3).scatter_(1, label.data.cpu().unsqueeze(1), 1)
-
-        test_cm.add(softmax(score, dim=1).data, label.data)
-        test_mAP.add(softmax(score, dim=1).data, one_hot)
-
-        positive_score_0 = [item[0] for item in softmax(score, dim=1).data.cpu().numpy().tolist()]
-        positive_score_1 = [item[1] for item in softmax(score, dim=1).data.cpu().numpy().tolist()]
-        positive_score_2 = [item[2] for item in softmax(score, dim=1).data.cpu().numpy().tolist()]
-        label_0 = [1 if item == 0 else 0 for item in label.data.cpu().numpy().tolist()]
-        label_1 = [1 if item == 1 else 0 for item in label.data.cpu().numpy().tolist()]
-        label_2 = [1 if item == 2 else 0 for item in label.data.cpu().numpy().tolist()]
-
-        y_true_0.extend(label_0)  # 用于sklearn计算AUC和ROC
-        y_true_1.extend(label_1)
-        y_true_2.extend(label_2)
-        y_scores_0.extend(positive_score_0)
-        y_scores_1.extend(positive_score_1)
-        y_scores_2.extend(positive_score_2)
-
-        # ******************************** record prediction results ******************************
-        for l, p, ip in zip(label.detach(), softmax(score, dim=1).detach(), image_path):
-            if p[0] > p[1] and p[0] > p[2]:
-                results.append((ip, int(l), 0, round(float(p[0]), 4), round(float(p[1]), 4), round(float(p[2]), 4)))
-            elif p[1] > p[0] and p[1] > p[2]:
-                results.append((ip, int(l), 1, round(float(p[0]), 4), round(float(p[1]), 4), round(float(p[2]), 4)))
-            else:
-                results.append((ip, int(l), 2, round(float(p[0]), 4), round(float(p[1]), 4), round(float(p[2]), 4)))
+    cache = PredictionCache(config.cache_path, config.cache_max_mb).bind(
+        config.load_model_path, model, model_head(model), useRGB=config.useRGB, padding=config.padding,
+        tta=config.tta) if config.use_cache and config.load_model_path else None
+    predictions = inference(model, test_dataloader, get_score, config.num_classes, use_gpu=config.use_gpu,
+                            batch_size=config.eval_batch_size, tta=config.tta, cache=cache,
+                            dedup=True)  # upsample重复的样本只forward一次
+    probs = predictions.probs.numpy()
+
+    # ******************************** record prediction results ******************************
+    results = [(ip, int(l), int(np.argmax(p)), round(float(p[0]), 4), round(float(p[1]), 4), round(float(p[2]), 4))
+               for ip, l, p in zip(predictions.paths, predictions.labels, probs)]
 
     # ================================== accuracy and sensitivity ==================================
-    AUC_0 = roc_auc_score(np.array(y_true_0), np.array(y_scores_0), average='weighted')
-    AUC_1 = roc_auc_score(np.array(y_true_1), np.array(y_scores_1), average='weighted')
-    AUC_2 = roc_auc_score(np.array(y_true_2), np.array(y_scores_2), average='weighted')
-
-    test_cm = test_cm.value()
-    test_accuracy = 100. * sum([test_cm[c][c] for c in range(config.num_classes)]) / test_cm.sum()
-    test_sp = [100. * (test_cm.sum() - test_cm.sum(0)[i] - test_cm.sum(1)[i] + test_cm[i][i]) / (test_cm.sum() - test_cm.sum(1)[i])
-               for i in range(config.num_classes)]
-    test_se = [100. * test_cm[i][i] / test_cm.sum(1)[i] for i in range(config.num_classes)]
-    test_cm = test_cm / np.expand_dims(np.array(test_scale), axis=1)  # 计算指标时按照balance后的matrix来算，展示的时候还原
-
-    # ============================================ t-SNE ===========================================
-    features = np.concatenate(features, axis=0)
-    tsne = manifold.TSNE(n_components=2, init='pca', random_state=0)
-    Y = tsne.fit_transform(features)  # 转换后的输出
-    fig = plt.figure(figsize=(8, 8))
-    ax = fig.add_subplot(1, 1, 1)
-    plt.scatter(Y[:, 0], Y[:, 1], c=colors, cmap=plt.cm.Spectral)
-    ax.xaxis.set_major_formatter(NullFormatter())  # 设置标签显示格式为空
-    ax.yaxis.set_major_formatter(NullFormatter())
-    plt.savefig(f'results/{config.load_model_path.split("/")[-1][:-4]}_logits2.png')
-    # ipdb.set_trace()
+    test_cm, test_mAP, test_sp, test_se, test_mAUC, test_accuracy = metrics_3class(predictions, test_scale)
 
     # ================================ Save and Print Prediction Results ===========================
     if config.result_file:
@@ -797,11 +661,18 @@ def test_3class(**kwargs):
     print('test_sp0:', test_sp[0], 'test_sp1:', test_sp[1], 'test_sp2:', test_sp[2])
     print('test_se0:', test_se[0], 'test_se1:', test_se[1], 'test_se2:', test_se[2])
     print('mSP:', round(sum(test_sp) / 3, 5), 'mSE:', round(sum(test_se) / 3, 5))
-    print('test_mAUC:', (AUC_0 + AUC_1 + AUC_2) / 3)
-    print('test_mAP:', test_mAP.value().numpy())
+    print('test_mAUC:', test_mAUC)
+    print('test_mAP:', test_mAP)
     print('test_cm:')
     print(test_cm.astype(dtype=np.int32))
 
+    # ============================= Bootstrap Confidence Intervals =============================
+    if config.bootstrap:  # 按病人 / 脊骨重采样的95%置信区间
+        test_ci = bootstrap_ci(predictions, config.bootstrap, by=config.bootstrap_by)
+        write_json(os.path.join('results', config.load_model_path.split('/')[-1][:-4] + '_ci.json'), test_ci)
+        for name, interval in test_ci.items():
+            print(f'test_{name} 95% CI:', interval)
+
 
 if __name__ == '__main__':
     fire.Fire({
@@ -0,0 +1,268 @@
+# coding: utf-8
+
+import os
+import json
+import time
+import tempfile
+import platform
+import resource
+import multiprocessing
+import fire
+import torch
+
+from torch.utils.data import DataLoader, RandomSampler
+from torch.utils.data.dataloader import default_collate
+
+from config import config
+from dataset import VB_Dataset, ContextVB_Dataset, Dual_Dataset, CollapseDataset, make_synthetic
+from models import MODELS, build_model, example_inputs
+from utils import write_json, measure_latency
+
+# benchmark.py loader测量的dataset，均为训练时的设置(train phase，config中的useRGB / usetrans / padding)
+DATASETS = {
+    'VB': lambda paths: VB_Dataset(paths, phase='train', num_classes=config.num_classes, useRGB=config.useRGB,
+                                   usetrans=config.usetrans, padding=config.padding),
+    'Context': lambda paths: ContextVB_Dataset(paths, phase='train', num_classes=config.num_classes, useRGB=config.useRGB,
+                                               usetrans=config.usetrans, padding=config.padding, balance='upsample'),
+    'Dual': lambda paths: Dual_Dataset(paths, phase='train', useRGB=False, usetrans=config.usetrans, padding=config.padding),
+    'Collapse': lambda paths: CollapseDataset(paths, phase='train', useRGB=config.useRGB, usetrans=config.usetrans),
+}
+
+
+def peak_rss_mb():
+    """当前进程到目前为止的峰值常驻内存(Linux上ru_maxrss的单位为KB)"""
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def count_flops(model, inputs):
+    """:return: 一次forward的FLOPs(乘加算2次)，torch版本不支持时为None"""
+    try:
+        from torch.utils.flop_counter import FlopCounterMode
+    except ImportError:
+        return None
+    counter = FlopCounterMode(display=False)
+    with counter, torch.no_grad():
+        model(*inputs)
+    return counter.get_total_flops()
+
+
+def profile(job):
+    """
+    在单独的进程中测量一个模型，每个模型的峰值内存互不影响
+
+    :param job: (arch, num_classes, batch_sizes, threads, warmup, repeats, backward)
+    """
+    arch, num_classes, batch_sizes, threads, warmup, repeats, backward = job
+    torch.manual_seed(0)
+    base_rss = peak_rss_mb()
+    model = build_model(arch, num_classes=num_classes).eval()
+    result = {'params_M': round(sum(p.numel() for p in model.parameters()) / 1e6, 2),
+              'GFLOPs': None, 'runs': []}
+    flops = count_flops(model, example_inputs(arch, batch_size=1))
+    result['GFLOPs'] = round(flops / 1e9, 3) if flops is not None else None
+
+    for num_threads in threads:
+        torch.set_num_threads(num_threads)
+        for batch_size in batch_sizes:
+            inputs = example_inputs(arch, batch_size=batch_size)
+            run = {'threads': num_threads, 'batch_size': batch_size,
+                   'forward': measure_latency(model.eval(), inputs, warmup=warmup, repeats=repeats)}
+            if backward:
+                run['forward_backward'] = measure_latency(model.train(), inputs, warmup=warmup, repeats=repeats,
+                                                          backward=True)
+            result['runs'].append(run)
+            print(arch, run)
+    result['base_rss_MB'], result['peak_rss_MB'] = base_rss, peak_rss_mb()
+    return arch, result
+
+
+def run(*archs, **kwargs):
+    """
+    在CPU上测量各模型(默认为models/zoo.py中注册的全部模型)在不同batch_size、线程数下的
+    forward / forward + backward耗时和吞吐量，以及参数量、FLOPs和峰值内存，结果保存为benchmark_file
+
+    python benchmark.py run [ResNet18 ContextResNet18 ...] [--benchmark_batch_sizes=[1,32] --benchmark_threads=[1,8]]
+    """
+    config.parse(kwargs)
+    archs = list(archs) if archs else list(MODELS)
+    for arch in archs:
+        if arch not in MODELS:
+            raise ValueError(f'Unknown model: {arch}, choose from {list(MODELS)}')
+
+    jobs = [(arch, config.num_classes, list(config.benchmark_batch_sizes), list(config.benchmark_threads),
+             config.benchmark_warmup, config.benchmark_repeats, config.benchmark_backward) for arch in archs]
+    # spawn的新进程不继承父进程的内存，每个进程只跑一个模型
+    with multiprocessing.get_context('spawn').Pool(1, maxtasksperchild=1) as pool:
+        results = dict(pool.imap(profile, jobs))
+
+    report = {'meta': {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'torch': torch.__version__,
+                       'platform': platform.platform(), 'processor': platform.processor(),
+                       'cpu_count': os.cpu_count(), 'num_classes': config.num_classes},
+              'models': results}
+    if os.path.dirname(config.benchmark_file) and not os.path.exists(os.path.dirname(config.benchmark_file)):
+        os.makedirs(os.path.dirname(config.benchmark_file))
+    write_json(config.benchmark_file, report)
+    print('Benchmark ' + config.benchmark_file + ' has been saved!')
+
+
+def tensor_bytes(x):
+    """一个样本 / batch中所有Tensor的字节数，即worker通过共享内存传给主进程的数据量"""
+    if torch.is_tensor(x):
+        return x.element_size() * x.numel()
+    if isinstance(x, (tuple, list)):
+        return sum(tensor_bytes(item) for item in x)
+    return 0
+
+
+def profile_stages(dataset, num_samples, batch_size):
+    """
+    在主进程中读num_samples个样本，打开dataset.timer得到__getitem__各阶段的耗时，再单独测量collate
+
+    :return: {阶段名: 每个样本的毫秒数}，以及每个batch的Tensor大小(MB)
+    """
+    dataset.timer.enabled = True
+    dataset.timer.reset()
+    samples = [dataset[i % len(dataset)] for i in range(num_samples)]
+    dataset.timer.enabled = False
+    stages = dataset.timer.summary()
+
+    start = time.perf_counter()
+    for i in range(0, len(samples), batch_size):
+        default_collate(samples[i:i + batch_size])  # 图片Tensor的stack和路径字符串的整理
+    stages['collate'] = round(1000 * (time.perf_counter() - start) / len(samples), 4)
+    return stages, round(tensor_bytes(samples[0]) * batch_size / 2 ** 20, 3)
+
+
+def measure_loader(dataset, num_workers, batch_size, num_batches):
+    """
+    :return: 第一个batch的耗时(worker启动)，之后每秒读入的图片数
+    """
+    sampler = RandomSampler(dataset, replacement=True, num_samples=batch_size * (num_batches + 1))
+    loader = DataLoader(dataset, batch_size=batch_size, sampler=sampler, num_workers=num_workers)
+    start = time.perf_counter()
+    iterator = iter(loader)
+    next(iterator)
+    first = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in iterator:
+        pass
+    return first, batch_size * num_batches / (time.perf_counter() - start)
+
+
+def synthetic(**kwargs):
+    """
+    生成合成数据集(dataset/synthetic.py)，目录结构和csv与真实数据相同，可用于任意机器上的训练和benchmark，
+    如 python benchmark.py synthetic --synthetic_dir=/data/vb_synthetic --synthetic_patients=100000 --synthetic_workers=16
+    生成约150万张脊骨图；参数相同时不会重复生成。
+    ContextVB_Dataset按路径的第10级区分病人，--synthetic_dir的绝对路径最多7级，更深时报错
+
+    :return: {'train_VBOri': csv路径, ...}
+    """
+    config.parse(kwargs)
+    root = config.synthetic_dir if config.synthetic_dir else os.path.join(tempfile.gettempdir(), 'vb_synthetic')
+    start = time.perf_counter()
+    csvs = make_synthetic(root, num_patients=config.synthetic_patients, vertebrae=config.synthetic_vertebrae,
+                          workers=config.synthetic_workers, seed=config.synthetic_seed)
+    print(f'Synthetic dataset {root} is ready ({time.perf_counter() - start:.1f} s):')
+    for name, path in csvs.items():
+        print(f'    {name}: {path}')
+    return csvs
+
+
+def loader(*csv_paths, **kwargs):
+    """
+    分别测量各dataset的读图速度：__getitem__各阶段(decode / resize / 各个transform / to_tensor)和collate的耗时，
+    以及不同num_workers、batch_size下每秒读入的图片数，给出达到最快速度90%的最少worker数和最小batch_size。
+    默认在合成数据(dataset/synthetic.py)上运行，CollapseDataset读整条脊柱的图，其他读单块脊骨的图，
+    结果保存为loader_benchmark_file
+
+    python benchmark.py loader [train.csv ...] [--loader_workers=[0,4,8] --loader_batch_sizes=[32]]
+    :param csv_paths: 真实数据的csv，所有dataset都读这些csv，默认生成合成数据
+    """
+    config.parse(kwargs)
+    if csv_paths:
+        paths = {name: list(csv_paths) for name in DATASETS}
+    else:
+        csvs = synthetic()
+        paths = {name: [csvs['train_single' if name == 'Collapse' else 'train_VBOri']] for name in DATASETS}
+
+    results = {}
+    for name in config.loader_datasets:
+        try:
+            dataset = DATASETS[name](paths[name])
+            stages, batch_mb = profile_stages(dataset, config.loader_profile_samples, max(config.loader_batch_sizes))
+        except Exception as e:  # 某个dataset在当前环境下无法运行时只记录错误，不影响其他dataset
+            print(f'{name}: {type(e).__name__}: {e}')
+            results[name] = {'error': f'{type(e).__name__}: {e}'}
+            continue
+        print(name, 'ms per sample:', stages)
+
+        runs = []
+        for num_workers in config.loader_workers:
+            for batch_size in config.loader_batch_sizes:
+                first, images_per_sec = measure_loader(dataset, num_workers, batch_size, config.loader_batches)
+                runs.append({'num_workers': num_workers, 'batch_size': batch_size, 'startup_s': round(first, 3),
+                             'images_per_sec': round(images_per_sec, 2),
+                             'images_per_sec_per_worker': round(images_per_sec / max(num_workers, 1), 2)})
+                print(name, runs[-1])
+
+        best = max(run['images_per_sec'] for run in runs)
+        recommended = min([run for run in runs if run['images_per_sec'] >= 0.9 * best],
+                          key=lambda run: (run['num_workers'], run['batch_size']))
+        results[name] = {'size': len(dataset), 'ms_per_sample': stages, 'batch_MB': batch_mb, 'runs': runs,
+                         'recommended': {'num_workers': recommended['num_workers'],
+                                         'batch_size': recommended['batch_size']}}
+        print(f'{name}: recommended num_workers={recommended["num_workers"]}, batch_size={recommended["batch_size"]} '
+              f'({recommended["images_per_sec"]} images/s, best {best} images/s)')
+
+    report = {'meta': {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'torch': torch.__version__,
+                       'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'csv_paths': paths},
+              'datasets': results}
+    if os.path.dirname(config.loader_benchmark_file) and not os.path.exists(os.path.dirname(config.loader_benchmark_file)):
+        os.makedirs(os.path.dirname(config.loader_benchmark_file))
+    write_json(config.loader_benchmark_file, report)
+    print('Loader benchmark ' + config.loader_benchmark_file + ' has been saved!')
+
+
+def compare(baseline, current=None, tolerance=0.1, **kwargs):
+    """
+    与之前保存的benchmark比较，列出每个模型每组(线程数, batch_size)的耗时之比，
+    比baseline慢tolerance以上的记为变慢，有变慢时返回非0
+
+    python benchmark.py compare results/benchmark_old.json [results/benchmark.json]
+    :param current: 默认为config.benchmark_file
+    """
+    config.parse(kwargs)
+    with open(baseline) as f:
+        old = json.load(f)['models']
+    with open(current if current else config.benchmark_file) as f:
+        new = json.load(f)['models']
+
+    slower = []
+    for arch in [a for a in new if a in old]:
+        old_runs = {(r['threads'], r['batch_size']): r for r in old[arch]['runs']}
+        for run in new[arch]['runs']:
+            key = (run['threads'], run['batch_size'])
+            if key not in old_runs:
+                continue
+            for mode in ['forward', 'forward_backward']:
+                if mode not in run or mode not in old_runs[key]:
+                    continue
+                ratio = run[mode]['mean_ms'] / old_runs[key][mode]['mean_ms']
+                print(f'{arch} threads={key[0]} batch_size={key[1]} {mode}: '
+                      f'{old_runs[key][mode]["mean_ms"]} -> {run[mode]["mean_ms"]} ms ({ratio:.2f}x)')
+                if ratio > 1 + tolerance:
+                    slower.append(f'{arch} threads={key[0]} batch_size={key[1]} {mode} {ratio:.2f}x')
+    for message in slower:
+        print('SLOWER:', message)
+    if slower:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    fire.Fire({
+        'run': run,
+        'loader': loader,
+        'synthetic': synthetic,
+        'compare': compare
+    })
@@ -0,0 +1,256 @@
+# coding: utf-8
+
+import os
+import copy
+import importlib
+import fire
+import torch
+
+from tqdm import tqdm
+from torch.utils.data import DataLoader
+
+from config import config
+from dataset import VB_Dataset, ContextVB_Dataset
+from models import get_spec, build_model, example_inputs, adapt_inputs, unpack_score
+from models import frozen_path, save_frozen
+from models import lowrank_path, factorizable, decompose, factorize
+from models import pruned_path, prunable, prune_channels
+from utils import write_csv, write_json, measure_latency
+from utils import inference, roc_2class, mean_ap, mean_auc
+
+
+def build_dataloader(paths, arch=None):
+    spec = get_spec(arch if arch else config.arch)
+    if spec.num_inputs == 3:
+        data = ContextVB_Dataset(paths, phase='test', num_classes=config.num_classes, useRGB=spec.channels == 3,
+                                 usetrans=False, padding=config.padding, balance=config.data_balance)
+    else:
+        # 与test_2class / test_3class保持一致：2分类不做balance，3分类按balance后的数据计算指标
+        data = VB_Dataset(paths, phase='test', num_classes=config.num_classes, useRGB=spec.channels == 3,
+                          usetrans=False, padding=config.padding,
+                          balance=config.data_balance if config.num_classes == 3 else False)
+    return DataLoader(data, batch_size=config.batch_size, shuffle=False, num_workers=config.num_workers)
+
+
+def evaluate(model, dataloader, device='cpu', arch=None):
+    """计算与test_2class / test_3class相同的AUC / mAP"""
+    arch = arch if arch else config.arch
+    predictions = inference(model, dataloader, lambda m, x: unpack_score(m(*adapt_inputs(arch, x))),
+                            config.num_classes, use_gpu=device == 'cuda', batch_size=config.eval_batch_size, dedup=True)
+
+    if config.num_classes == 2:
+        return {'AUC': float(roc_2class(predictions)[3])}
+    elif config.num_classes == 3:
+        return {'mAP': float(mean_ap(predictions)), 'mAUC': float(mean_auc(predictions))}
+    else:
+        raise ValueError
+
+
+def count_params(model):
+    return round(sum(p.numel() for p in model.parameters()) / 1e6, 2)
+
+
+def quantize(**kwargs):
+    from models import quantized_path, quantize_static, save_quantized  # torch.ao.quantization的FX只在这里用到
+
+    config.parse(kwargs)
+    config.use_gpu = False  # int8算子只在CPU上运行
+
+    # ============================================= Prepare Data =============================================
+    calib_dataloader = build_dataloader(config.calib_paths)
+    test_dataloader = build_dataloader(config.test_paths)
+
+    # ============================================= Prepare Model ============================================
+    model = build_model(config.arch, num_classes=config.num_classes)
+    model.load(config.load_model_path, map_location='cpu')
+    model.eval()
+
+    # ============================================ Quantize =============================================
+    def calibration_batches():
+        for i, (image, label, image_path) in enumerate(tqdm(calib_dataloader, desc='Calibrating')):
+            if i == config.calib_batches:
+                break
+            yield adapt_inputs(config.arch, image)
+
+    inputs = example_inputs(config.arch, batch_size=config.batch_size)
+    qmodel = quantize_static(model, inputs, calibration_batches(), backend=config.quantize_backend)
+    save_path = save_quantized(qmodel, inputs, quantized_path(config.load_model_path))
+
+    # ======================================== Accuracy Drift and Latency ========================================
+    fp32_metrics, int8_metrics = evaluate(model, test_dataloader), evaluate(qmodel, test_dataloader)
+    report = {'arch': config.arch, 'checkpoint': config.load_model_path, 'quantized': save_path,
+              'fp32': fp32_metrics, 'int8': int8_metrics,
+              'drift': {k: int8_metrics[k] - fp32_metrics[k] for k in fp32_metrics},
+              'fp32_latency': measure_latency(model, inputs), 'int8_latency': measure_latency(qmodel, inputs),
+              'fp32_size_MB': round(os.path.getsize(config.load_model_path) / 2 ** 20, 2),
+              'int8_size_MB': round(os.path.getsize(save_path) / 2 ** 20, 2)}
+    write_json(file=os.path.splitext(save_path)[0] + '_report.json', content=report)
+
+    for k, v in report.items():
+        print(k + ':', v)
+
+
+def freeze(**kwargs):
+    config.parse(kwargs)
+    device = 'cuda' if config.use_gpu else 'cpu'
+
+    # ============================================= Prepare Model ============================================
+    model = build_model(config.arch, num_classes=config.num_classes)
+    model.load(config.load_model_path, map_location='cpu')
+    model.to(device).eval()
+
+    # ============================================ Freeze =============================================
+    # freeze之后权重成为计算图中的常量，.cuda()不会移动它们，在目标device上trace和freeze
+    inputs = tuple(x.to(device) for x in example_inputs(config.arch, batch_size=config.batch_size))
+    frozen = model.freeze(inputs)
+
+    with torch.no_grad():
+        diff = (unpack_score(model(*inputs)) - unpack_score(frozen(*inputs))).abs().max().item()
+    if diff > config.freeze_tolerance:  # load_inference_model / test默认优先使用推理图，误差大时不能保存
+        raise ValueError(f'frozen {config.arch} differs from the eager model by {diff} > {config.freeze_tolerance}')
+    save_path = save_frozen(frozen, frozen_path(config.load_model_path))
+
+    report = {'arch': config.arch, 'checkpoint': config.load_model_path, 'frozen': save_path, 'max_abs_diff': diff,
+              'eager_latency': measure_latency(model, inputs), 'frozen_latency': measure_latency(frozen, inputs)}
+    write_json(file=os.path.splitext(save_path)[0] + '_report.json', content=report)
+
+    for k, v in report.items():
+        print(k + ':', v)
+
+
+def lowrank(**kwargs):
+    config.parse(kwargs)
+    device = 'cuda' if config.use_gpu else 'cpu'
+    metric = 'AUC' if config.num_classes == 2 else 'mAP'
+
+    # ============================================= Prepare Data =============================================
+    val_dataloader = build_dataloader(config.val_paths)
+    test_dataloader = build_dataloader(config.test_paths)
+
+    # ============================================= Prepare Model ============================================
+    model = build_model(config.arch, num_classes=config.num_classes)
+    model.load(config.load_model_path, map_location='cpu')
+    model.eval()
+
+    names = factorizable(model)
+    if not names:
+        raise ValueError(f'{config.arch} has no Linear layer to factorize')
+    svd = decompose(model, names)  # 只分解一次，不同的rank直接截断
+
+    # ========================================== Choose Rank ==========================================
+    model.to(device)
+    baseline = evaluate(model, val_dataloader, device)[metric]
+    target = config.target_metric if config.target_metric is not None else baseline - config.max_metric_drop
+    print(f'{config.arch} val_{metric}: {baseline}, target: {target}, factorize: {names}')
+
+    table = []
+    for rank in sorted(config.lowrank_ranks):
+        candidate = factorize(copy.deepcopy(model), rank, svd).eval()
+        value = evaluate(candidate, val_dataloader, device)[metric]
+        table.append({'rank': rank, 'val_' + metric: value, 'params_M': count_params(candidate)})
+        print(table[-1])
+        if value >= target:
+            break
+    # 所有rank都达不到目标时保留最大的rank，用finetune补回精度
+    save_path = candidate.save(lowrank_path(config.load_model_path))
+
+    # ======================================== Accuracy Drift and Latency ========================================
+    test_metrics = {'original': evaluate(model, test_dataloader, device), 'lowrank': evaluate(candidate, test_dataloader, device)}
+    inputs = example_inputs(config.arch, batch_size=config.batch_size)
+    model.cpu(), candidate.cpu()
+    report = {'arch': config.arch, 'checkpoint': config.load_model_path, 'lowrank': save_path,
+              'val_' + metric: baseline, 'target': target, 'ranks': table, 'rank': table[-1]['rank'], 'test': test_metrics,
+              'original_params_M': count_params(model), 'lowrank_params_M': count_params(candidate),
+              'original_size_MB': round(os.path.getsize(config.load_model_path) / 2 ** 20, 2),
+              'lowrank_size_MB': round(os.path.getsize(save_path) / 2 ** 20, 2),
+              'original_cpu_latency': measure_latency(model, inputs), 'lowrank_cpu_latency': measure_latency(candidate, inputs)}
+    write_json(file=os.path.splitext(save_path)[0] + '_report.json', content=report)
+
+    for k, v in report.items():
+        print(k + ':', v)
+
+
+def run_iter_train(checkpoint):
+    """
+    用原有的iter_train对压缩后的checkpoint做少量迭代的微调，
+    BasicModule.load会根据checkpoint恢复低秩 / 剪枝后的结构
+
+    :return: 验证集上最好的模型的路径，与iter_train的保存路径一致
+    """
+    config.load_model_path = checkpoint
+    config.max_iter = config.finetune_iters
+    config.save_model_dir = config.save_model_dir if config.save_model_dir else config.arch
+    if not config.save_model_name:
+        config.save_model_name = os.path.basename(os.path.splitext(checkpoint)[0]) + '_ft.pth'
+    script = {1: 'basic', 2: 'pairwise', 3: 'context'}[get_spec(config.arch).num_inputs]
+    importlib.import_module(script).iter_train()
+    return os.path.join('checkpoints', config.save_model_dir, config.save_model_name[:-4], config.save_model_name)
+
+
+def finetune(**kwargs):
+    config.parse(kwargs)
+    run_iter_train(config.load_model_path)
+
+
+def prune(**kwargs):
+    config.parse(kwargs)
+    device = 'cuda' if config.use_gpu else 'cpu'
+    metric = 'AUC' if config.num_classes == 2 else 'mAP'
+    checkpoint = config.load_model_path
+
+    # ============================================= Prepare Data =============================================
+    val_dataloader = build_dataloader(config.val_paths)
+
+    # ============================================= Prepare Model ============================================
+    model = build_model(config.arch, num_classes=config.num_classes)
+    model.load(checkpoint, map_location='cpu')
+    model.eval()
+    if not prunable(model):
+        raise ValueError(f'{config.arch} has no residual block to prune')
+    inputs = example_inputs(config.arch, batch_size=config.batch_size)
+
+    def record(ratio, model, path):
+        return {'ratio': ratio, 'checkpoint': path, 'params_M': count_params(model),
+                'cpu_ms_per_image': measure_latency(model.cpu(), inputs)['per_image_ms'],
+                'val_' + metric: evaluate(model.to(device), val_dataloader, device)[metric]}
+
+    # ============================================= Prune and Finetune ============================================
+    table = [record(0, model, checkpoint)]
+    for ratio in config.prune_ratios:
+        pruned = prune_channels(model, ratio)
+        path = pruned.save(pruned_path(checkpoint, ratio))
+        table.append(record(ratio, pruned, path))
+        print(table[-1])
+
+        if config.finetune_iters:
+            config.save_model_name = None
+            path = run_iter_train(path)
+            pruned = build_model(config.arch, num_classes=config.num_classes)
+            pruned.load(path, map_location='cpu')
+            table.append(record(ratio, pruned.eval(), path))
+            print(table[-1])
+
+    # ======================================= Pareto Front: Latency vs AUC/mAP ===================================
+    key = 'val_' + metric
+    for row in table:
+        row['pareto'] = not any(other['cpu_ms_per_image'] <= row['cpu_ms_per_image'] and other[key] >= row[key] and
+                                (other['cpu_ms_per_image'], other[key]) != (row['cpu_ms_per_image'], row[key])
+                                for other in table)
+    tag = ['ratio', 'checkpoint', 'params_M', 'cpu_ms_per_image', key, 'pareto']
+    table.sort(key=lambda row: row['cpu_ms_per_image'])
+    write_csv(file=os.path.splitext(checkpoint)[0] + '_pareto.csv', tag=tag, content=[[row[k] for k in tag] for row in table])
+    write_json(file=os.path.splitext(checkpoint)[0] + '_pareto.json', content={'arch': config.arch, 'table': table})
+
+    print(tag)
+    for row in table:
+        print([row[k] for k in tag])
+
+
+if __name__ == '__main__':
+    fire.Fire({
+        'quantize': quantize,
+        'freeze': freeze,
+        'lowrank': lowrank,
+        'finetune': finetune,
+        'prune': prune
+    })
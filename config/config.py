@@ -15,12 +15,78 @@ class Config(object):
     train_paths = [os.path.join(root, 'dataset/train_VB.csv'),
                    os.path.join(root, 'dataset/val_VB.csv')]
     test_paths = [os.path.join(root, 'dataset/test_VB.csv')]
+    val_paths = [os.path.join(root, 'dataset/val_VB.csv')]  # 压缩时用于选择rank / 剪枝比例
 
     save_model_dir = None
     save_model_name = None
     load_model_path = None
     result_file = None
 
+    arch = None  # 模型名，见models/zoo.py中的MODELS
+    quantized = False  # 测试时加载load_model_path对应的int8模型
+    quantize_backend = 'fbgemm'
+    use_frozen = True  # 测试时若存在load_model_path对应的冻结推理图(compress.py freeze)，优先加载
+    freeze_tolerance = 1e-3  # compress.py freeze中推理图与原模型score的最大误差，超过时报错，不保存推理图
+    calib_paths = [os.path.join(root, 'dataset/val_VB.csv')]
+    calib_batches = 20
+    lowrank_ranks = [16, 32, 64, 128, 256, 512]  # 从小到大尝试，取第一个达到目标的rank
+    target_metric = None  # 2分类为AUC，3分类为mAP；为None时取原模型的指标减去max_metric_drop
+    max_metric_drop = 0.01
+    finetune_iters = 2000  # compress.py finetune / prune的微调迭代次数
+    prune_ratios = [0.3, 0.5, 0.7]  # 剪掉的block内部通道比例
+
+    teacher_arch = 'ContextResNet18'  # distill.py的teacher，student为arch
+    teacher_path = None
+    distill_T = 4.0
+    distill_alpha = 0.7
+
+    use_cache = False  # 测试 / predict.py时从预测缓存中取已经算过的logits，只计算未命中的图
+    cache_path = 'checkpoints/prediction_cache.db'
+    cache_max_mb = 2048
+    dedup = True  # predict.py中输入相同的行只预测一次(需要在内存中保存每一行的hash)
+
+    ensemble_paths = []  # ensemble.py的各个成员的checkpoint
+    ensemble_archs = []  # 与ensemble_paths一一对应，只给一个时所有成员使用同一个模型，为空时使用arch
+    ensemble_fuse = True  # 成员结构相同时用vmap合并为一次forward，否则用线程池并行
+
+    embedding_dir = None  # embedding.py的输出目录，为None时为<load_model_path>_embedding
+    embedding_source = 'features'  # t-SNE的输入：features(倒数第二层特征) / logits
+    pca_dim = 50  # t-SNE之前PCA降到的维数
+    tsne_perplexity = 30
+
+    retrieval_nlist = None  # retrieval.py的倒排表个数，为None时约为4 * sqrt(索引大小)
+    retrieval_m = 32  # PQ子空间个数，特征维数需要能被整除
+    retrieval_exact = False  # True时对全部特征做精确检索
+    nprobe = 16  # 每个查询扫描的倒排表个数
+    rerank = 100  # 用原始特征重排序的候选个数，0为不重排序
+    top_k = 10
+
+    serve_host = '127.0.0.1'  # serve.py
+    serve_port = 8000
+    max_batch_latency_ms = 10  # 第一张图进入队列后最多等待的时间，batch大小上限为eval_batch_size
+
+    benchmark_batch_sizes = [1, 8, 32]  # benchmark.py
+    benchmark_threads = [1, 4]  # CPU线程数(torch.set_num_threads)
+    benchmark_warmup = 2
+    benchmark_repeats = 10
+    benchmark_backward = True  # 同时测量forward + backward
+    benchmark_file = 'results/benchmark.json'
+    loader_datasets = ['VB', 'Context', 'Dual', 'Collapse']  # benchmark.py loader
+    loader_workers = [0, 2, 4, 8]
+    loader_batch_sizes = [16, 32, 64]
+    loader_batches = 20  # 每组设置读多少个batch
+    loader_profile_samples = 64  # 分阶段计时读多少个样本
+    loader_benchmark_file = 'results/loader_benchmark.json'
+    synthetic_dir = None  # 合成数据的目录(benchmark.py synthetic)，绝对路径最多7级，默认在系统临时目录下
+    synthetic_patients = 32  # 病人数，每个病人synthetic_vertebrae块脊骨
+    synthetic_vertebrae = 15
+    synthetic_workers = 1  # 生成图片的进程数
+    synthetic_seed = 0
+
+    roc_bins = 10000  # val时2分类的ROC用多少格的直方图计算(与样本数无关的内存)，0为用sklearn精确计算
+    bootstrap = 1000  # 测试时bootstrap置信区间的replicate个数，0为不计算
+    bootstrap_by = 'patient'  # patient按病人重采样，vertebra按单个脊骨重采样
+
     data_balance = 'upsample'
     padding = True
     useRGB = True
@@ -28,8 +94,13 @@ class Config(object):
     num_classes = 3
 
     batch_size = 32
+    eval_batch_size = 128  # val / test时的batch_size，在inference_mode下不保存中间结果，可以比训练时大很多
+    tta = 1  # 测试时每张图的view个数(翻转 / 旋转，见utils/tta.py)，1为不做TTA
+    tta_list = [1, 2, 4, 8]  # tta.py report比较的view个数
     num_workers = 8
     print_freq = 100
+    timeline = False  # iter_train中分阶段计时(data / h2d / forward / loss / backward / optimizer / metrics / eval / checkpoint)，每print_freq次打印
+    timeline_file = None  # 不为None时保存Chrome trace(包括DataLoader worker中的各阶段)，如 results/timeline.json
     max_epoch = 100
     max_iter = 10000
     lr = 0.0001
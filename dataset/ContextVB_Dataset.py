@@ -13,6 +13,69 @@ from PIL import Image
 from tqdm import tqdm
 from utils import write_csv
 
+from .timer import StageTimer
+
+
+def load_context(image_paths, useRGB=True, padding=False, size=224, timer=None):
+    """
+    读上一块、本身、下一块脊骨并缩放到size*size。padding时上下两块先缩放到与中间一块相同的大小，再与中间一块做相同的pad
+
+    :param image_paths: (上一块, 本身, 下一块)的路径
+    :param timer: StageTimer，分别记录decode和resize的时间
+    :return: 三个PIL Image
+    """
+    last_image_path, image_path, next_image_path = image_paths
+    last_image = Image.open(last_image_path)
+    image = Image.open(image_path)
+    next_image = Image.open(next_image_path)
+    if timer is not None:  # Image.open只读文件头，计时时先解码，decode和resize分开计
+        for x in (last_image, image, next_image):
+            x.load()
+
+    last_image = Image.fromarray(np.asarray(last_image)[:, :, 0]) if not useRGB else last_image
+    image = Image.fromarray(np.asarray(image)[:, :, 0]) if not useRGB else image  # 得到的RGB图片三通道数值相等，只选择其中一个
+    next_image = Image.fromarray(np.asarray(next_image)[:, :, 0]) if not useRGB else next_image
+    if timer is not None:
+        timer.lap('decode')
+
+    if padding:  # 调整图像长边为size，以下代码出自torchvision.transforms.functional.resize
+        w, h = image.size
+        if max(w, h) == size:
+            ow, oh = w, h
+            pass
+        elif w < h:
+            ow = int(size * w / h)
+            oh = size
+            last_image = last_image.resize((ow, oh), resample=Image.BILINEAR)
+            image = image.resize((ow, oh), resample=Image.BILINEAR)
+            next_image = next_image.resize((ow, oh), resample=Image.BILINEAR)
+        else:
+            ow = size
+            oh = int(size * h / w)
+            last_image = last_image.resize((ow, oh), resample=Image.BILINEAR)
+            image = image.resize((ow, oh), resample=Image.BILINEAR)
+            next_image = next_image.resize((ow, oh), resample=Image.BILINEAR)
+
+        # 将短边补齐到size
+        last_image = functional.pad(last_image, fill=0, padding_mode='constant',
+                                    padding=((size - ow) // 2, (size - oh) // 2,
+                                             (size - ow) - (size - ow) // 2, (size - oh) - (size - oh) // 2))
+
+        image = functional.pad(image, fill=0, padding_mode='constant',
+                               padding=((size - ow) // 2, (size - oh) // 2,
+                                        (size - ow) - (size - ow) // 2, (size - oh) - (size - oh) // 2))
+
+        next_image = functional.pad(next_image, fill=0, padding_mode='constant',
+                                    padding=((size - ow) // 2, (size - oh) // 2,
+                                             (size - ow) - (size - ow) // 2, (size - oh) - (size - oh) // 2))
+    else:  # resize到size*size
+        last_image = functional.resize(last_image, (size, size))
+        image = functional.resize(image, (size, size))
+        next_image = functional.resize(next_image, (size, size))
+    if timer is not None:
+        timer.lap('resize')
+    return last_image, image, next_image
+
 
 class ContextVB_Dataset(object):
     def __init__(self, csv_path, phase, num_classes, useRGB=True, usetrans=True, padding=False, balance='upsample'):
@@ -25,6 +88,7 @@ class ContextVB_Dataset(object):
         self.balance = balance
         self.padding = padding
         self.scale = []
+        self.timer = StageTimer()  # 分阶段计时，benchmark.py loader中打开
 
         self.images, self.labels = self.prepare_data()
 
@@ -40,49 +104,9 @@ class ContextVB_Dataset(object):
         # next_image_path = next_image_path.replace('/DB/rhome/bllai/Data/DATA3/Vertebrae/Sagittal',  # for ai-research server
         #                                           '/mnt/lustre/ai-vision/home/yz891/bllai/Data/Vertebrae_Collapse')
 
-        last_image = Image.open(last_image_path)
-        image = Image.open(image_path)
-        next_image = Image.open(next_image_path)
-
-        last_image = Image.fromarray(np.asarray(last_image)[:, :, 0]) if not self.useRGB else last_image
-        image = Image.fromarray(np.asarray(image)[:, :, 0]) if not self.useRGB else image  # 得到的RGB图片三通道数值相等，只选择其中一个
-        next_image = Image.fromarray(np.asarray(next_image)[:, :, 0]) if not self.useRGB else next_image
-
-        if self.padding:  # 调整图像长边为224，以下代码出自torchvision.transforms.functional.resize
-            size = 224
-            w, h = image.size
-            if max(w, h) == size:
-                ow, oh = w, h
-                pass
-            elif w < h:
-                ow = int(size * w / h)
-                oh = size
-                last_image = last_image.resize((ow, oh), resample=Image.BILINEAR)
-                image = image.resize((ow, oh), resample=Image.BILINEAR)
-                next_image = next_image.resize((ow, oh), resample=Image.BILINEAR)
-            else:
-                ow = size
-                oh = int(size * h / w)
-                last_image = last_image.resize((ow, oh), resample=Image.BILINEAR)
-                image = image.resize((ow, oh), resample=Image.BILINEAR)
-                next_image = next_image.resize((ow, oh), resample=Image.BILINEAR)
-
-            # 将短边补齐到224
-            last_image = functional.pad(last_image, fill=0, padding_mode='constant',
-                                        padding=((size - ow) // 2, (size - oh) // 2,
-                                                 (size - ow) - (size - ow) // 2, (size - oh) - (size - oh) // 2))
-
-            image = functional.pad(image, fill=0, padding_mode='constant',
-                                   padding=((size - ow) // 2, (size - oh) // 2,
-                                            (size - ow) - (size - ow) // 2, (size - oh) - (size - oh) // 2))
-
-            next_image = functional.pad(next_image, fill=0, padding_mode='constant',
-                                        padding=((size - ow) // 2, (size - oh) // 2,
-                                                 (size - ow) - (size - ow) // 2, (size - oh) - (size - oh) // 2))
-        else:  # resize到224*224
-            last_image = functional.resize(last_image, (224, 224))
-            image = functional.resize(image, (224, 224))
-            next_image = functional.resize(next_image, (224, 224))
+        self.timer.start()
+        last_image, image, next_image = load_context((last_image_path, image_path, next_image_path), useRGB=self.useRGB,
+                                                     padding=self.padding, timer=self.timer)
 
         # 三块脊骨做一样的transformation
         if self.usetrans:
@@ -103,11 +127,13 @@ class ContextVB_Dataset(object):
             last_image = functional.rotate(last_image, angle)
             image = functional.rotate(image, angle)
             next_image = functional.rotate(next_image, angle)
+        self.timer.lap('augment')
 
         # Convert to Tensor
         last_image = functional.to_tensor(last_image)
         image = functional.to_tensor(image)
         next_image = functional.to_tensor(next_image)
+        self.timer.lap('to_tensor')
 
         # 三块脊骨分别做transformation
         # if self.trans:
@@ -211,6 +237,23 @@ class ContextVB_Dataset(object):
             else:
                 raise ValueError
 
+        else:  # 不做balance时同样把每块脊骨与上下相邻的脊骨组成三元组
+            contexts = []
+            for i, line in enumerate(lines):
+                path = str(line).strip().split(',')[0]
+
+                # 每个病人的第一个 / 最后一个patch，将本身作为上一块 / 下一块脊骨
+                if i == 0 or path.split('/')[10] != str(lines[i - 1]).strip().split(',')[0].split('/')[10]:
+                    context = [line, line]
+                else:
+                    context = [lines[i - 1], line]
+                if i == len(lines) - 1 or path.split('/')[10] != str(lines[i + 1]).strip().split(',')[0].split('/')[10]:
+                    context.append(line)
+                else:
+                    context.append(lines[i + 1])
+                contexts.append(context)
+            lines = contexts
+
         if self.phase == 'train':
             random.shuffle(lines)
         elif self.phase == 'val' or self.phase == 'test' or self.phase == 'test_train':
@@ -13,6 +13,8 @@ from torch.utils.data import DataLoader
 from PIL import Image
 from tqdm import tqdm
 
+from .timer import StageTimer
+
 
 class Dual_Dataset(object):
     def __init__(self, csv_path, phase, useRGB=True, usetrans=True, padding=False, balance=False):
@@ -23,6 +25,7 @@ class Dual_Dataset(object):
         self.usetrans = usetrans
         self.balance = balance
         self.padding = padding
+        self.timer = StageTimer()  # 分阶段计时，benchmark.py loader中打开
 
         self.images, self.labels = self.prepare_data()
 
@@ -54,10 +57,15 @@ class Dual_Dataset(object):
         image_path = self.images[index]
         dual_path = image_path.replace('SW_VB', 'VB_TruncDoG_1.0&0.5&0.6')
 
+        self.timer.start()
         image = Image.open(image_path)
         image = Image.fromarray(np.asarray(image)[:, :, 0]) if not self.useRGB else image  # 得到的RGB图片三通道数值相等，只选择其中一个
         dual_image = Image.open(dual_path)
         dual_image = Image.fromarray(np.asarray(dual_image)[:, :, 0]) if not self.useRGB else image  # 得到的RGB图片三通道数值相等，只选择其中一个
+        if self.timer.enabled:  # Image.open只读文件头，计时时先解码，decode和resize分开计
+            for x in (image, dual_image):
+                x.load()
+        self.timer.lap('decode')
 
         if self.padding:  # 调整图像长边为112，以下代码出自torchvision.transforms.functional.resize
             size = 112
@@ -81,6 +89,7 @@ class Dual_Dataset(object):
         else:  # resize到112*112
             image = functional.resize(image, (112, 112))
             dual_image = functional.resize(dual_image, (112, 112))
+        self.timer.lap('resize')
 
         if self.usetrans:
             if random.random() < 0.5:
@@ -92,9 +101,11 @@ class Dual_Dataset(object):
             angle = random.uniform(-30, 30)
             image = functional.rotate(image, angle, resample=False, expand=False, center=None)
             dual_image = functional.rotate(dual_image, angle, resample=PIL.Image.BILINEAR, expand=False, center=None)
+        self.timer.lap('augment')
 
         image = self.trans(image)
         dual_image = self.trans(dual_image)
+        self.timer.lap('to_tensor')
 
         label = self.labels[index]
 
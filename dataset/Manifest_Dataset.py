@@ -0,0 +1,84 @@
+# coding: utf-8
+
+import os
+
+from itertools import chain
+from torch.utils.data import IterableDataset, get_worker_info
+from torchvision.transforms import functional
+
+from .VB_Dataset import load_image
+from .ContextVB_Dataset import load_context
+
+
+def read_manifest(csv_path):
+    """
+    逐行读取csv，不把整个文件读入内存
+
+    :return: generator of (path, 原始label)，csv中没有label时为-1
+    """
+    for csv_file in csv_path:
+        with open(csv_file, 'r') as f:
+            for line in f:
+                items = line.strip().split(',')
+                if not items[0] or items[0] == 'path':  # 跳过空行和表头
+                    continue
+                yield items[0], int(items[1]) if len(items) > 1 and items[1] else -1
+
+
+def count_rows(csv_path):
+    return sum(1 for _ in read_manifest(csv_path))
+
+
+def map_label(label, num_classes):
+    """与VB_Dataset一致：2分类0/1为阴性，2/3为阳性；3分类0/1为阴性，2/3为1/2"""
+    if label < 0:
+        return label
+    if num_classes == 2:
+        return 0 if label in [0, 1] else 1
+    elif num_classes == 3:
+        return 0 if label in [0, 1] else label - 1
+    else:
+        raise ValueError
+
+
+class Manifest_Dataset(IterableDataset):
+    """
+    流式读取任意大小的csv，按行号分给DataLoader的各个worker，跳过已经预测过的行
+
+    :param csv_path: list of csv
+    :param num_inputs: 1 / 2 为单张脊骨，3 为上一块、本身、下一块(同一目录下的相邻行，与ContextVB_Dataset一致)
+    :param done: bool数组，done[row]为True的行不再读图
+    """
+    def __init__(self, csv_path, num_classes, num_inputs=1, useRGB=True, padding=False, done=None):
+        self.csv_path = csv_path
+        self.num_classes = num_classes
+        self.num_inputs = num_inputs
+        self.useRGB = useRGB
+        self.padding = padding
+        self.done = done
+
+    def rows(self):
+        """:return: generator of (path, label, (上一块, 本身, 下一块)的路径)"""
+        last, current = None, None
+        for item in chain(read_manifest(self.csv_path), [None]):
+            if current is not None:
+                path, label = current
+                patient = os.path.dirname(path)
+                # 每个病人的第一块 / 最后一块脊骨，将本身作为上一块 / 下一块
+                last_path = last[0] if last is not None and os.path.dirname(last[0]) == patient else path
+                next_path = item[0] if item is not None and os.path.dirname(item[0]) == patient else path
+                yield path, label, (last_path, path, next_path)
+            last, current = current, item
+
+    def __iter__(self):
+        worker = get_worker_info()
+        worker_id, num_workers = (worker.id, worker.num_workers) if worker is not None else (0, 1)
+
+        for row, (path, label, context) in enumerate(self.rows()):
+            if row % num_workers != worker_id or (self.done is not None and self.done[row]):
+                continue
+            if self.num_inputs == 3:  # 与ContextVB_Dataset相同，上下两块按中间一块的大小缩放后再pad
+                images = tuple(functional.to_tensor(x) for x in load_context(context, useRGB=self.useRGB, padding=self.padding))
+            else:
+                images = functional.to_tensor(load_image(path, useRGB=self.useRGB, padding=self.padding))
+            yield row, images, map_label(label, self.num_classes), path
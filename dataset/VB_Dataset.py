@@ -12,6 +12,48 @@ from torch.utils.data import DataLoader
 from PIL import Image
 from tqdm import tqdm
 
+from .timer import StageTimer
+
+
+def load_image(image_path, useRGB=True, padding=False, size=224, timer=None):
+    """
+    读图并缩放到size*size
+
+    :param useRGB: False时只取一个通道(RGB三通道数值相等)
+    :param padding: True时长边缩放到size，短边补0；False时直接resize
+    :param timer: StageTimer，分别记录decode和resize的时间
+    :return: PIL Image
+    """
+    image = Image.open(image_path)
+    if timer is not None:  # Image.open只读文件头，计时时先解码，decode和resize分开计
+        image.load()
+    image = Image.fromarray(np.asarray(image)[:, :, 0]) if not useRGB else image  # 得到的RGB图片三通道数值相等，只选择其中一个
+    if timer is not None:
+        timer.lap('decode')
+
+    if padding:  # 调整图像长边为size，以下代码出自torchvision.transforms.functional.resize
+        w, h = image.size
+        if max(w, h) == size:
+            ow, oh = w, h
+        elif w < h:
+            ow = int(size * w / h)
+            oh = size
+            image = image.resize((ow, oh), resample=Image.BILINEAR)
+        else:
+            ow = size
+            oh = int(size * h / w)
+            image = image.resize((ow, oh), resample=Image.BILINEAR)
+
+        # 将短边补齐到size
+        image = functional.pad(image, fill=0, padding_mode='constant',
+                               padding=((size - ow) // 2, (size - oh) // 2,
+                                        (size - ow) - (size - ow) // 2, (size - oh) - (size - oh) // 2))
+    else:  # resize到size*size
+        image = functional.resize(image, (size, size))
+    if timer is not None:
+        timer.lap('resize')
+    return image
+
 
 class VB_Dataset(object):
     def __init__(self, csv_path, phase, num_classes, useRGB=True, usetrans=True, padding=False, balance=False):
@@ -24,6 +66,7 @@ class VB_Dataset(object):
         self.balance = balance
         self.padding = padding
         self.scale = []
+        self.timer = StageTimer()  # 分阶段计时，benchmark.py loader中打开
 
         self.images, self.labels = self.prepare_data()
 
@@ -64,32 +107,11 @@ class VB_Dataset(object):
         # image_path = image_path.replace('SW_VBCus', 'SW_VBSoft')
         # image_path = image_path.replace('/DB/rhome/bllai/Data/DATA3/Vertebrae/Sagittal',   # for ai-research server
         #                                 '/mnt/lustre/ai-vision/home/yz891/bllai/Data/Vertebrae_Collapse')
-        image = Image.open(image_path)
-        image = Image.fromarray(np.asarray(image)[:, :, 0]) if not self.useRGB else image  # 得到的RGB图片三通道数值相等，只选择其中一个
-
-        if self.padding:  # 调整图像长边为224，以下代码出自torchvision.transforms.functional.resize
-            size = 224
-            w, h = image.size
-            if max(w, h) == size:
-                ow, oh = w, h
-                pass
-            elif w < h:
-                ow = int(size * w / h)
-                oh = size
-                image = image.resize((ow, oh), resample=Image.BILINEAR)
-            else:
-                ow = size
-                oh = int(size * h / w)
-                image = image.resize((ow, oh), resample=Image.BILINEAR)
-
-            # 将短边补齐到224
-            image = functional.pad(image, fill=0, padding_mode='constant',
-                                   padding=((size - ow) // 2, (size - oh) // 2,
-                                            (size - ow) - (size - ow) // 2, (size - oh) - (size - oh) // 2))
-        else:  # resize到224*224
-            image = functional.resize(image, (224, 224))
-
-        image = self.trans(image)
+        self.timer.start()
+        image = load_image(image_path, useRGB=self.useRGB, padding=self.padding, timer=self.timer)
+        for trans in self.trans.transforms:  # 与self.trans(image)相同，每个变换分别计时
+            image = trans(image)
+            self.timer.lap(type(trans).__name__)
 
         label = self.labels[index]
 
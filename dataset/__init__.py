@@ -1,4 +1,7 @@
 from .collapse import CollapseDataset
-from .VB_Dataset import VB_Dataset
+from .VB_Dataset import VB_Dataset, load_image
 from .Dual_Dataset import Dual_Dataset
-from .ContextVB_Dataset import ContextVB_Dataset
+from .ContextVB_Dataset import ContextVB_Dataset, load_context
+from .Manifest_Dataset import Manifest_Dataset, read_manifest, count_rows, map_label
+from .timer import StageTimer
+from .synthetic import make_synthetic
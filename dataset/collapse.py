@@ -12,6 +12,8 @@ from torch.utils.data import DataLoader
 from PIL import Image
 from tqdm import tqdm
 
+from .timer import StageTimer
+
 
 class CollapseDataset(object):
     def __init__(self, csv_path, phase, useRGB=True, usetrans=True, balance=False):
@@ -21,6 +23,7 @@ class CollapseDataset(object):
         self.useRGB = useRGB
         self.usetrans = usetrans
         self.balance = balance
+        self.timer = StageTimer()  # 分阶段计时，benchmark.py loader中打开
 
         self.images, self.labels = self.prepare_data()
 
@@ -57,9 +60,15 @@ class CollapseDataset(object):
 
     def __getitem__(self, index):
         image_path = self.images[index]
+        self.timer.start()
         image = Image.open(image_path)
+        if self.timer.enabled:  # Image.open只读文件头，计时时先解码，decode和之后的变换分开计
+            image.load()
         image = Image.fromarray(np.asarray(image)[:, :, 0]) if not self.useRGB else image  # 得到的RGB图片三通道数值相等，只选择其中一个
-        image = self.trans(image)
+        self.timer.lap('decode')
+        for trans in self.trans.transforms:  # 与self.trans(image)相同，每个变换分别计时
+            image = trans(image)
+            self.timer.lap(type(trans).__name__)
 
         label = self.labels[index]
 
@@ -0,0 +1,153 @@
+# coding: utf-8
+
+import os
+import json
+import multiprocessing
+import numpy as np
+
+from PIL import Image, ImageFilter
+
+VB_DIR = 'SW_VB'  # 单块脊骨
+DUAL_DIR = 'VB_TruncDoG_1.0&0.5&0.6'  # Dual_Dataset把路径中的SW_VB换成这个目录读第二张图
+SPINE_DIR = 'Resized_PNG'  # 整条脊柱，CollapseDataset
+PATIENT_DEPTH = 10  # ContextVB_Dataset用path.split('/')[10]区分病人，与真实数据一样为 .../SW_VB/<组>/<病人>/VB{i}_{label}.png
+SPLITS = ['train', 'val', 'test']
+GROUP_SIZE = 1000  # 每个组目录下的病人数，病人很多时避免一个目录下有太多子目录
+
+
+def vertebra(rng, height, width, label):
+    """
+    一块灰度的合成脊骨：皮质骨为亮的边缘，松质骨较暗，上下为椎间盘。
+    label越大椎体越扁，前缘(左侧)比后缘压缩得更多(楔形变)
+
+    :return: uint8, (height, width)
+    """
+    y, x = np.mgrid[:height, :width] / np.array([height, width]).reshape(2, 1, 1)
+    squash = 1 - 0.15 * label
+    wedge = 1 - 0.1 * label * (1 - x)  # 前缘高度
+    half = 0.38 * squash * wedge
+    body = (np.abs(x - 0.5) <= 0.42) & (np.abs(y - 0.5) <= half)
+    rim = body & ((np.abs(x - 0.5) > 0.36) | (np.abs(y - 0.5) > half - 0.06))
+    image = rng.normal(50, 15, size=(height, width)) + 70 * body + 60 * rim
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def truncated_dog(gray, sigma1=1.0, sigma2=0.5, truncate=0.6):
+    """VB_TruncDoG_1.0&0.5&0.6的近似：两个高斯模糊之差的绝对值，在最大值的truncate处截断后拉伸到0~255"""
+    image = Image.fromarray(gray)
+    dog = np.abs(np.asarray(image.filter(ImageFilter.GaussianBlur(sigma2)), dtype=np.float32) -
+                 np.asarray(image.filter(ImageFilter.GaussianBlur(sigma1)), dtype=np.float32))
+    limit = max(truncate * float(dog.max()), 1e-6)
+    return (255 * np.minimum(dog, limit) / limit).astype(np.uint8)
+
+
+def spine(rng, patches, size):
+    """把一个病人的脊骨从上到下排成一张size * size的矢状位整条脊柱图"""
+    canvas = rng.normal(30, 10, size=(size, size))
+    scale = 0.9 * size / sum(p.shape[0] * 1.25 for p in patches)  # 每块之间留0.25倍高度的椎间隙
+    top = 0.05 * size
+    for i, patch in enumerate(patches):
+        height, width = max(int(patch.shape[0] * scale), 1), max(int(patch.shape[1] * scale), 1)
+        left = int(size / 2 - width / 2 + 0.08 * size * np.sin(np.pi * i / len(patches)))  # 生理弯曲
+        canvas[int(top):int(top) + height, left:left + width] = np.asarray(Image.fromarray(patch).resize((width, height)))
+        top += 1.25 * height
+    return np.clip(canvas, 0, 255).astype(np.uint8)
+
+
+def save_gray(path, gray):
+    """保存为三通道数值相等的RGB图，与真实数据相同"""
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    Image.fromarray(np.stack([gray] * 3, axis=2)).save(path)
+
+
+def make_patient(job):
+    """
+    生成一个病人的所有图片，随机数只由(seed, 病人序号)决定，与进程数无关
+
+    :param job: (root, padding, patient, split, vertebrae, min_size, max_size, spine_size, seed)
+    :return: split, [(脊骨路径, label)], (整条脊柱路径, label)
+    """
+    root, padding, patient, split, vertebrae, min_size, max_size, spine_size, seed = job
+    rng = np.random.RandomState([seed, patient])
+    directory = os.path.join(f'Group_{patient // GROUP_SIZE:04d}', f'{1000000 + patient:07d}')
+
+    rows, patches = [], []
+    for v in range(vertebrae):
+        # 前4块依次为0~3，小数据集的每个split也包含所有label；其余按真实数据中大多数正常的比例
+        label = v if v < 4 else int(rng.choice(4, p=[0.7, 0.15, 0.1, 0.05]))
+        width = rng.randint(min_size, max_size + 1)
+        aspect = np.clip(rng.normal(1.35, 0.15), 1.0, 1.9) * (1 + 0.12 * label)  # 宽 / 高，压缩越严重越扁
+        height = max(int(width / aspect), 8)
+        gray = vertebra(rng, height, width, label)
+        path = os.path.join(root, *padding, VB_DIR, directory, f'VB{v}_{label}.png')
+        save_gray(path, gray)
+        save_gray(path.replace(VB_DIR, DUAL_DIR), truncated_dog(gray))
+        rows.append((path, label))
+        patches.append(gray)
+
+    spine_path = os.path.join(root, *padding, SPINE_DIR, directory + '.png')
+    save_gray(spine_path, spine(rng, patches, spine_size))
+    return split, rows, (spine_path, max(label for _, label in rows))  # 整条脊柱的label为最严重的一块
+
+
+def make_synthetic(root, num_patients=8, vertebrae=15, min_size=64, max_size=160, spine_size=512,
+                   splits=(0.7, 0.15, 0.15), workers=1, seed=0):
+    """
+    生成与真实数据目录结构相同的合成数据集，不需要真实图片就可以跑训练 / dataloader / benchmark：
+    <root>/.../SW_VB/<组>/<病人>/VB{i}_{label}.png，同名的VB_TruncDoG_1.0&0.5&0.6/...(DoG图)，
+    以及整条脊柱 Resized_PNG/<组>/<病人>.png，图片均为三通道数值相等的RGB图。
+    按病人划分train / val / test，写出与dataset/中同名的{split}_VBOri.csv(脊骨)和{split}_single.csv(整条脊柱)。
+    结果只由参数决定；参数相同且已经生成过时直接返回
+
+    :param root: 输出目录，绝对路径最多7级(如/data/vb_synthetic)，下面补齐目录使病人目录位于第PATIENT_DEPTH级
+    :param vertebrae: 每个病人的脊骨数，至少为4
+    :param min_size: 脊骨图宽度的范围，高度由随机的长宽比得到
+    :param splits: train / val / test的病人比例
+    :param workers: 进程数，百万级的图片时使用多个进程
+    :return: {'train_VBOri': csv路径, ..., 'test_single': csv路径}
+    """
+    if vertebrae < 4:
+        raise ValueError(f'vertebrae must be at least 4, got {vertebrae}')
+    root = os.path.abspath(root)
+    depth = len(root.split('/'))
+    if depth > PATIENT_DEPTH - 2:
+        raise ValueError(f'{root} is too deep, patient directories must be at level {PATIENT_DEPTH}')
+    padding = [f'd{i}' for i in range(PATIENT_DEPTH - 2 - depth)]
+
+    csvs = {f'{split}_{kind}': os.path.join(root, f'{split}_{kind}.csv') for kind in ['VBOri', 'single'] for split in SPLITS}
+    params = {'num_patients': num_patients, 'vertebrae': vertebrae, 'min_size': min_size, 'max_size': max_size,
+              'spine_size': spine_size, 'splits': list(splits), 'seed': seed}
+    manifest = os.path.join(root, 'synthetic.json')
+    if os.path.exists(manifest) and all(os.path.exists(path) for path in csvs.values()):
+        with open(manifest) as f:
+            if json.load(f) == params:
+                return csvs
+
+    if os.path.exists(manifest):  # 中途中断时不会误用不完整的数据
+        os.remove(manifest)
+    if not os.path.exists(root):
+        os.makedirs(root)
+    # 按比例随机划分病人，每个split的人数固定
+    ends = np.round(np.cumsum(splits) / sum(splits) * num_patients).astype(int)
+    split_of = np.searchsorted(ends, np.random.RandomState(seed).permutation(num_patients), side='right')
+    jobs = ((root, padding, p, SPLITS[split_of[p]], vertebrae, min_size, max_size, spine_size, seed)
+            for p in range(num_patients))
+    files = {name: open(path, 'w') for name, path in csvs.items()}
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        # imap保持病人的顺序，同一个病人的脊骨在csv中相邻，ContextVB_Dataset据此找上下相邻的脊骨
+        for split, rows, (spine_path, spine_label) in (pool.imap(make_patient, jobs, chunksize=16) if pool else
+                                                        map(make_patient, jobs)):
+            files[f'{split}_VBOri'].writelines(f'{path},{label}\n' for path, label in rows)
+            files[f'{split}_single'].write(f'{spine_path},{spine_label}\n')
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        for f in files.values():
+            f.close()
+
+    with open(manifest, 'w') as f:
+        json.dump(params, f)
+    return csvs
@@ -0,0 +1,54 @@
+# coding: utf-8
+
+import os
+import json
+import time
+
+
+class StageTimer(object):
+    """
+    __getitem__中分阶段计时：start()之后每次lap(name)把距离上一次start / lap的时间记到name上。
+    默认关闭，关闭时start / lap只判断一次enabled；DataLoader的每个worker各有一份dataset，各自计时
+
+    :param enabled: 是否计时
+    """
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.last = 0.
+        self.stats = {}  # 阶段名 -> [次数, 总秒数]，按第一次出现的顺序
+        self.trace_file = None
+
+    def trace(self, path, name):
+        """
+        把之后的每个阶段作为Chrome trace的事件逐行写入path(jsonl)，由utils.Timeline.save合并。
+        每行立即写入文件，DataLoader的worker退出时不会丢失
+
+        :param name: 在trace中显示的线程名，如 loader worker 0
+        """
+        self.enabled = True
+        self.trace_file = open(path, 'a', buffering=1)
+        self.trace_file.write(json.dumps({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': 1,
+                                          'args': {'name': name}}) + '\n')
+
+    def start(self):
+        if self.enabled:
+            self.last = time.perf_counter()
+
+    def lap(self, name):
+        if self.enabled:
+            now = time.perf_counter()
+            stat = self.stats.setdefault(name, [0, 0.])
+            stat[0] += 1
+            stat[1] += now - self.last
+            if self.trace_file is not None:  # 与Timeline相同，时间戳为perf_counter的微秒数，各进程一致
+                self.trace_file.write(json.dumps({'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': 1,
+                                                  'ts': round(self.last * 1e6, 1),
+                                                  'dur': round((now - self.last) * 1e6, 1)}) + '\n')
+            self.last = now
+
+    def reset(self):
+        self.stats = {}
+
+    def summary(self):
+        """:return: {阶段名: 每次的平均毫秒数}"""
+        return {name: round(1000 * total / count, 4) for name, (count, total) in self.stats.items()}
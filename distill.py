@@ -0,0 +1,144 @@
+# coding: utf-8
+
+import os
+import fire
+import torch
+import numpy as np
+
+from tqdm import tqdm
+from torch.utils.data import DataLoader
+
+from config import config
+from dataset import VB_Dataset
+from models import get_spec, build_model, adapt_inputs, adapt_path, unpack_score
+from models import DistillationLoss
+from utils import write_json
+from compress import build_dataloader, evaluate
+
+
+def logits_path(csv_file, teacher_path):
+    """teacher的logits与数据的csv放在一起，每个teacher一份"""
+    return f'{os.path.splitext(csv_file)[0]}_{os.path.splitext(os.path.basename(teacher_path))[0]}_logits.npz'
+
+
+def load_logits(csv_files, teacher_path):
+    """
+    :return: {image_path: logits}，有csv没有算过或teacher更新过时返回None
+    """
+    logits = {}
+    for csv_file in csv_files:
+        path = logits_path(csv_file, teacher_path)
+        if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(teacher_path):
+            return None
+        data = np.load(path)
+        logits.update(zip(data['paths'].tolist(), data['logits']))
+    return logits
+
+
+def teacher_logits(**kwargs):
+    """用冻结的teacher对train_paths中的每个patch算一次logits，蒸馏时不再运行teacher"""
+    config.parse(kwargs)
+    device = 'cuda' if config.use_gpu else 'cpu'
+
+    teacher = build_model(config.teacher_arch, num_classes=config.num_classes)
+    teacher.load(config.teacher_path, map_location='cpu')
+    teacher.to(device).eval()
+
+    for csv_file in config.train_paths:
+        logits = {}
+        with torch.no_grad():
+            for image, label, image_path in tqdm(build_dataloader([csv_file], arch=config.teacher_arch), desc=csv_file):
+                score = unpack_score(teacher(*[x.to(device) for x in adapt_inputs(config.teacher_arch, image)]))
+                logits.update(zip(adapt_path(image_path), score.cpu().numpy()))  # upsample重复的patch只保留一份
+
+        path = logits_path(csv_file, config.teacher_path)
+        np.savez(path, paths=np.array(list(logits.keys())), logits=np.stack(list(logits.values())))
+        print('Teacher logits ' + path + ' has been saved!')
+
+
+def train(**kwargs):
+    from torchnet import meter  # 只有训练时用到
+    config.parse(kwargs)
+    device = 'cuda' if config.use_gpu else 'cpu'
+    metric = 'AUC' if config.num_classes == 2 else 'mAP'
+
+    # ============================================ Teacher Logits ============================================
+    logits = load_logits(config.train_paths, config.teacher_path)
+    if logits is None:
+        teacher_logits()
+        logits = load_logits(config.train_paths, config.teacher_path)
+
+    # ============================================= Prepare Data =============================================
+    spec = get_spec(config.arch)
+    train_data = VB_Dataset(config.train_paths, phase='train', num_classes=config.num_classes, useRGB=spec.channels == 3,
+                            usetrans=config.usetrans, padding=config.padding, balance=config.data_balance)
+    train_dataloader = DataLoader(train_data, batch_size=config.batch_size, shuffle=True, num_workers=config.num_workers)
+    val_dataloader = build_dataloader(config.test_paths)  # 与iter_train一致，用test_paths验证
+    print('Training Images:', train_data.__len__(), 'Teacher Logits:', len(logits))
+
+    # ============================================= Prepare Model ============================================
+    model = build_model(config.arch, num_classes=config.num_classes)
+    if config.load_model_path:
+        model.load(config.load_model_path, map_location='cpu')
+    model.to(device)
+
+    criterion = DistillationLoss(T=config.distill_T, alpha=config.distill_alpha)
+    optimizer = torch.optim.Adam(model.parameters(), lr=config.lr, weight_decay=config.weight_decay)
+    loss_meter = meter.AverageValueMeter()
+
+    # ====================================== Saving and Recording Configuration =================================
+    save_model_dir = config.save_model_dir if config.save_model_dir else model.model_name
+    save_model_name = config.save_model_name if config.save_model_name else \
+        f'{model.model_name}_from_{config.teacher_arch}_best_model.pth'
+    save_dir = os.path.join('checkpoints', save_model_dir, save_model_name[:-4])
+    previous, save_iter = 0, 1
+    process_record = {'loss': [], 'val_' + metric: []}
+
+    # ================================================== Training ===============================================
+    iteration = 0
+    train_iter = iter(train_dataloader)
+    model.train()
+    while iteration < config.max_iter:
+        try:
+            image, label, image_path = next(train_iter)
+        except StopIteration:
+            train_iter = iter(train_dataloader)
+            image, label, image_path = next(train_iter)
+        iteration += 1
+
+        teacher_score = torch.from_numpy(np.stack([logits[path] for path in image_path])).to(device)
+        score = model(*[x.to(device) for x in adapt_inputs(config.arch, image)])
+
+        optimizer.zero_grad()
+        loss = criterion(score, teacher_score, label.to(device))
+        loss.backward()
+        optimizer.step()
+        loss_meter.add(loss.item())
+
+        if iteration % config.print_freq == 0:
+            model.eval()
+            value = evaluate(model, val_dataloader, device)[metric]
+            model.train()
+
+            if value > previous:  # 验证集上的指标升高时保存模型
+                if not os.path.exists(save_dir):
+                    os.makedirs(save_dir)
+                model.save(os.path.join(save_dir, save_model_name))
+                previous, save_iter = value, iteration
+
+            process_record['loss'].append(loss_meter.value()[0])
+            process_record['val_' + metric].append(value)
+            tqdm.write(f"iter: [{iteration}/{config.max_iter}] loss: {round(loss_meter.value()[0], 5)} "
+                       f"val_{metric}: {value} best: {previous}")
+            loss_meter.reset()
+
+    if os.path.exists(save_dir):
+        write_json(file=os.path.join(save_dir, 'process_record.json'), content=process_record)
+    print("Best Iter:", save_iter)
+
+
+if __name__ == '__main__':
+    fire.Fire({
+        'teacher_logits': teacher_logits,
+        'train': train
+    })
@@ -0,0 +1,159 @@
+# coding: utf-8
+
+import os
+import csv
+import json
+import hashlib
+import fire
+import torch
+import numpy as np
+
+from tqdm import tqdm
+from torch.utils.data import DataLoader, Subset
+
+from config import config
+from models import model_head, load_inference_model, adapt_inputs, unpack_score
+from utils import unique_samples, write_csv, write_json
+from utils.evaluate import center_item
+from compress import build_dataloader
+
+COLORS = np.array(['springgreen', 'mediumblue', 'red'])
+
+
+def embedding_dir():
+    path = config.embedding_dir if config.embedding_dir else os.path.splitext(config.load_model_path)[0] + '_embedding'
+    if not os.path.exists(path):
+        os.makedirs(path)
+    return path
+
+
+def read_labels(path):
+    """:return: 路径, label, 重复次数(upsample后的倍数)"""
+    with open(os.path.join(path, 'labels.csv'), newline='') as f:
+        rows = list(csv.DictReader(f))
+    return [r['path'] for r in rows], np.array([int(r['label']) for r in rows]), np.array([int(r['weight']) for r in rows])
+
+
+def feature_hook(model):
+    """
+    在分类层上挂forward pre-hook，每次forward之后captured[0]为倒数第二层特征
+
+    :return: handle, captured
+    """
+    captured = []
+
+    def hook(module, inputs):
+        if not captured:  # PC模型一次forward调用两次分类层，第一次对应分类score
+            captured.append(inputs[0].detach().flatten(1))
+    return model.get_submodule(model_head(model)).register_forward_pre_hook(hook), captured
+
+
+def export(*csv_paths, **kwargs):
+    """
+    导出倒数第二层特征和logits，保存为<dir>/features.npy、logits.npy(可以用np.load(mmap_mode='r')读取)，
+    以及labels.csv(path,label,weight)。upsample重复的样本只保存一份，weight为重复次数
+
+    python embedding.py export [train.csv ...] --arch=ResNet18 --load_model_path=xxx.pth
+    :param csv_paths: 默认为config.test_paths
+    """
+    config.parse(kwargs)
+    device = 'cuda' if config.use_gpu else 'cpu'
+    model = load_inference_model(config.arch, config.load_model_path, config.num_classes, device=device,
+                                 use_frozen=False)  # 冻结的推理图无法挂hook
+    handle, captured = feature_hook(model)
+
+    dataset = build_dataloader(list(csv_paths) if csv_paths else config.test_paths).dataset
+    unique, _, weights = unique_samples(dataset.images)
+    dataloader = DataLoader(Subset(dataset, unique), batch_size=config.eval_batch_size, shuffle=False,
+                            num_workers=config.num_workers, pin_memory=device == 'cuda')
+
+    path = embedding_dir()
+    features, logits, start = None, None, 0
+    with torch.inference_mode():
+        for image, label, image_path in tqdm(dataloader):
+            captured.clear()
+            image = tuple(x.to(device) for x in image) if isinstance(image, (tuple, list)) else image.to(device)
+            score = unpack_score(model(*adapt_inputs(config.arch, image))).float().cpu().numpy()
+            feature = captured[0].float().cpu().numpy()
+            if features is None:  # 第一个batch之后才知道特征维度
+                features = np.lib.format.open_memmap(os.path.join(path, 'features.npy'), mode='w+', dtype=np.float32,
+                                                     shape=(len(unique), feature.shape[1]))
+                logits = np.lib.format.open_memmap(os.path.join(path, 'logits.npy'), mode='w+', dtype=np.float32,
+                                                   shape=(len(unique), score.shape[1]))
+            features[start:start + len(score)] = feature
+            logits[start:start + len(score)] = score
+            start += len(score)
+    handle.remove()
+    features.flush()
+    logits.flush()
+
+    write_csv(os.path.join(path, 'labels.csv'), tag=['path', 'label', 'weight'],
+              content=[(center_item(dataset.images[i]), center_item(dataset.labels[i]), w) for i, w in zip(unique, weights)])
+    write_json(os.path.join(path, 'meta.json'), {'arch': config.arch, 'checkpoint': config.load_model_path,
+                                                 'head': model_head(model)})
+    print('Embedding ' + path + ' has been saved!')
+
+
+def project(**kwargs):
+    """
+    对export得到的features / logits做PCA降维后t-SNE，结果按(输入文件, 参数)缓存为<dir>/tsne_<hash>.npy，
+    参数和输入不变时直接读取缓存
+
+    python embedding.py project --load_model_path=xxx.pth [--embedding_source=logits]
+    :return: 缓存文件的路径
+    """
+    from sklearn.decomposition import PCA  # 只在计算t-SNE时才import
+    from sklearn.manifold import TSNE
+    config.parse(kwargs)
+    path = embedding_dir()
+    source = os.path.join(path, config.embedding_source + '.npy')
+    stat = os.stat(source)
+    params = {'source': config.embedding_source, 'pca_dim': config.pca_dim, 'perplexity': config.tsne_perplexity,
+              'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+    cached = os.path.join(path, 'tsne_' + hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12] + '.npy')
+    if os.path.exists(cached):
+        print('Projection ' + cached + ' is cached!')
+        return cached
+
+    X = np.asarray(np.load(source, mmap_mode='r'), dtype=np.float32)
+    if X.shape[1] > config.pca_dim:  # 先用PCA降到pca_dim维，t-SNE的距离计算只在低维上进行
+        X = PCA(n_components=min(config.pca_dim, len(X)), random_state=0).fit_transform(X)
+    Y = TSNE(n_components=2, init='pca', random_state=0, perplexity=min(config.tsne_perplexity, len(X) - 1),
+             n_jobs=config.num_workers).fit_transform(X)
+    np.save(cached, Y.astype(np.float32))
+    print('Projection ' + cached + ' has been saved!')
+    return cached
+
+
+def plot(point_size=20, alpha=1.0, weighted=False, **kwargs):
+    """
+    画出project的结果，只调整画图参数时不重新计算t-SNE
+
+    python embedding.py plot --load_model_path=xxx.pth [--point_size=10 --weighted=True]
+    :param weighted: 点的大小乘以upsample的重复次数
+    """
+    import matplotlib  # 只在画图时才import，export / retrieval不需要
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from matplotlib.ticker import NullFormatter
+    Y = np.load(project(**kwargs))
+    path = embedding_dir()
+    _, labels, weights = read_labels(path)
+
+    fig = plt.figure(figsize=(8, 8))
+    ax = fig.add_subplot(1, 1, 1)
+    plt.scatter(Y[:, 0], Y[:, 1], c=COLORS[labels], s=point_size * weights if weighted else point_size, alpha=alpha)
+    ax.xaxis.set_major_formatter(NullFormatter())  # 设置标签显示格式为空
+    ax.yaxis.set_major_formatter(NullFormatter())
+    save_path = os.path.join(path, f'tsne_{config.embedding_source}.png')
+    plt.savefig(save_path)
+    plt.close(fig)
+    print('Figure ' + save_path + ' has been saved!')
+
+
+if __name__ == '__main__':
+    fire.Fire({
+        'export': export,
+        'project': project,
+        'plot': plot
+    })
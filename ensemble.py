@@ -0,0 +1,117 @@
+# coding: utf-8
+
+import os
+import copy
+import fire
+import torch
+
+from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
+from torch.func import stack_module_state, functional_call
+
+from config import config
+from models import get_spec, load_inference_model, adapt_inputs, unpack_score
+from models.BasicModule import BasicModule
+from utils import Predictions, roc_2class, mean_ap, mean_auc, confusion_metrics, write_csv, write_json
+from utils.evaluate import center
+from compress import build_dataloader
+
+
+def member_inputs(arch, image):
+    """Context模型的数据中，非Context的成员只使用中间一块脊骨"""
+    if isinstance(image, (tuple, list)) and get_spec(arch).num_inputs != 3:
+        image = image[1]
+    return adapt_inputs(arch, image)
+
+
+def fuse_members(models):
+    """
+    结构相同的成员把参数堆叠起来，用vmap一次算完所有成员
+
+    :return: fn(*inputs) -> (成员数, N, num_classes)
+    """
+    params, buffers = stack_module_state(models)
+    base = copy.deepcopy(models[0]).to('meta')
+
+    def call(params, buffers, *inputs):
+        return unpack_score(functional_call(base, (params, buffers), inputs))
+
+    def forward(*inputs):
+        return torch.vmap(call, in_dims=(0, 0) + (None,) * len(inputs))(params, buffers, *inputs)
+    return forward
+
+
+def metrics(predictions):
+    result = {'accuracy': round(float(confusion_metrics(predictions.cm)[0]), 4)}
+    if predictions.num_classes == 2:
+        result['AUC'] = round(float(roc_2class(predictions)[3]), 4)
+    else:
+        result['mAP'] = round(float(mean_ap(predictions)), 4)
+        result['mAUC'] = round(float(mean_auc(predictions)), 4)
+    return result
+
+
+def test(**kwargs):
+    """
+    多个checkpoint的集成测试，每个batch只读一次图，所有成员并行forward，一次得到每个成员和集成后的指标
+
+    python ensemble.py test --ensemble_archs=[AlexNet] --ensemble_paths=[AlexNet_1.pth,AlexNet_2.pth,...]
+    """
+    config.parse(kwargs)
+    archs = config.ensemble_archs if len(config.ensemble_archs) == len(config.ensemble_paths) else \
+        [config.ensemble_archs[0] if config.ensemble_archs else config.arch] * len(config.ensemble_paths)
+    device = 'cuda' if config.use_gpu and not config.quantized else 'cpu'
+
+    # ============================================= Prepare Model ============================================
+    models = [load_inference_model(arch, path, config.num_classes, device=device, quantized=config.quantized,
+                                   backend=config.quantize_backend, use_frozen=config.use_frozen)
+              for arch, path in zip(archs, config.ensemble_paths)]
+    fused = None
+    if config.ensemble_fuse and len(set(archs)) == 1 and all(isinstance(m, BasicModule) for m in models):
+        fused = fuse_members(models)
+
+    # ============================================= Prepare Data =============================================
+    # 有Context成员时用ContextVB_Dataset，其余成员取中间一块脊骨
+    context = [arch for arch in archs if get_spec(arch).num_inputs == 3]
+    dataloader = build_dataloader(config.test_paths, arch=context[0] if context else archs[0])
+    dataloader = torch.utils.data.DataLoader(dataloader.dataset, batch_size=config.eval_batch_size, shuffle=False,
+                                             num_workers=config.num_workers, pin_memory=device == 'cuda')
+    num_samples = len(dataloader.dataset)
+    members = [Predictions(num_samples, config.num_classes) for _ in models]
+    ensemble = Predictions(num_samples, config.num_classes)
+
+    # ================================================== Test ================================================
+    def forward(i, image):
+        with torch.inference_mode():  # inference_mode只对当前线程生效
+            return unpack_score(models[i](*[x.to(device) for x in member_inputs(archs[i], image)]))
+
+    with torch.inference_mode(), ThreadPoolExecutor(len(models)) as executor:
+        for image, label, image_path in tqdm(dataloader):
+            if fused is not None:
+                scores = list(fused(*[x.to(device) for x in member_inputs(archs[0], image)]))
+            else:
+                scores = list(executor.map(lambda i: forward(i, image), range(len(models))))
+
+            label, image_path = center(label), center(image_path)
+            probs = torch.stack([torch.softmax(score.float(), dim=1) for score in scores])
+            for predictions, score in zip(members, scores):
+                predictions.add(score.float().cpu(), label)
+            ensemble.add(probs.mean(0).log().cpu(), label, image_path)  # softmax之后即为平均概率
+
+    # ============================================ Save and Print ============================================
+    rows = [dict({'member': os.path.basename(path)}, **metrics(predictions))
+            for path, predictions in zip(config.ensemble_paths, members)]
+    rows.append(dict({'member': 'ensemble'}, **metrics(ensemble)))
+    for row in rows:
+        print(row)
+
+    save_path = os.path.splitext(config.result_file)[0] if config.result_file else \
+        os.path.splitext(config.ensemble_paths[0])[0] + '_ensemble'
+    write_csv(file=save_path + '.csv', tag=list(rows[0].keys()), content=[list(row.values()) for row in rows])
+    write_json(file=save_path + '.json', content=rows)
+
+
+if __name__ == '__main__':
+    fire.Fire({
+        'test': test
+    })
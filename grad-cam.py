@@ -1,63 +1,21 @@
 # coding: utf-8
 import os
 import argparse
+import multiprocessing
 
-import cv2
 import numpy as np
 import torch
 
 from torch.nn import functional, Sequential
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, Subset
 from torch.autograd import Variable, Function
 from torchvision import models, utils, transforms
-from torchnet import meter
 from PIL import Image
 from tqdm import tqdm
 
-from dataset import VB_Dataset, Dual_Dataset
-from models import Vgg16, ResNet18, ShallowVgg
-
-
-class FeatureExtractor:
-    """ Class for extracting activations and
-    registering gradients from targetted intermediate layers """
-    def __init__(self, model, target_layers):
-        self.model = model
-        self.target_layers = target_layers
-        self.gradients = []
-
-    def save_gradient(self, grad):
-        self.gradients.append(grad)
-
-    def __call__(self, x):
-        outputs = []
-        self.gradients = []
-        for name, module in self.model._modules.items():
-            x = module(x)
-            if name in self.target_layers:
-                x.register_hook(self.save_gradient)
-                outputs += [x]
-        return outputs, x
-
-
-class ModelOutputs:
-    """ Class for making a forward pass, and getting:
-    1. The network output.
-    2. Activations from intermeddiate targetted layers.
-    3. Gradients from intermeddiate targetted layers. """
-    def __init__(self, model, target_layers):
-        self.model = model
-        self.feature_extractor = FeatureExtractor(self.model.features, target_layers)
-        # self.feature_extractor = FeatureExtractor(self.model.layer4, target_layers)
-
-    def get_gradients(self):
-        return self.feature_extractor.gradients
-
-    def __call__(self, x):
-        target_activations, output = self.feature_extractor(x)
-        output = output.view(output.size(0), -1)
-        output = self.model.classifier(output)
-        return target_activations, output
+from dataset import VB_Dataset, Dual_Dataset, ContextVB_Dataset, load_image
+from models import build_model, get_spec, adapt_inputs, adapt_label, adapt_path
+from utils import GradCAM, CAMWriter, CAMArchive, unique_samples
 
 
 def preprocess_image(img):
@@ -76,6 +34,7 @@ def preprocess_image(img):
 
 
 def show_cam_on_image(img, mask, save_name):
+    import cv2  # 只在渲染叠加图时才import
     heatmap = cv2.applyColorMap(np.uint8(255*mask), cv2.COLORMAP_JET)
     heatmap = np.float32(heatmap) / 255
     cam = heatmap + np.float32(img)
@@ -83,59 +42,6 @@ def show_cam_on_image(img, mask, save_name):
     cv2.imwrite(save_name, np.uint8(255 * cam))
 
 
-class GradCam:
-    def __init__(self, model, target_layer_names, use_cuda):
-        self.model = model
-        self.model.eval()
-        self.cuda = use_cuda
-        if self.cuda:
-            self.model = model.cuda()
-
-        self.extractor = ModelOutputs(self.model, target_layer_names)
-
-    def forward(self, input):
-        return self.model(input)
-
-    def __call__(self, input, index=None):
-        if self.cuda:
-            features, output = self.extractor(input.cuda())
-        else:
-            features, output = self.extractor(input)
-
-        if not index:
-            index = np.argmax(output.cpu().data.numpy())
-
-        one_hot = np.zeros((1, output.size()[-1]), dtype=np.float32)
-        one_hot[0][index] = 1
-        one_hot = Variable(torch.from_numpy(one_hot), requires_grad=True)
-        if self.cuda:
-            one_hot = torch.sum(one_hot.cuda() * output)
-        else:
-            one_hot = torch.sum(one_hot * output)
-
-        self.model.features.zero_grad()
-        self.model.classifier.zero_grad()
-        one_hot.backward(retain_graph=True)
-
-        # print(self.extractor.get_gradients())
-        grads_val = self.extractor.get_gradients()[-1].cpu().data.numpy()
-
-        target = features[-1]
-        target = target.cpu().data.numpy()[0, :]
-
-        weights = np.mean(grads_val, axis=(2, 3))[0, :]
-        cam = np.zeros(target.shape[1:], dtype=np.float32)
-
-        for i, w in enumerate(weights):
-            cam += w * target[i, :, :]
-
-        cam = np.maximum(cam, 0)
-        cam = cv2.resize(cam, (224, 224))
-        cam = cam - np.min(cam)
-        cam = cam / np.max(cam)
-        return cam
-
-
 class GuidedBackpropReLU(Function):
 
     def forward(self, input):
@@ -203,6 +109,17 @@ def get_args():
     parser.add_argument('--use-cuda', action='store_true', default=False, help='Use NVIDIA GPU acceleration')
     parser.add_argument('--image-path', type=str, default='csv', help='Input image path')
     parser.add_argument('--model-path', type=str, help='Load model path')
+    parser.add_argument('--model', type=str, default='ResNet18', help='Model name in models.MODELS')
+    parser.add_argument('--num-classes', type=int, default=3)
+    parser.add_argument('--layer', type=str, nargs='+', default=['layer4'], help='Target layer names')
+    parser.add_argument('--target-index', type=int, default=1, help='Target class, -1 for the predicted class')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--num-workers', type=int, default=4)
+    parser.add_argument('--archive', type=str, default=None, help='CAM archive directory, default results/cam/<checkpoint>_CAM_<target>')
+    parser.add_argument('--chunk-size', type=int, default=256, help='Images per compressed chunk in the archive')
+    parser.add_argument('--render', action='store_true', default=False, help='Render overlay PNGs from the archive')
+    parser.add_argument('--render-dir', type=str, default=None, help='Output directory of rendered PNGs, default <archive>_png')
+    parser.add_argument('--pattern', type=str, default='', help='Only render images whose path contains this string')
     args = parser.parse_args()
     args.use_cuda = args.use_cuda and torch.cuda.is_available()
     if args.use_cuda:
@@ -213,102 +130,157 @@ def get_args():
     return args
 
 
-if __name__ == '__main__':
-    """ python grad_cam.py <path_to_image>
-    1. Loads an image with opencv.
-    2. Preprocesses it for VGG19 and converts to a pytorch variable.
-    3. Makes a forward pass to find the category index with the highest score,
-    and computes intermediate activations.
-    Makes the visualization. """
-
-    args = get_args()
+def to_bgr(image):
+    """dataset给出的(3, H, W) Tensor转换为cv2使用的(H, W, 3) BGR图，数值在[0, 1]"""
+    return np.ascontiguousarray(image.permute(1, 2, 0).numpy()[:, :, ::-1])
+
+
+def branch_cams(cams, num_inputs):
+    """
+    将GradCAM的结果展开为(后缀, 输入序号, CAM)：共享层的第k次调用对应第k个输入，
+    各分支独立的层按名字的后缀(如layer2_1)对应输入，其余对应中间一块脊骨
+    """
+    total = sum(len(v) for v in cams.values())
+    for name, calls in cams.items():
+        for k, cam in enumerate(calls):
+            if len(calls) > 1:
+                index, suffix = k, f'_{name}_{k + 1}'
+            else:
+                tail = name.rsplit('_', 1)[-1]
+                index = int(tail) - 1 if tail.isdigit() and 0 < int(tail) <= num_inputs else num_inputs // 2
+                suffix = f'_{name}'
+            yield suffix if total > 1 else '', min(index, num_inputs - 1), cam
+
+
+def render_chunk(job):
+    """在子进程中渲染一个chunk：chunk只解压一次，读原图叠加CAM后保存为PNG"""
+    archive_path, chunk, paths, render_dir = job
+    archive = CAMArchive(archive_path)
+    cams = archive.load(chunk)
+    for path in paths:
+        row = archive.index[path]
+        prob = row['prob'].split()
+        save_path = os.path.join(render_dir, os.path.basename(os.path.dirname(path)))
+        os.makedirs(save_path, exist_ok=True)
+        cam_save_name = os.path.basename(path)[:-5] + row['label'] + '_' + row['predict'] + '_' + prob[min(1, len(prob) - 1)]
+        for name, input_path, mask in zip(archive.meta['names'], row['inputs'].split('|'), cams[int(row['offset'])]):
+            image = load_image(input_path, useRGB=True, padding=archive.meta['padding'], size=mask.shape[-1])
+            img = np.float32(image.convert('RGB'))[:, :, ::-1] / 255
+            show_cam_on_image(img, mask.astype(np.float32), os.path.join(save_path, cam_save_name + name + '.png'))
+    return len(paths)
+
+
+def render(archive_path, render_dir, pattern='', num_workers=4):
+    """按需从CAM archive渲染叠加图，各chunk在多个进程中并行"""
+    archive = CAMArchive(archive_path)
+    jobs = [(archive_path, chunk, [p for p in paths if pattern in p], render_dir)
+            for chunk, paths in sorted(archive.chunks().items())]
+    jobs = [job for job in jobs if job[2]]
+    with multiprocessing.Pool(max(num_workers, 1)) as pool, tqdm(total=sum(len(job[2]) for job in jobs)) as bar:
+        for n in pool.imap_unordered(render_chunk, jobs):
+            bar.update(n)
 
-    # Can work with any model, but it assumes that the model has a feature method, and a classifier method,
-    # as in the VGG models in torchvision.
 
-    # model = Vgg16(num_classes=2)
-    model = ResNet18(num_classes=3)
-    # model = ShallowVgg(num_classes=2)
-    model.load(args.model_path)
-    model.addfeatures()
-    model.eval()
+if __name__ == '__main__':
+    """ python grad-cam.py --model-path=xxx.pth [--image-path=<path_to_image>]
+    1. 按batch读入图片，在目标层上挂hook记录forward的输出
+    2. 一次forward得到score，对每张图选中类别的logit求和后一次backward得到目标层的梯度
+    3. 在Tensor上按batch计算CAM并插值到输入大小，以float16压缩保存到CAM archive
+    4. python grad-cam.py --render --archive=xxx [--pattern=xxx] 按需并行渲染叠加图 """
 
-    grad_cam = GradCam(model=model, target_layer_names=["7"], use_cuda=args.use_cuda)  # for resnet
-    # grad_cam = GradCam(model=model, target_layer_names=["23"], use_cuda=args.use_cuda)
-    # grad_cam = GradCam(model=model, target_layer_names=["16"], use_cuda=args.use_cuda)
+    args = get_args()
+    device = 'cuda' if args.use_cuda else 'cpu'
+    archive_path = args.archive if args.archive else \
+        os.path.join('results', 'cam', os.path.basename(str(args.model_path))[:-4] + f'_CAM_{args.target_index}')
+
+    if args.render:
+        render(archive_path, args.render_dir if args.render_dir else archive_path.rstrip('/') + '_png',
+               pattern=args.pattern, num_workers=args.num_workers)
+        raise SystemExit
+
+    # 冻结的推理图无法挂hook，这里始终从checkpoint建立模型；score与CAM来自同一次forward
+    model = build_model(args.model, num_classes=args.num_classes)
+    model.load(args.model_path, map_location='cpu')
+    model.to(device).eval()
+    for param in model.parameters():
+        param.requires_grad = False  # 只需要中间层的梯度
+
+    grad_cam = GradCAM(model, args.layer)
+    target_index = None if args.target_index < 0 else args.target_index  # None时对预测的类别计算CAM
+    num_inputs = get_spec(args.model).num_inputs
 
     if args.image_path == 'csv':  # 可以直接输入包含多张图片的csv文件
         root = '/DB/rhome/bllai/PyTorchProjects/Vertebrae_Collapse'
         test_paths = [os.path.join(root, 'dataset/test_VB.csv')]
-        test_data = VB_Dataset(test_paths, num_classes=3, phase='test', useRGB=True, usetrans=True, padding=True, balance='upsample')
-        test_dataloader = DataLoader(test_data, batch_size=1, shuffle=False, num_workers=4)
-
-        test_cm = meter.ConfusionMeter(3)
+        Dataset = ContextVB_Dataset if num_inputs == 3 else VB_Dataset  # Context模型需要相邻的三块脊骨
+        # 不做随机augmentation，也不upsample，每张图片只forward一次
+        test_data = Dataset(test_paths, num_classes=args.num_classes, phase='test', useRGB=True, usetrans=False, padding=True, balance=False)
+        # 中断后重新运行时，archive中已有的图片不再读取和forward
+        archived = CAMArchive(archive_path).index if os.path.exists(os.path.join(archive_path, 'index.csv')) else {}
+        centre = [x[1] if num_inputs == 3 else x for x in test_data.images]
+        pending = [i for i, path in enumerate(centre) if path not in archived]
+        print(f'{len(centre) - len(pending)} images already in the archive, {len(pending)} to compute')
+        test_dataloader = DataLoader(Subset(test_data, pending), batch_size=args.batch_size, shuffle=False, num_workers=args.num_workers)
+        # CAM只对每张图片计算一次，指标按upsample后的重复次数加权，与balance后的测试集一致
+        balanced = Dataset(test_paths, num_classes=args.num_classes, phase='test', useRGB=True, usetrans=False, padding=True, balance='upsample')
+        unique, _, weights = unique_samples(balanced.images)
+        repeats = {balanced.images[i][1] if num_inputs == 3 else balanced.images[i]: w for i, w in zip(unique, weights)}
+
+        from torchnet import meter  # 只有csv时用到
+        test_cm = meter.ConfusionMeter(args.num_classes)
         test_mAP = meter.mAPMeter()
         softmax = functional.softmax
 
+        def add_balanced(prob, label, paths):
+            counts = torch.tensor([repeats.get(path, 1) for path in paths])
+            prob, label = prob.repeat_interleave(counts, dim=0), label.repeat_interleave(counts, dim=0)
+            test_cm.add(prob, label)
+            test_mAP.add(prob, torch.zeros(label.size(0), args.num_classes).scatter_(1, label.unsqueeze(1), 1))
+
+        done = [path for path in centre if path in archived]
+        if done:  # 已有图片的label和概率从index.csv取出，指标仍覆盖整个csv
+            rows = [archived[path] for path in done]
+            prob = torch.tensor([[float(p) for p in row['prob'].split()] for row in rows])
+            add_balanced(prob, torch.tensor([int(row['label']) for row in rows]), done)
+        writer = None
         for image, label, image_path in tqdm(test_dataloader):
-            image.requires_grad = True
-
-            if args.use_cuda:
-                model.cuda()
-                image = image.cuda()
-
-            score = model(image)
-
-            prob = softmax(score, dim=1).detach().cpu().numpy()[0]
-            one_hot = torch.zeros(label.size(0), 3).scatter_(1, label.data.cpu().unsqueeze(1), 1)
-            test_cm.add(softmax(score, dim=1).data, label.data)
-            test_mAP.add(softmax(score, dim=1).data, one_hot)
-
-            # If None, returns the map for the highest scoring category. Otherwise, targets the requested index.
-            # target_index = None
-            target_index = 1
-
-            image_path = image_path[0]
-            img = cv2.imread(image_path, 1)  # 这一步重新读入图片是为了将CAM图画在原图上
-            # img = np.float32(cv2.resize(img, (224, 224))) / 255
-
-            img_split_path = image_path.split('/')
-            cam_save_path = '/'.join([*img_split_path[:8], 'CAM_Collapse', model.model_name,
-                                      f'CAM_{target_index}_' + args.model_path.split('/')[-1][:-4] + '-' + img_split_path[8], *img_split_path[9:11]])
-
-            if not os.path.exists(cam_save_path):
-                os.makedirs(cam_save_path)
-            cam_save_name = img_split_path[-1][:-5] + str(label.numpy()[0]) + '_' + str(int(np.argmax(prob))) + '_' + str(round(prob[1], 4)) + '.png'
-
-            if not os.path.exists(os.path.join(cam_save_path, cam_save_name)):
-                mask = grad_cam(image, target_index)  # 考虑到upsample有重复的图片，为了节省时间，重复的图片不计算CAM
-                show_cam_on_image(img, mask, os.path.join(cam_save_path, cam_save_name))
-
-        print('mAP:', test_mAP.value().numpy())
+            images = adapt_inputs(args.model, image)
+            score, cams = grad_cam(tuple(x.to(device) for x in images), target_index)  # 一次forward得到所有分支的CAM
+            branch_paths = image_path if num_inputs == 3 else [image_path] * num_inputs
+            label, image_path = adapt_label(label), adapt_path(image_path)
+
+            prob = softmax(score, dim=1).cpu()
+            add_balanced(prob, label, image_path)
+
+            suffixes, indices, masks = zip(*branch_cams(cams, num_inputs))
+            masks = torch.stack(masks, dim=1).half().cpu().numpy()  # (N, K, H, W)
+            if writer is None:
+                writer = CAMWriter(archive_path, names=suffixes, chunk_size=args.chunk_size, model=args.model,
+                                   checkpoint=args.model_path, layers=args.layer, target=target_index, padding=True)
+            for i, path in enumerate(image_path):
+                writer.add(path, masks[i], label[i], prob[i].numpy(), inputs=[branch_paths[k][i] for k in indices])
+        if writer is not None:
+            writer.close()
+        print('CAM archive:', archive_path)
+        print('balanced mAP:', test_mAP.value().numpy())
 
     else:
-        # img = cv2.imread(args.image_path, 1)
-        # img = np.float32(cv2.resize(img, (224, 224))) / 255
         img = Image.open(args.image_path)
         save_name = '_'.join(args.image_path.split('/')[-2:])
         if not os.path.exists(os.path.join('results', 'cam')):
             os.makedirs(os.path.join('results', 'cam'))
         img.save(os.path.join('results', 'cam', save_name))
-        input = preprocess_image(img)
-
-        model.eval()
-        if args.use_cuda:
-            model.cuda()
-            input = input.cuda()
-        softmax = functional.softmax
-        print(softmax(model(input), dim=1).data)
-
-        # If None, returns the map for the highest scoring category.
-        # Otherwise, targets the requested index.
-        target_index = None
 
-        mask = grad_cam(input, target_index)
+        spec = get_spec(args.model)
+        image = transforms.ToTensor()(load_image(args.image_path, useRGB=spec.channels == 3, size=spec.size))
+        images = adapt_inputs(args.model, [image.unsqueeze(0)] * num_inputs)  # 单张图时各分支输入同一张图
+        score, cams = grad_cam(tuple(x.to(device) for x in images), target_index)
+        print(functional.softmax(score, dim=1))
 
-        img = cv2.imread(args.image_path, 1)
-        img = np.float32(cv2.resize(img, (112, 112))) / 255
-        show_cam_on_image(img, mask, save_name)
+        img = to_bgr(image.expand(3, -1, -1))
+        name, ext = os.path.splitext(save_name)
+        for suffix, index, cam in branch_cams(cams, num_inputs):
+            show_cam_on_image(img, cam[0].cpu().numpy(), name + suffix + ext)
 
         # gb_model = GuidedBackpropReLUModel(model=model, use_cuda=args.use_cuda)
         # gb = gb_model(input, index=target_index)
@@ -0,0 +1,60 @@
+# coding: utf-8
+
+import sys
+import fire
+import subprocess
+
+ENTRY_POINTS = ['basic', 'context', 'pairwise', 'triplewise', 'predict', 'compress', 'ensemble', 'tta', 'distill',
+                'embedding', 'retrieval', 'serve', 'grad-cam', 'benchmark']
+HEAVY = ['sklearn', 'matplotlib', 'visdom', 'torchnet', 'ipdb', 'cv2']  # 只应该在用到的子命令中import
+
+
+def import_times(module):
+    """
+    在新的进程中用python -X importtime import一个模块
+
+    :return: {模块名: 累计耗时(ms)}
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'__import__("{module}")'],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f'import {module} failed:\n{result.stderr[-2000:]}')
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')  # 自身耗时(us) | 累计耗时(us) | 模块名
+        times[name.strip()] = int(cumulative) / 1000
+    return times
+
+
+def check(*modules, budget_ms=4000, top=10):
+    """
+    检查命令行入口的import耗时，超过budget_ms或import了HEAVY中的库时返回非0
+
+    python import_time.py check [basic context ...] [--budget_ms=4000]
+    :param modules: 默认为ENTRY_POINTS
+    :param top: 打印累计耗时最多的几个第三方库
+    """
+    failed = []
+    for module in modules if modules else ENTRY_POINTS:
+        times = import_times(module)
+        total = times[module]
+        heavy = [name for name in HEAVY if name in times]
+        libraries = sorted([(t, name) for name, t in times.items() if '.' not in name and name != module], reverse=True)
+        print(f'{module}: {total:.0f} ms', ', '.join(f'{name} {t:.0f} ms' for t, name in libraries[:top]))
+        if total > budget_ms:
+            failed.append(f'{module} takes {total:.0f} ms > {budget_ms} ms')
+        if heavy:
+            failed.append(f'{module} imports {", ".join(heavy)} at startup')
+    for message in failed:
+        print('FAILED:', message)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    fire.Fire({
+        'check': check,
+        'times': import_times
+    })
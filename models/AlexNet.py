@@ -3,7 +3,7 @@
 import torch
 from torch import nn
 
-from .pretrained import alexnet, alexnet_pre
+from . import pretrained
 from .BasicModule import BasicModule
 
 
@@ -11,18 +11,18 @@ class AlexNet(BasicModule):
     def __init__(self, num_classes):
         super(AlexNet, self).__init__()
 
-        self.conv1 = alexnet.features[0:3]
-        self.conv2 = alexnet.features[3:6]
-        self.conv3 = alexnet.features[6:8]
-        self.conv4 = alexnet.features[8:10]
-        self.conv5 = alexnet.features[10:13]
-
-        self.dropout1 = alexnet.classifier[0]
-        self.fc1 = alexnet.classifier[1]
-        self.relu1 = alexnet.classifier[2]
-        self.dropout2 = alexnet.classifier[3]
-        self.fc2 = alexnet.classifier[4]
-        self.relu2 = alexnet.classifier[5]
+        self.conv1 = pretrained.alexnet.features[0:3]
+        self.conv2 = pretrained.alexnet.features[3:6]
+        self.conv3 = pretrained.alexnet.features[6:8]
+        self.conv4 = pretrained.alexnet.features[8:10]
+        self.conv5 = pretrained.alexnet.features[10:13]
+
+        self.dropout1 = pretrained.alexnet.classifier[0]
+        self.fc1 = pretrained.alexnet.classifier[1]
+        self.relu1 = pretrained.alexnet.classifier[2]
+        self.dropout2 = pretrained.alexnet.classifier[3]
+        self.fc2 = pretrained.alexnet.classifier[4]
+        self.relu2 = pretrained.alexnet.classifier[5]
         self.fc3 = nn.Linear(in_features=4096, out_features=num_classes, bias=True)
 
     def forward(self, x):
@@ -1,5 +1,6 @@
 # coding: utf-8
 
+import copy
 import torch
 
 
@@ -8,10 +9,43 @@ class BasicModule(torch.nn.Module):
         super(BasicModule, self).__init__()
         self.model_name = self.__class__.__name__
 
-    def load(self, path):
-        self.load_state_dict(torch.load(path))
+    def load(self, path, map_location=None):
+        """加载之前先复制pretrained.py中的共享层，加载的权重不会写入之后build的其它模型(teacher / student、ensemble)"""
+        state_dict = torch.load(path, map_location=map_location)
+        self._unshare()
+        own = self.state_dict()
+        if any(k not in own or own[k].shape != v.shape for k, v in state_dict.items()):
+            # compress.py lowrank / prune得到的checkpoint，结构与原模型不同，需要先重建对应的层
+            from .lowrank import factorize, lowrank_ranks
+            from .pruning import match_channels
+            ranks = lowrank_ranks(state_dict)
+            if ranks:
+                factorize(self, ranks)
+            match_channels(self, state_dict)
+        self.load_state_dict(state_dict)
+
+    def _unshare(self):
+        """各模型的层直接取自models/pretrained.py中的全局网络，修改结构之前先复制一份，模型内部的共享关系保持不变"""
+        memo = {}
+        for name, child in list(self.named_children()):
+            setattr(self, name, copy.deepcopy(child, memo))
 
     def save(self, name):
         torch.save(self.state_dict(), name)
         print('Model ' + name + ' has been saved!')
         return name
+
+    def freeze(self, example_inputs):
+        """
+        生成只用于推理的计算图：BN折叠进前面的conv(被多次调用的共享层不折叠)，去掉dropout，trace之后freeze
+
+        :param example_inputs: tuple of Tensor，与forward的输入一致
+        :return: torch.jit.ScriptModule，不改变self
+        """
+        from torch.fx.experimental.optimization import remove_dropout  # 只在compress.py freeze时才import torch.fx
+        from .freeze import fuse_conv_bn
+
+        model = remove_dropout(fuse_conv_bn(self))
+        with torch.no_grad():
+            traced = torch.jit.trace(model, example_inputs)
+        return torch.jit.freeze(traced)
@@ -4,7 +4,7 @@ import copy
 import torch
 from torch import nn
 
-from .pretrained import alexnet, alexnet_pre
+from . import pretrained
 from .BasicModule import BasicModule
 
 
@@ -12,25 +12,25 @@ class ContextAlexNet(BasicModule):
     def __init__(self, num_classes):
         super(ContextAlexNet, self).__init__()
 
-        self.conv1_1 = alexnet.features[0:3]
+        self.conv1_1 = pretrained.alexnet.features[0:3]
         self.conv1_2 = copy.deepcopy(self.conv1_1)
         self.conv1_3 = copy.deepcopy(self.conv1_1)
-        self.conv2_1 = alexnet.features[3:6]
+        self.conv2_1 = pretrained.alexnet.features[3:6]
         self.conv2_2 = copy.deepcopy(self.conv2_1)
         self.conv2_3 = copy.deepcopy(self.conv2_1)
-        self.conv3_1 = alexnet.features[6:8]
+        self.conv3_1 = pretrained.alexnet.features[6:8]
         self.conv3_2 = copy.deepcopy(self.conv3_1)
         self.conv3_3 = copy.deepcopy(self.conv3_1)
 
-        self.conv4 = alexnet.features[8:10]
-        self.conv5 = alexnet.features[10:13]
+        self.conv4 = pretrained.alexnet.features[8:10]
+        self.conv5 = pretrained.alexnet.features[10:13]
 
-        self.dropout1 = alexnet.classifier[0]
-        self.fc1 = alexnet.classifier[1]
-        self.relu1 = alexnet.classifier[2]
-        self.dropout2 = alexnet.classifier[3]
-        self.fc2 = alexnet.classifier[4]
-        self.relu2 = alexnet.classifier[5]
+        self.dropout1 = pretrained.alexnet.classifier[0]
+        self.fc1 = pretrained.alexnet.classifier[1]
+        self.relu1 = pretrained.alexnet.classifier[2]
+        self.dropout2 = pretrained.alexnet.classifier[3]
+        self.fc2 = pretrained.alexnet.classifier[4]
+        self.relu2 = pretrained.alexnet.classifier[5]
         self.fc3 = nn.Linear(in_features=4096, out_features=num_classes, bias=True)
 
         # for two MSE loss
@@ -6,7 +6,7 @@ import torch
 from torch import nn
 from torch.nn import functional
 
-from .pretrained import resnet18, resnet18_pre, resnet34, resnet34_pre, resnet50, resnet50_pre
+from . import pretrained
 from .BasicModule import BasicModule
 
 
@@ -15,25 +15,25 @@ class ContextResNet18(BasicModule):
         super(ContextResNet18, self).__init__()
 
         # train from scratch
-        self.conv1_1 = resnet18.conv1
-        self.bn1_1 = resnet18.bn1
+        self.conv1_1 = pretrained.resnet18.conv1
+        self.bn1_1 = pretrained.resnet18.bn1
 
-        self.conv1_2 = copy.deepcopy(resnet18.conv1)
-        self.bn1_2 = copy.deepcopy(resnet18.bn1)
+        self.conv1_2 = copy.deepcopy(pretrained.resnet18.conv1)
+        self.bn1_2 = copy.deepcopy(pretrained.resnet18.bn1)
 
-        self.conv1_3 = copy.deepcopy(resnet18.conv1)
-        self.bn1_3 = copy.deepcopy(resnet18.bn1)
+        self.conv1_3 = copy.deepcopy(pretrained.resnet18.conv1)
+        self.bn1_3 = copy.deepcopy(pretrained.resnet18.bn1)
 
-        self.relu = resnet18.relu
-        self.maxpool = resnet18.maxpool
+        self.relu = pretrained.resnet18.relu
+        self.maxpool = pretrained.resnet18.maxpool
 
-        self.layer1_1 = resnet18.layer1
-        self.layer1_2 = copy.deepcopy(resnet18.layer1)
-        self.layer1_3 = copy.deepcopy(resnet18.layer1)
+        self.layer1_1 = pretrained.resnet18.layer1
+        self.layer1_2 = copy.deepcopy(pretrained.resnet18.layer1)
+        self.layer1_3 = copy.deepcopy(pretrained.resnet18.layer1)
 
-        self.layer2_1 = resnet18.layer2
-        self.layer2_2 = copy.deepcopy(resnet18.layer2)
-        self.layer2_3 = copy.deepcopy(resnet18.layer2)
+        self.layer2_1 = pretrained.resnet18.layer2
+        self.layer2_2 = copy.deepcopy(pretrained.resnet18.layer2)
+        self.layer2_3 = copy.deepcopy(pretrained.resnet18.layer2)
 
         # for concat
         # self.conv = nn.Conv2d(128 * 3, 128, kernel_size=3, stride=1, padding=1)
@@ -52,8 +52,8 @@ class ContextResNet18(BasicModule):
         # self.dfc1 = nn.Linear(1024, 1)
         # self.dfc2 = nn.Linear(1024, 1)
 
-        self.layer3 = resnet18.layer3
-        self.layer4 = resnet18.layer4
+        self.layer3 = pretrained.resnet18.layer3
+        self.layer4 = pretrained.resnet18.layer4
 
         # self.layer3_1 = resnet18.layer3
         # self.layer3_2 = copy.deepcopy(resnet18.layer3)
@@ -62,7 +62,7 @@ class ContextResNet18(BasicModule):
         # self.layer4_2 = copy.deepcopy(resnet18.layer4)
         # self.layer4_3 = copy.deepcopy(resnet18.layer4)
 
-        self.avgpool = resnet18.avgpool
+        self.avgpool = pretrained.resnet18.avgpool
         self.fc = nn.Linear(512, num_classes)
 
         for m in self.modules():
@@ -169,25 +169,25 @@ class ContextShareNet(BasicModule):
         super(ContextShareNet, self).__init__()
 
         # train from scratch
-        self.conv1_1 = resnet18.conv1
-        self.bn1_1 = resnet18.bn1
+        self.conv1_1 = pretrained.resnet18.conv1
+        self.bn1_1 = pretrained.resnet18.bn1
 
-        self.conv1_2 = resnet18.conv1
-        self.bn1_2 = resnet18.bn1
+        self.conv1_2 = pretrained.resnet18.conv1
+        self.bn1_2 = pretrained.resnet18.bn1
 
-        self.conv1_3 = resnet18.conv1
-        self.bn1_3 = resnet18.bn1
+        self.conv1_3 = pretrained.resnet18.conv1
+        self.bn1_3 = pretrained.resnet18.bn1
 
-        self.relu = resnet18.relu
-        self.maxpool = resnet18.maxpool
+        self.relu = pretrained.resnet18.relu
+        self.maxpool = pretrained.resnet18.maxpool
 
-        self.layer1_1 = resnet18.layer1
-        self.layer1_2 = resnet18.layer1
-        self.layer1_3 = resnet18.layer1
+        self.layer1_1 = pretrained.resnet18.layer1
+        self.layer1_2 = pretrained.resnet18.layer1
+        self.layer1_3 = pretrained.resnet18.layer1
 
-        self.layer2_1 = resnet18.layer2
-        self.layer2_2 = resnet18.layer2
-        self.layer2_3 = resnet18.layer2
+        self.layer2_1 = pretrained.resnet18.layer2
+        self.layer2_2 = pretrained.resnet18.layer2
+        self.layer2_3 = pretrained.resnet18.layer2
 
         # for concat
         # self.conv = nn.Conv2d(128 * 3, 128, kernel_size=3, stride=1, padding=1)
@@ -206,15 +206,15 @@ class ContextShareNet(BasicModule):
         # self.dfc1 = nn.Linear(1024, 1)
         # self.dfc2 = nn.Linear(1024, 1)
 
-        self.layer3 = resnet18.layer3
-        self.layer4 = resnet18.layer4
+        self.layer3 = pretrained.resnet18.layer3
+        self.layer4 = pretrained.resnet18.layer4
 
         # self.layer3_1 = copy.deepcopy(resnet18.layer3)
         # self.layer3_3 = copy.deepcopy(resnet18.layer3)
         # self.layer4_1 = copy.deepcopy(resnet18.layer4)
         # self.layer4_3 = copy.deepcopy(resnet18.layer4)
 
-        self.avgpool = resnet18.avgpool
+        self.avgpool = pretrained.resnet18.avgpool
         self.fc = nn.Linear(512, num_classes)
 
         for m in self.modules():
@@ -322,25 +322,25 @@ class ContextResNet50(BasicModule):
         super(ContextResNet50, self).__init__()
 
         # train from scratch
-        self.conv1_1 = resnet50.conv1
-        self.bn1_1 = resnet50.bn1
+        self.conv1_1 = pretrained.resnet50.conv1
+        self.bn1_1 = pretrained.resnet50.bn1
 
-        self.conv1_2 = copy.deepcopy(resnet50.conv1)
-        self.bn1_2 = copy.deepcopy(resnet50.bn1)
+        self.conv1_2 = copy.deepcopy(pretrained.resnet50.conv1)
+        self.bn1_2 = copy.deepcopy(pretrained.resnet50.bn1)
 
-        self.conv1_3 = copy.deepcopy(resnet50.conv1)
-        self.bn1_3 = copy.deepcopy(resnet50.bn1)
+        self.conv1_3 = copy.deepcopy(pretrained.resnet50.conv1)
+        self.bn1_3 = copy.deepcopy(pretrained.resnet50.bn1)
 
-        self.relu = resnet50.relu
-        self.maxpool = resnet50.maxpool
+        self.relu = pretrained.resnet50.relu
+        self.maxpool = pretrained.resnet50.maxpool
 
-        self.layer1_1 = resnet50.layer1
-        self.layer1_2 = copy.deepcopy(resnet50.layer1)
-        self.layer1_3 = copy.deepcopy(resnet50.layer1)
+        self.layer1_1 = pretrained.resnet50.layer1
+        self.layer1_2 = copy.deepcopy(pretrained.resnet50.layer1)
+        self.layer1_3 = copy.deepcopy(pretrained.resnet50.layer1)
 
-        self.layer2_1 = resnet50.layer2
-        self.layer2_2 = copy.deepcopy(resnet50.layer2)
-        self.layer2_3 = copy.deepcopy(resnet50.layer2)
+        self.layer2_1 = pretrained.resnet50.layer2
+        self.layer2_2 = copy.deepcopy(pretrained.resnet50.layer2)
+        self.layer2_3 = copy.deepcopy(pretrained.resnet50.layer2)
 
         # for two MSE loss
         self.dconv1 = nn.Conv2d(512 * 2, 1024, kernel_size=3, stride=2, padding=1)
@@ -350,10 +350,10 @@ class ContextResNet50(BasicModule):
         self.dpool = nn.AvgPool2d(kernel_size=7, stride=1)
         self.dfc = nn.Linear(1024, 1)
 
-        self.layer3 = resnet50.layer3
-        self.layer4 = resnet50.layer4
+        self.layer3 = pretrained.resnet50.layer3
+        self.layer4 = pretrained.resnet50.layer4
 
-        self.avgpool = resnet50.avgpool
+        self.avgpool = pretrained.resnet50.avgpool
         self.fc = nn.Linear(2048, num_classes)
 
         for m in self.modules():
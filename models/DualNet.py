@@ -4,7 +4,7 @@ import math
 import torch
 from torch import nn
 
-from .pretrained import vgg16
+from . import pretrained
 from .BasicModule import BasicModule
 
 
@@ -6,7 +6,7 @@ import torch
 from torch import nn
 from torch.nn import functional
 
-from .pretrained import resnet18, resnet18_pre, resnet34, resnet34_pre, resnet50, resnet50_pre
+from . import pretrained
 from .BasicModule import BasicModule
 
 
@@ -14,26 +14,26 @@ class DualResNet18(BasicModule):
     def __init__(self, num_classes):
         super(DualResNet18, self).__init__()
 
-        self.conv1_1 = resnet18.conv1
-        self.bn1_1 = resnet18.bn1
-        self.relu_1 = resnet18.relu
-        self.maxpool_1 = resnet18.maxpool
-        self.layer1_1 = resnet18.layer1
-        self.layer2_1 = resnet18.layer2
-        self.layer3_1 = resnet18.layer3
-        self.layer4_1 = resnet18.layer4
-        self.avgpool_1 = resnet18.avgpool
+        self.conv1_1 = pretrained.resnet18.conv1
+        self.bn1_1 = pretrained.resnet18.bn1
+        self.relu_1 = pretrained.resnet18.relu
+        self.maxpool_1 = pretrained.resnet18.maxpool
+        self.layer1_1 = pretrained.resnet18.layer1
+        self.layer2_1 = pretrained.resnet18.layer2
+        self.layer3_1 = pretrained.resnet18.layer3
+        self.layer4_1 = pretrained.resnet18.layer4
+        self.avgpool_1 = pretrained.resnet18.avgpool
         self.fc_1 = nn.Linear(512, num_classes)
 
-        self.conv1_2 = copy.deepcopy(resnet18.conv1)
-        self.bn1_2 = copy.deepcopy(resnet18.bn1)
-        self.relu_2 = resnet18.relu
-        self.maxpool_2 = resnet18.maxpool
-        self.layer1_2 = copy.deepcopy(resnet18.layer1)
-        self.layer2_2 = copy.deepcopy(resnet18.layer2)
-        self.layer3_2 = copy.deepcopy(resnet18.layer3)
-        self.layer4_2 = copy.deepcopy(resnet18.layer4)
-        self.avgpool_2 = resnet18.avgpool
+        self.conv1_2 = copy.deepcopy(pretrained.resnet18.conv1)
+        self.bn1_2 = copy.deepcopy(pretrained.resnet18.bn1)
+        self.relu_2 = pretrained.resnet18.relu
+        self.maxpool_2 = pretrained.resnet18.maxpool
+        self.layer1_2 = copy.deepcopy(pretrained.resnet18.layer1)
+        self.layer2_2 = copy.deepcopy(pretrained.resnet18.layer2)
+        self.layer3_2 = copy.deepcopy(pretrained.resnet18.layer3)
+        self.layer4_2 = copy.deepcopy(pretrained.resnet18.layer4)
+        self.avgpool_2 = pretrained.resnet18.avgpool
         self.fc_2 = nn.Linear(512, num_classes)
 
         self.fc_3 = nn.Linear(1024, 2)
@@ -85,26 +85,26 @@ class DualResNet50(BasicModule):
     def __init__(self, num_classes):
         super(DualResNet50, self).__init__()
 
-        self.conv1_1 = resnet50.conv1
-        self.bn1_1 = resnet50.bn1
-        self.relu_1 = resnet50.relu
-        self.maxpool_1 = resnet50.maxpool
-        self.layer1_1 = resnet50.layer1
-        self.layer2_1 = resnet50.layer2
-        self.layer3_1 = resnet50.layer3
-        self.layer4_1 = resnet50.layer4
-        self.avgpool_1 = resnet50.avgpool
+        self.conv1_1 = pretrained.resnet50.conv1
+        self.bn1_1 = pretrained.resnet50.bn1
+        self.relu_1 = pretrained.resnet50.relu
+        self.maxpool_1 = pretrained.resnet50.maxpool
+        self.layer1_1 = pretrained.resnet50.layer1
+        self.layer2_1 = pretrained.resnet50.layer2
+        self.layer3_1 = pretrained.resnet50.layer3
+        self.layer4_1 = pretrained.resnet50.layer4
+        self.avgpool_1 = pretrained.resnet50.avgpool
         self.fc_1 = nn.Linear(2048, num_classes)
 
-        self.conv1_2 = copy.deepcopy(resnet50.conv1)
-        self.bn1_2 = copy.deepcopy(resnet50.bn1)
-        self.relu_2 = resnet50.relu
-        self.maxpool_2 = resnet50.maxpool
-        self.layer1_2 = copy.deepcopy(resnet50.layer1)
-        self.layer2_2 = copy.deepcopy(resnet50.layer2)
-        self.layer3_2 = copy.deepcopy(resnet50.layer3)
-        self.layer4_2 = copy.deepcopy(resnet50.layer4)
-        self.avgpool_2 = resnet50.avgpool
+        self.conv1_2 = copy.deepcopy(pretrained.resnet50.conv1)
+        self.bn1_2 = copy.deepcopy(pretrained.resnet50.bn1)
+        self.relu_2 = pretrained.resnet50.relu
+        self.maxpool_2 = pretrained.resnet50.maxpool
+        self.layer1_2 = copy.deepcopy(pretrained.resnet50.layer1)
+        self.layer2_2 = copy.deepcopy(pretrained.resnet50.layer2)
+        self.layer3_2 = copy.deepcopy(pretrained.resnet50.layer3)
+        self.layer4_2 = copy.deepcopy(pretrained.resnet50.layer4)
+        self.avgpool_2 = pretrained.resnet50.avgpool
         self.fc_2 = nn.Linear(2048, num_classes)
 
         self.fc_3 = nn.Linear(2048*2, 2)
@@ -4,7 +4,7 @@ import math
 import torch
 from torch import nn
 
-from .pretrained import resnet18, resnet18_pre, resnet34, resnet34_pre, resnet50, resnet50_pre
+from . import pretrained
 from .BasicModule import BasicModule
 
 
@@ -12,15 +12,15 @@ class PCResNet18(BasicModule):
     def __init__(self, num_classes):
         super(PCResNet18, self).__init__()
 
-        self.conv1 = resnet18.conv1
-        self.bn1 = resnet18.bn1
-        self.relu = resnet18.relu
-        self.maxpool = resnet18.maxpool
-        self.layer1 = resnet18.layer1
-        self.layer2 = resnet18.layer2
-        self.layer3 = resnet18.layer3
-        self.layer4 = resnet18.layer4
-        self.avgpool = resnet18.avgpool
+        self.conv1 = pretrained.resnet18.conv1
+        self.bn1 = pretrained.resnet18.bn1
+        self.relu = pretrained.resnet18.relu
+        self.maxpool = pretrained.resnet18.maxpool
+        self.layer1 = pretrained.resnet18.layer1
+        self.layer2 = pretrained.resnet18.layer2
+        self.layer3 = pretrained.resnet18.layer3
+        self.layer4 = pretrained.resnet18.layer4
+        self.avgpool = pretrained.resnet18.avgpool
         self.fc = nn.Linear(512, num_classes)
 
         for m in self.modules():
@@ -67,15 +67,15 @@ class PCResNet50(BasicModule):
     def __init__(self, num_classes):
         super(PCResNet50, self).__init__()
 
-        self.conv1 = resnet50.conv1
-        self.bn1 = resnet50.bn1
-        self.relu = resnet50.relu
-        self.maxpool = resnet50.maxpool
-        self.layer1 = resnet50.layer1
-        self.layer2 = resnet50.layer2
-        self.layer3 = resnet50.layer3
-        self.layer4 = resnet50.layer4
-        self.avgpool = resnet50.avgpool
+        self.conv1 = pretrained.resnet50.conv1
+        self.bn1 = pretrained.resnet50.bn1
+        self.relu = pretrained.resnet50.relu
+        self.maxpool = pretrained.resnet50.maxpool
+        self.layer1 = pretrained.resnet50.layer1
+        self.layer2 = pretrained.resnet50.layer2
+        self.layer3 = pretrained.resnet50.layer3
+        self.layer4 = pretrained.resnet50.layer4
+        self.avgpool = pretrained.resnet50.avgpool
         self.fc = nn.Linear(2048, num_classes)
 
         for m in self.modules():
@@ -3,7 +3,7 @@
 import torch
 from torch import nn
 
-from .pretrained import vgg16, vgg16_pre
+from . import pretrained
 from .BasicModule import BasicModule
 
 
@@ -11,18 +11,18 @@ class PCVgg16(BasicModule):
     def __init__(self, num_classes):
         super(PCVgg16, self).__init__()
 
-        self.conv1 = vgg16.features[0:5]
-        self.conv2 = vgg16.features[5:10]
-        self.conv3 = vgg16.features[10:17]
-        self.conv4 = vgg16.features[17:24]
-        self.conv5 = vgg16.features[24:31]
-
-        self.fc1 = vgg16.classifier[0]
-        self.relu1 = vgg16.classifier[1]
-        self.dropout1 = vgg16.classifier[2]
-        self.fc2 = vgg16.classifier[3]
-        self.relu2 = vgg16.classifier[4]
-        self.dropout2 = vgg16.classifier[5]
+        self.conv1 = pretrained.vgg16.features[0:5]
+        self.conv2 = pretrained.vgg16.features[5:10]
+        self.conv3 = pretrained.vgg16.features[10:17]
+        self.conv4 = pretrained.vgg16.features[17:24]
+        self.conv5 = pretrained.vgg16.features[24:31]
+
+        self.fc1 = pretrained.vgg16.classifier[0]
+        self.relu1 = pretrained.vgg16.classifier[1]
+        self.dropout1 = pretrained.vgg16.classifier[2]
+        self.fc2 = pretrained.vgg16.classifier[3]
+        self.relu2 = pretrained.vgg16.classifier[4]
+        self.dropout2 = pretrained.vgg16.classifier[5]
         self.fc3 = nn.Linear(in_features=4096, out_features=num_classes, bias=True)
 
     def forward(self, x, y):
@@ -6,7 +6,7 @@ import torch
 from torch import nn
 from torch.nn import functional
 
-from .pretrained import resnet18, resnet18_pre, resnet34, resnet34_pre, resnet50, resnet50_pre
+from . import pretrained
 from .BasicModule import BasicModule
 
 
@@ -15,15 +15,15 @@ class ResNet18(BasicModule):
         super(ResNet18, self).__init__()
 
         # train from scratch
-        self.conv1 = resnet18.conv1
-        self.bn1 = resnet18.bn1
-        self.relu = resnet18.relu
-        self.maxpool = resnet18.maxpool
-        self.layer1 = resnet18.layer1
-        self.layer2 = resnet18.layer2
-        self.layer3 = resnet18.layer3
-        self.layer4 = resnet18.layer4
-        self.avgpool = resnet18.avgpool
+        self.conv1 = pretrained.resnet18.conv1
+        self.bn1 = pretrained.resnet18.bn1
+        self.relu = pretrained.resnet18.relu
+        self.maxpool = pretrained.resnet18.maxpool
+        self.layer1 = pretrained.resnet18.layer1
+        self.layer2 = pretrained.resnet18.layer2
+        self.layer3 = pretrained.resnet18.layer3
+        self.layer4 = pretrained.resnet18.layer4
+        self.avgpool = pretrained.resnet18.avgpool
         # self.avgpool = nn.AvgPool2d(14, stride=1)
         self.fc = nn.Linear(512, num_classes)
 
@@ -76,19 +76,19 @@ class SkipResNet18(BasicModule):
         super(SkipResNet18, self).__init__()
 
         # train from scratch
-        self.conv1 = resnet18.conv1
-        self.bn1 = resnet18.bn1
-        self.relu = resnet18.relu
-        self.maxpool = resnet18.maxpool
-        self.layer1 = resnet18.layer1
-        self.layer2 = resnet18.layer2
-        self.layer3 = resnet18.layer3
-        self.layer4 = resnet18.layer4
+        self.conv1 = pretrained.resnet18.conv1
+        self.bn1 = pretrained.resnet18.bn1
+        self.relu = pretrained.resnet18.relu
+        self.maxpool = pretrained.resnet18.maxpool
+        self.layer1 = pretrained.resnet18.layer1
+        self.layer2 = pretrained.resnet18.layer2
+        self.layer3 = pretrained.resnet18.layer3
+        self.layer4 = pretrained.resnet18.layer4
 
         self.adapool = nn.AdaptiveAvgPool2d(output_size=(7, 7))
         self.adaconv = nn.Conv2d(in_channels=1024, out_channels=512, kernel_size=1, stride=1)
 
-        self.avgpool = resnet18.avgpool
+        self.avgpool = pretrained.resnet18.avgpool
         self.fc = nn.Linear(512, num_classes)
 
         for m in self.modules():
@@ -131,14 +131,14 @@ class DensResNet18(BasicModule):
         super(DensResNet18, self).__init__()
 
         # train from scratch
-        self.conv1 = resnet18.conv1
-        self.bn1 = resnet18.bn1
-        self.relu = resnet18.relu
-        self.maxpool = resnet18.maxpool
-        self.layer1 = resnet18.layer1
-        self.layer2 = resnet18.layer2
-        self.layer3 = resnet18.layer3
-        self.layer4 = resnet18.layer4
+        self.conv1 = pretrained.resnet18.conv1
+        self.bn1 = pretrained.resnet18.bn1
+        self.relu = pretrained.resnet18.relu
+        self.maxpool = pretrained.resnet18.maxpool
+        self.layer1 = pretrained.resnet18.layer1
+        self.layer2 = pretrained.resnet18.layer2
+        self.layer3 = pretrained.resnet18.layer3
+        self.layer4 = pretrained.resnet18.layer4
 
         self.adapool56 = nn.AdaptiveAvgPool2d(output_size=(56, 56))
         self.adapool28 = nn.AdaptiveAvgPool2d(output_size=(28, 28))
@@ -149,7 +149,7 @@ class DensResNet18(BasicModule):
         self.adaconv3 = nn.Conv2d(in_channels=64+64+128+256, out_channels=256, kernel_size=1, stride=1)
         self.adaconv4 = nn.Conv2d(in_channels=64+64+128+256+512, out_channels=512, kernel_size=1, stride=1)
 
-        self.avgpool = resnet18.avgpool
+        self.avgpool = pretrained.resnet18.avgpool
         self.fc = nn.Linear(512, num_classes)
 
         for m in self.modules():
@@ -193,14 +193,14 @@ class GuideResNet18(BasicModule):
         super(GuideResNet18, self).__init__()
 
         # train from scratch
-        self.conv1 = resnet18.conv1
-        self.bn1 = resnet18.bn1
-        self.relu = resnet18.relu
-        self.maxpool = resnet18.maxpool
-        self.layer1 = resnet18.layer1
-        self.layer2 = resnet18.layer2
-        self.layer3 = resnet18.layer3
-        self.layer4 = resnet18.layer4
+        self.conv1 = pretrained.resnet18.conv1
+        self.bn1 = pretrained.resnet18.bn1
+        self.relu = pretrained.resnet18.relu
+        self.maxpool = pretrained.resnet18.maxpool
+        self.layer1 = pretrained.resnet18.layer1
+        self.layer2 = pretrained.resnet18.layer2
+        self.layer3 = pretrained.resnet18.layer3
+        self.layer4 = pretrained.resnet18.layer4
 
         # self.upconv1 = nn.ConvTranspose2d(in_channels=512, out_channels=128, kernel_size=3, stride=2, padding=1)
         # self.upconv2 = nn.ConvTranspose2d(in_channels=512, out_channels=128, kernel_size=3, stride=2, padding=1)
@@ -209,10 +209,10 @@ class GuideResNet18(BasicModule):
         self.downconv1 = nn.Conv2d(in_channels=256, out_channels=128, kernel_size=1, stride=1)
         self.downconv2 = nn.Conv2d(in_channels=128, out_channels=128, kernel_size=3, stride=2, padding=1)
 
-        self.resblock1 = copy.deepcopy(resnet18.layer4)
-        self.resblock2 = copy.deepcopy(resnet18.layer4)
+        self.resblock1 = copy.deepcopy(pretrained.resnet18.layer4)
+        self.resblock2 = copy.deepcopy(pretrained.resnet18.layer4)
 
-        self.avgpool = resnet18.avgpool
+        self.avgpool = pretrained.resnet18.avgpool
         self.fc = nn.Linear(1024, num_classes)
 
         for m in self.modules():
@@ -257,15 +257,15 @@ class ResNet34(BasicModule):
         super(ResNet34, self).__init__()
 
         # train from scratch
-        self.conv1 = resnet34.conv1
-        self.bn1 = resnet34.bn1
-        self.relu = resnet34.relu
-        self.maxpool = resnet34.maxpool
-        self.layer1 = resnet34.layer1
-        self.layer2 = resnet34.layer2
-        self.layer3 = resnet34.layer3
-        self.layer4 = resnet34.layer4
-        self.avgpool = resnet34.avgpool
+        self.conv1 = pretrained.resnet34.conv1
+        self.bn1 = pretrained.resnet34.bn1
+        self.relu = pretrained.resnet34.relu
+        self.maxpool = pretrained.resnet34.maxpool
+        self.layer1 = pretrained.resnet34.layer1
+        self.layer2 = pretrained.resnet34.layer2
+        self.layer3 = pretrained.resnet34.layer3
+        self.layer4 = pretrained.resnet34.layer4
+        self.avgpool = pretrained.resnet34.avgpool
         self.fc = nn.Linear(512, num_classes)
 
         for m in self.modules():
@@ -298,15 +298,15 @@ class ResNet50(BasicModule):
         super(ResNet50, self).__init__()
 
         # train from scratch
-        self.conv1 = resnet50.conv1
-        self.bn1 = resnet50.bn1
-        self.relu = resnet50.relu
-        self.maxpool = resnet50.maxpool
-        self.layer1 = resnet50.layer1
-        self.layer2 = resnet50.layer2
-        self.layer3 = resnet50.layer3
-        self.layer4 = resnet50.layer4
-        self.avgpool = resnet50.avgpool
+        self.conv1 = pretrained.resnet50.conv1
+        self.bn1 = pretrained.resnet50.bn1
+        self.relu = pretrained.resnet50.relu
+        self.maxpool = pretrained.resnet50.maxpool
+        self.layer1 = pretrained.resnet50.layer1
+        self.layer2 = pretrained.resnet50.layer2
+        self.layer3 = pretrained.resnet50.layer3
+        self.layer4 = pretrained.resnet50.layer4
+        self.avgpool = pretrained.resnet50.avgpool
         self.fc = nn.Linear(2048, num_classes)
 
         for m in self.modules():
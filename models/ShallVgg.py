@@ -5,7 +5,7 @@ import torch
 from torch import nn
 from torch.nn import functional
 
-from .pretrained import vgg16
+from . import pretrained
 from .BasicModule import BasicModule
 
 
@@ -13,7 +13,7 @@ class ShallowNet(BasicModule):
     def __init__(self, num_classes):
         super(ShallowNet, self).__init__()
 
-        self.features = nn.Sequential(*list(vgg16.features)[:16])
+        self.features = nn.Sequential(*list(pretrained.vgg16.features)[:16])
 
         self.classifier = nn.Linear(in_features=200704, out_features=num_classes, bias=True)
 
@@ -1,5 +1,7 @@
-from .pretrained import resnet18, resnet18_pre
-from .utils import FocalLoss, LabelSmoothing
+from importlib import import_module
+
+from . import pretrained
+from .utils import FocalLoss, LabelSmoothing, DistillationLoss
 from .AlexNet import AlexNet
 from .Vgg import Vgg16
 from .ResNet import ResNet18, ResNet34, ResNet50, SkipResNet18, DensResNet18, GuideResNet18
@@ -15,3 +17,25 @@ from .DualResNet import DualResNet18, DualResNet50
 from .ContextAlexNet import ContextAlexNet
 from .ContextVgg import ContextVgg16
 from .ContextResNet import ContextResNet18, ContextShareNet, ContextResNet50
+from .zoo import MODELS, get_spec, build_model, model_head, load_inference_model, example_inputs, adapt_inputs, adapt_label, adapt_path, unpack_score
+
+# 压缩 / 部署用的函数 -> 所在的子模块，第一次访问时才import(quantization会import torch.ao.quantization的FX)
+EXPORTS = {
+    'quantized_path': 'quantization', 'quantize_static': 'quantization', 'save_quantized': 'quantization',
+    'load_quantized': 'quantization',
+    'frozen_path': 'freeze', 'has_frozen': 'freeze', 'save_frozen': 'freeze', 'load_frozen': 'freeze',
+    'fuse_conv_bn': 'freeze',
+    'lowrank_path': 'lowrank', 'LowRankLinear': 'lowrank', 'factorizable': 'lowrank', 'decompose': 'lowrank',
+    'factorize': 'lowrank', 'lowrank_ranks': 'lowrank',
+    'pruned_path': 'pruning', 'prunable': 'pruning', 'channel_masks': 'pruning', 'prune_channels': 'pruning',
+    'match_channels': 'pruning',
+}
+
+
+def __getattr__(name):
+    """models.resnet18等全局网络在第一次访问时才建立(models/pretrained.py)，EXPORTS中的函数第一次访问时才import"""
+    if name in EXPORTS:
+        return getattr(import_module('.' + EXPORTS[name], __name__), name)
+    if name not in pretrained.NETWORKS:
+        raise AttributeError(f'module {__name__} has no attribute {name}')
+    return getattr(pretrained, name)
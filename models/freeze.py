@@ -0,0 +1,62 @@
+# coding: utf-8
+
+import os
+import copy
+import torch
+
+from collections import Counter
+from torch import nn
+
+
+def frozen_path(checkpoint):
+    """冻结的推理图与checkpoint放在同一目录下"""
+    return os.path.splitext(checkpoint)[0] + '_frozen.pt'
+
+
+def has_frozen(checkpoint):
+    """checkpoint更新之后，旧的推理图不再使用"""
+    path = frozen_path(checkpoint)
+    return os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(checkpoint)
+
+
+def fuse_conv_bn(model):
+    """
+    与torch.fx.experimental.optimization.fuse相同，把eval模式下的BN折叠进前面的conv，返回GraphModule，不改变model。
+    fuse在每个调用处各折叠一次，同一个conv / bn被调用多次时(PCResNet的两个输入共用conv1 / bn1，
+    ContextShareNet的三个分支共用一套层)会被重复折叠，这里跳过这些层
+    """
+    from torch import fx
+    from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+    traced = fx.symbolic_trace(copy.deepcopy(model).eval())
+    modules = dict(traced.named_modules())
+    calls = Counter(node.target for node in traced.graph.nodes if node.op == 'call_module')  # 共享的层target相同
+    for node in list(traced.graph.nodes):
+        conv = node.args[0] if node.op == 'call_module' and node.args else None
+        if not isinstance(conv, fx.Node) or conv.op != 'call_module' or \
+                type(modules[conv.target]) is not nn.Conv2d or type(modules[node.target]) is not nn.BatchNorm2d:
+            continue
+        bn = modules[node.target]
+        if len(conv.users) > 1 or calls[conv.target] > 1 or calls[node.target] > 1 or not bn.track_running_stats:
+            continue
+        fused = fuse_conv_bn_eval(modules[conv.target], bn)
+        parent, _, name = conv.target.rpartition('.')
+        setattr(modules[parent], name, fused)
+        modules[conv.target] = fused
+        node.replace_all_uses_with(conv)
+        traced.graph.erase_node(node)
+    traced.delete_all_unused_submodules()
+    traced.recompile()
+    return traced
+
+
+def save_frozen(frozen, path):
+    torch.jit.save(frozen, path)
+    print('Frozen model ' + path + ' has been saved!')
+    return path
+
+
+def load_frozen(checkpoint, map_location=None):
+    model = torch.jit.load(frozen_path(checkpoint), map_location=map_location)
+    model.eval()
+    return model
@@ -0,0 +1,84 @@
+# coding: utf-8
+
+import os
+import torch
+from torch import nn
+
+
+def lowrank_path(checkpoint):
+    return os.path.splitext(checkpoint)[0] + '_lowrank.pth'
+
+
+class LowRankLinear(nn.Module):
+    """W(out*in) ≈ U(out*r) · V(r*in)，两个小的Linear代替一个大的Linear"""
+    def __init__(self, in_features, out_features, rank, bias=True):
+        super(LowRankLinear, self).__init__()
+        self.in_features = in_features
+        self.out_features = out_features
+        self.rank = rank
+
+        self.v = nn.Linear(in_features, rank, bias=False)
+        self.u = nn.Linear(rank, out_features, bias=bias)
+
+    def forward(self, x):
+        return self.u(self.v(x))
+
+    @classmethod
+    def from_svd(cls, linear, svd, rank):
+        """用截断SVD初始化，奇异值平分到U和V上"""
+        U, S, Vh = svd
+        layer = cls(linear.in_features, linear.out_features, rank, bias=linear.bias is not None)
+        root = S[:rank].sqrt()
+        with torch.no_grad():
+            layer.v.weight.copy_(root.unsqueeze(1) * Vh[:rank])
+            layer.u.weight.copy_(U[:, :rank] * root)
+            if linear.bias is not None:
+                layer.u.bias.copy_(linear.bias)
+        return layer.to(linear.weight.device)
+
+
+def factorizable(model, min_features=1024):
+    """输入和输出都不小于min_features的Linear，即torchvision里25088/9216->4096->4096的全连接层"""
+    return [name for name, module in model.named_modules()
+            if isinstance(module, nn.Linear) and min(module.in_features, module.out_features) >= min_features]
+
+
+def decompose(model, names=None):
+    """
+    对Linear的权重做SVD，不同的rank可以共用一次分解
+
+    :return: {name: (U, S, Vh)}
+    """
+    names = factorizable(model) if names is None else names
+    modules = dict(model.named_modules())
+    with torch.no_grad():
+        return {name: torch.linalg.svd(modules[name].weight.float().cpu(), full_matrices=False) for name in names}
+
+
+def factorize(model, ranks, svd=None):
+    """
+    将model中的Linear替换为LowRankLinear(原地修改)
+
+    :param ranks: int(所有可分解的层使用同一个rank) 或 {name: rank}
+    :param svd: decompose()的结果，为None时只替换结构不初始化权重，用于加载低秩的checkpoint
+    :return: model
+    """
+    if isinstance(ranks, int):
+        ranks = {name: ranks for name in factorizable(model)}
+
+    modules = dict(model.named_modules())
+    for name, rank in ranks.items():
+        linear = modules[name]
+        if svd is None:
+            layer = LowRankLinear(linear.in_features, linear.out_features, rank, bias=linear.bias is not None)
+        else:
+            layer = LowRankLinear.from_svd(linear, svd[name], rank)
+        parent, _, attr = name.rpartition('.')
+        setattr(modules[parent] if parent else model, attr, layer)
+    return model
+
+
+def lowrank_ranks(state_dict):
+    """从checkpoint中找出分解过的层及其rank"""
+    return {key[:-len('.v.weight')]: value.size(0) for key, value in state_dict.items()
+            if key.endswith('.v.weight') and key[:-len('v.weight')] + 'u.weight' in state_dict}
@@ -1,44 +1,34 @@
 # coding: utf-8
 
-import torch
-from torch import nn
-from torch.nn import functional
 from torchvision import models
 
-from .BasicModule import BasicModule
-
-alexnet_pre = models.alexnet(pretrained=True)
-# alexnet_pre.cuda()
-
-alexnet = models.alexnet(pretrained=False)
-# alexnet.cuda()
-
-vgg16_pre = models.vgg16(pretrained=True)
-# vgg16_pre.cuda()
-
-vgg16 = models.vgg16(pretrained=False)
-# vgg16.cuda()
-
-resnet18_pre = models.resnet18(pretrained=True)
-# resnet18_pre.cuda()
-
-resnet18 = models.resnet18(pretrained=False)
-# resnet18.cuda()
-
-resnet34_pre = models.resnet34(pretrained=True)
-# resnet34_pre.cuda()
-
-resnet34 = models.resnet34(pretrained=False)
-# resnet34.cuda()
-
-resnet50_pre = models.resnet50(pretrained=True)
-# resnet50_pre.cuda()
-
-resnet50 = models.resnet50(pretrained=False)
-# resnet50.cuda()
-
-densenet121_pre = models.densenet121(pretrained=True)
-# densenet121_pre.cuda()
-
-densenet121 = models.densenet121(pretrained=False)
-# densenet121.cuda()
+# 各模型的层取自这里的全局网络。网络在第一次被访问时才建立(PEP 562的模块__getattr__)，之后一直复用同一个，
+# import models时不再建立全部torchvision网络、加载全部预训练权重
+NETWORKS = {
+    'alexnet': (models.alexnet, False),
+    'alexnet_pre': (models.alexnet, True),
+    'vgg16': (models.vgg16, False),
+    'vgg16_pre': (models.vgg16, True),
+    'resnet18': (models.resnet18, False),
+    'resnet18_pre': (models.resnet18, True),
+    'resnet34': (models.resnet34, False),
+    'resnet34_pre': (models.resnet34, True),
+    'resnet50': (models.resnet50, False),
+    'resnet50_pre': (models.resnet50, True),
+    'densenet121': (models.densenet121, False),
+    'densenet121_pre': (models.densenet121, True),
+}
+
+
+def __getattr__(name):
+    if name not in NETWORKS:
+        raise AttributeError(f'module {__name__} has no attribute {name}')
+    builder, pretrained = NETWORKS[name]
+    network = builder(pretrained=pretrained)
+    # network.cuda()
+    globals()[name] = network
+    return network
+
+
+def __dir__():
+    return sorted(list(globals()) + list(NETWORKS))
@@ -0,0 +1,112 @@
+# coding: utf-8
+
+import os
+import copy
+import math
+import torch
+from torch import nn
+from torchvision.models.resnet import BasicBlock, Bottleneck
+
+
+def pruned_path(checkpoint, ratio):
+    return os.path.splitext(checkpoint)[0] + f'_pruned{int(round(ratio * 100))}.pth'
+
+
+def prunable(model):
+    """
+    residual block内部的通道：BasicBlock的bn1，Bottleneck的bn1和bn2。
+    这些通道不经过shortcut，剪掉后只需要改动block内相邻的conv，context / dual的各个分支分别剪枝
+
+    :return: [(block_name, bn_name)]
+    """
+    layers = []
+    for name, module in model.named_modules():
+        if isinstance(module, BasicBlock):
+            layers.append((name, 'bn1'))
+        elif isinstance(module, Bottleneck):
+            layers.extend([(name, 'bn1'), (name, 'bn2')])
+    return layers
+
+
+def channel_masks(model, ratio, min_ratio=0.1):
+    """
+    按BN gamma的绝对值在全局排序，去掉最小的ratio比例的通道，每层至少保留min_ratio
+
+    :return: {(block_name, bn_name): 保留通道的下标}
+    """
+    modules = dict(model.named_modules())
+    layers = prunable(model)
+    gammas = [getattr(modules[block], bn).weight.detach().abs().cpu() for block, bn in layers]
+    # 按全局排名而不是阈值去掉通道，gamma相同时也能剪到指定比例
+    removed = torch.zeros(sum(len(g) for g in gammas), dtype=torch.bool)
+    removed[torch.argsort(torch.cat(gammas))[:int(len(removed) * ratio)]] = True
+
+    masks, start = {}, 0
+    for (block, bn), gamma in zip(layers, gammas):
+        keep = torch.nonzero(~removed[start:start + len(gamma)]).flatten()
+        start += len(gamma)
+        least = max(1, math.ceil(len(gamma) * min_ratio))
+        if len(keep) < least:
+            keep = torch.argsort(gamma, descending=True)[:least]
+        masks[(block, bn)] = torch.sort(keep)[0]
+    return masks
+
+
+def _conv(conv, in_index=None, out_index=None):
+    weight = conv.weight.detach()
+    weight = weight if out_index is None else weight[out_index]
+    weight = weight if in_index is None else weight[:, in_index]
+    new = nn.Conv2d(weight.size(1), weight.size(0), conv.kernel_size, stride=conv.stride, padding=conv.padding,
+                    dilation=conv.dilation, bias=conv.bias is not None).to(weight.device)
+    new.weight.data.copy_(weight)
+    if conv.bias is not None:
+        new.bias.data.copy_(conv.bias.detach() if out_index is None else conv.bias.detach()[out_index])
+    return new
+
+
+def _bn(bn, index):
+    new = nn.BatchNorm2d(len(index), eps=bn.eps, momentum=bn.momentum).to(bn.weight.device)
+    for attr in ['weight', 'bias', 'running_mean', 'running_var']:
+        getattr(new, attr).data.copy_(getattr(bn, attr).detach()[index])
+    return new
+
+
+def prune_channels(model, ratio, min_ratio=0.1):
+    """
+    结构化剪枝，返回通道更少的稠密模型，不改变输入的model
+
+    :param ratio: 剪掉的通道比例(只统计block内部的通道)
+    """
+    model = copy.deepcopy(model)  # 模型的部分层与models/pretrained.py中的全局网络共享，不能原地修改
+    modules = dict(model.named_modules())
+    for (block, bn), keep in channel_masks(model, ratio, min_ratio).items():
+        block = modules[block]
+        if bn == 'bn1':
+            block.conv1 = _conv(block.conv1, out_index=keep)
+            block.bn1 = _bn(block.bn1, keep)
+            block.conv2 = _conv(block.conv2, in_index=keep)
+        else:
+            block.conv2 = _conv(block.conv2, out_index=keep)
+            block.bn2 = _bn(block.bn2, keep)
+            block.conv3 = _conv(block.conv3, in_index=keep)
+    return model
+
+
+def match_channels(model, state_dict):
+    """按checkpoint中的形状重建剪枝过的conv / bn(原地修改)，之后才能load_state_dict"""
+    for name, module in list(model.named_modules()):
+        key = name + '.weight'
+        if key not in state_dict or state_dict[key].shape == module.weight.shape:
+            continue
+        shape = state_dict[key].shape
+        if isinstance(module, nn.Conv2d):
+            new = nn.Conv2d(shape[1] * module.groups, shape[0], module.kernel_size, stride=module.stride,
+                            padding=module.padding, dilation=module.dilation, groups=module.groups,
+                            bias=module.bias is not None)
+        elif isinstance(module, nn.BatchNorm2d):
+            new = nn.BatchNorm2d(shape[0], eps=module.eps, momentum=module.momentum)
+        else:
+            continue
+        parent, _, attr = name.rpartition('.')
+        setattr(model.get_submodule(parent) if parent else model, attr, new)
+    return model
@@ -0,0 +1,59 @@
+# coding: utf-8
+
+import os
+import copy
+import torch
+
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+
+def quantized_path(checkpoint):
+    """int8模型与checkpoint放在同一目录下"""
+    return os.path.splitext(checkpoint)[0] + '_int8.pt'
+
+
+def quantize_static(model, example_inputs, calibration_batches, backend='fbgemm'):
+    """
+    FX graph mode的静态int8量化，prepare_fx时会自动融合conv-bn-relu
+
+    :param model: eval模式下的BasicModule
+    :param example_inputs: tuple of Tensor，用于trace
+    :param calibration_batches: 可迭代对象，每个元素是forward的输入元组
+    :param backend: 'fbgemm' (x86) 或 'qnnpack' (ARM)
+    :return: 量化后的GraphModule
+    """
+    torch.backends.quantized.engine = backend
+    model = copy.deepcopy(model).cpu().eval()
+
+    prepared = prepare_fx(model, get_default_qconfig_mapping(backend), example_inputs)
+    with torch.no_grad():
+        for inputs in calibration_batches:
+            prepared(*inputs)
+
+    return _view_to_reshape(convert_fx(prepared))
+
+
+def _view_to_reshape(graph_module):
+    """量化后conv的输出是channels_last，flatten时的view会报错，统一换成reshape"""
+    for node in graph_module.graph.nodes:
+        if node.op == 'call_method' and node.target == 'view':
+            node.target = 'reshape'
+    graph_module.recompile()
+    return graph_module
+
+
+def save_quantized(qmodel, example_inputs, path):
+    """trace成TorchScript保存，加载时不需要模型的定义"""
+    with torch.no_grad():
+        scripted = torch.jit.trace(qmodel, example_inputs, check_trace=False)
+    torch.jit.save(scripted, path)
+    print('Quantized model ' + path + ' has been saved!')
+    return path
+
+
+def load_quantized(checkpoint, backend='fbgemm'):
+    torch.backends.quantized.engine = backend
+    model = torch.jit.load(quantized_path(checkpoint), map_location='cpu')
+    model.eval()
+    return model
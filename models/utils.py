@@ -78,3 +78,17 @@ class LabelSmoothing(nn.Module):
         self.true_dist = true_dist
 
         return self.criterion(x, true_dist)
+
+
+class DistillationLoss(nn.Module):
+    """Hinton KD：alpha * T^2 * KL(student/T || teacher/T) + (1 - alpha) * CE(student, label)"""
+
+    def __init__(self, T=4.0, alpha=0.7):
+        super(DistillationLoss, self).__init__()
+        self.T = T
+        self.alpha = alpha
+
+    def forward(self, score, teacher_score, target):
+        soft = F.kl_div(F.log_softmax(score / self.T, dim=1), F.softmax(teacher_score / self.T, dim=1),
+                        reduction='batchmean') * self.T * self.T
+        return self.alpha * soft + (1 - self.alpha) * F.cross_entropy(score, target)
@@ -0,0 +1,133 @@
+# coding: utf-8
+
+from collections import namedtuple
+
+import torch
+from torch.nn import functional
+
+from .AlexNet import AlexNet
+from .Vgg import Vgg16
+from .ResNet import ResNet18, ResNet34, ResNet50, SkipResNet18, DensResNet18, GuideResNet18
+from .ShallDenseNet import densenet_collapse
+from .ShallVgg import ShallowVgg, CustomedNet
+from .DualNet import DualNet
+from .PCAlexNet import PCAlexNet
+from .PCVgg import PCVgg16
+from .PCResNet import PCResNet18, PCResNet50
+from .DualAlexNet import DualAlexNet
+from .DualVgg import DualVgg16
+from .DualResNet import DualResNet18, DualResNet50
+from .ContextAlexNet import ContextAlexNet
+from .ContextVgg import ContextVgg16
+from .ContextResNet import ContextResNet18, ContextShareNet, ContextResNet50
+from .freeze import has_frozen, load_frozen
+
+# builder: 构造函数，num_inputs: forward的输入个数，channels/size: 每个输入的通道数和边长
+# head: 输出分类score的Linear，它的输入即倒数第二层特征
+ModelSpec = namedtuple('ModelSpec', ['builder', 'num_inputs', 'channels', 'size', 'head'])
+
+MODELS = {
+    'ResNet18': ModelSpec(ResNet18, 1, 3, 224, 'fc'),
+    'ResNet34': ModelSpec(ResNet34, 1, 3, 224, 'fc'),
+    'ResNet50': ModelSpec(ResNet50, 1, 3, 224, 'fc'),
+    'SkipResNet18': ModelSpec(SkipResNet18, 1, 3, 224, 'fc'),
+    'DensResNet18': ModelSpec(DensResNet18, 1, 3, 224, 'fc'),
+    'GuideResNet18': ModelSpec(GuideResNet18, 1, 3, 224, 'fc'),
+    'Vgg16': ModelSpec(Vgg16, 1, 3, 224, 'fc3'),
+    'AlexNet': ModelSpec(AlexNet, 1, 3, 224, 'fc3'),
+    'ShallowVgg': ModelSpec(ShallowVgg, 1, 1, 112, 'classifier'),
+    'CustomedNet': ModelSpec(CustomedNet, 1, 1, 112, 'classifier'),
+    'densenet_collapse': ModelSpec(densenet_collapse, 1, 1, 112, 'linear'),
+    'DualNet': ModelSpec(DualNet, 2, 1, 112, 'classifier'),
+    'PCAlexNet': ModelSpec(PCAlexNet, 2, 3, 224, 'fc3'),
+    'PCVgg16': ModelSpec(PCVgg16, 2, 3, 224, 'fc3'),
+    'PCResNet18': ModelSpec(PCResNet18, 2, 3, 224, 'fc'),
+    'PCResNet50': ModelSpec(PCResNet50, 2, 3, 224, 'fc'),
+    'DualAlexNet': ModelSpec(DualAlexNet, 2, 3, 224, 'fc3_1'),
+    'DualVgg16': ModelSpec(DualVgg16, 2, 3, 224, 'fc3_1'),
+    'DualResNet18': ModelSpec(DualResNet18, 2, 3, 224, 'fc_1'),
+    'DualResNet50': ModelSpec(DualResNet50, 2, 3, 224, 'fc_1'),
+    'ContextAlexNet': ModelSpec(ContextAlexNet, 3, 3, 224, 'fc3'),
+    'ContextVgg16': ModelSpec(ContextVgg16, 3, 3, 224, 'fc3'),
+    'ContextResNet18': ModelSpec(ContextResNet18, 3, 3, 224, 'fc'),
+    'ContextShareNet': ModelSpec(ContextShareNet, 3, 3, 224, 'fc'),
+    'ContextResNet50': ModelSpec(ContextResNet50, 3, 3, 224, 'fc'),
+}
+
+
+def get_spec(arch):
+    if arch not in MODELS:
+        raise ValueError(f'Unknown model: {arch}, choose from {list(MODELS)}')
+    return MODELS[arch]
+
+
+def build_model(arch, num_classes):
+    return get_spec(arch).builder(num_classes=num_classes)
+
+
+def model_head(model):
+    """分类层的名字；int8模型和冻结的推理图无法挂hook，返回None"""
+    model = getattr(model, 'module', model)  # DataParallel
+    if isinstance(model, torch.jit.ScriptModule) or getattr(model, 'model_name', None) not in MODELS:
+        return None
+    return MODELS[model.model_name].head
+
+
+def load_inference_model(arch, checkpoint, num_classes, device='cpu', quantized=False, backend='fbgemm',
+                         use_frozen=True):
+    """
+    加载用于推理的模型：int8模型 > 冻结的推理图 > checkpoint
+
+    :return: eval模式下的模型，int8模型只能在CPU上运行
+    """
+    if quantized:
+        from .quantization import load_quantized  # torch.ao.quantization的FX只在用到int8模型时才import
+        return load_quantized(checkpoint, backend)
+    elif use_frozen and has_frozen(checkpoint):
+        return load_frozen(checkpoint, map_location=device)
+    model = build_model(arch, num_classes=num_classes)
+    model.load(checkpoint, map_location='cpu')
+    return model.to(device).eval()
+
+
+def example_inputs(arch, batch_size=1):
+    spec = get_spec(arch)
+    return tuple(torch.rand(batch_size, spec.channels, spec.size, spec.size) for _ in range(spec.num_inputs))
+
+
+def adapt_inputs(arch, image):
+    """
+    将dataloader给出的image转换为模型forward的输入元组
+
+    :param arch: 模型名
+    :param image: VB_Dataset给出的Tensor，或ContextVB_Dataset给出的三元组
+    :return: tuple of Tensor
+    """
+    spec = get_spec(arch)
+    images = list(image) if isinstance(image, (tuple, list)) else [image] * spec.num_inputs  # PC/Dual两支输入同一张图
+    if len(images) != spec.num_inputs:
+        raise ValueError(f'{arch} needs {spec.num_inputs} inputs, got {len(images)}')
+
+    inputs = []
+    for x in images:
+        if x.size(1) != spec.channels:
+            x = x[:, :spec.channels] if x.size(1) > spec.channels else x.expand(-1, spec.channels, -1, -1)
+        if x.size(-1) != spec.size or x.size(-2) != spec.size:
+            x = functional.interpolate(x, size=(spec.size, spec.size), mode='bilinear', align_corners=False)
+        inputs.append(x)
+    return tuple(inputs)
+
+
+def adapt_label(label):
+    """ContextVB_Dataset的label为三元组，取中间一块脊骨的label"""
+    return label[1] if isinstance(label, (tuple, list)) else label
+
+
+def adapt_path(image_path):
+    """与adapt_label相同，取中间一块脊骨的路径"""
+    return image_path[1] if isinstance(image_path, (tuple, list)) and isinstance(image_path[0], (tuple, list)) else image_path
+
+
+def unpack_score(output):
+    """多输出模型(Context/PC/Dual)的第一个输出为分类score"""
+    return output[0] if isinstance(output, (tuple, list)) else output
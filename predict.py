@@ -0,0 +1,221 @@
+# coding: utf-8
+
+import os
+import fire
+import hashlib
+import torch
+import numpy as np
+
+from tqdm import tqdm
+from torch.utils.data import DataLoader
+from torch.nn import functional
+
+from config import config
+from dataset import Manifest_Dataset, count_rows, map_label
+from models import get_spec, model_head, load_inference_model, adapt_inputs, unpack_score
+from utils import tta_score, PredictionCache
+
+
+def record_dtype(num_classes):
+    """二进制结果中每一行的格式，可以用np.fromfile(output, dtype=record_dtype(num_classes))读取"""
+    return np.dtype([('row', '<i8'), ('label', '<i8'), ('predict', '<i8'), ('prob', '<f4', (num_classes,))])
+
+
+class CSVResult(object):
+    """row,path,label,predict,p1,p2,...，每个batch追加写入"""
+    def __init__(self, output, num_classes):
+        self.output = output
+        self.num_classes = num_classes
+        self.copies = {}  # duplicate_rows的结果，重复的行在写入第一行时一起写入
+
+    def scored(self, num_rows):
+        """
+        已经写入的行号，中断时写了一半的最后一行会被截掉
+
+        :return: bool数组
+        """
+        done = np.zeros(num_rows, dtype=bool)
+        if not os.path.exists(self.output):
+            return done
+        end = 0
+        with open(self.output, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                if not line.startswith(b'row,'):
+                    done[int(line.split(b',', 1)[0])] = True
+                end += len(line)
+        with open(self.output, 'r+b') as f:
+            f.truncate(end)
+        return done
+
+    def __enter__(self):
+        new = not os.path.exists(self.output) or os.path.getsize(self.output) == 0
+        self.file = open(self.output, 'a')
+        if new:
+            self.file.write(','.join(['row', 'path', 'label', 'predict'] +
+                                     [f'p{c + 1}' for c in range(self.num_classes)]) + '\n')
+        return self
+
+    def __exit__(self, *args):
+        self.file.close()
+
+    def expand(self, rows, labels, probs, paths):
+        """加上与rows中输入相同的重复行，使用同一个结果"""
+        if not self.copies:
+            return rows, labels, probs, paths
+        rows, labels, probs, paths = list(rows), list(labels), list(probs), list(paths)
+        for i in range(len(rows)):
+            for row, label, path in self.copies.pop(int(rows[i]), []):
+                rows.append(row)
+                labels.append(label)
+                probs.append(probs[i])
+                paths.append(path)
+        return rows, labels, np.stack(probs), paths
+
+    def write(self, rows, labels, probs, paths):
+        rows, labels, probs, paths = self.expand(rows, labels, probs, paths)
+        self.file.writelines(f'{r},{ip},{l},{np.argmax(p)},' + ','.join(str(round(float(x), 4)) for x in p) + '\n'
+                             for r, ip, l, p in zip(rows, paths, labels, probs))
+        self.file.flush()
+
+
+class BinaryResult(CSVResult):
+    """定长记录(record_dtype)，不保存路径，按row对应到输入csv的行"""
+    def scored(self, num_rows):
+        done = np.zeros(num_rows, dtype=bool)
+        if not os.path.exists(self.output):
+            return done
+        dtype = record_dtype(self.num_classes)
+        count = os.path.getsize(self.output) // dtype.itemsize
+        with open(self.output, 'r+b') as f:
+            f.truncate(count * dtype.itemsize)
+        if count:
+            done[np.memmap(self.output, dtype=dtype, mode='r', shape=(count,))['row']] = True
+        return done
+
+    def __enter__(self):
+        self.file = open(self.output, 'ab')
+        return self
+
+    def write(self, rows, labels, probs, paths):
+        rows, labels, probs, paths = self.expand(rows, labels, probs, paths)
+        records = np.empty(len(rows), dtype=record_dtype(self.num_classes))
+        records['row'], records['label'], records['prob'] = rows, labels, probs
+        records['predict'] = np.argmax(probs, axis=1)
+        self.file.write(records.tobytes())
+        self.file.flush()
+
+
+def duplicate_rows(data, done):
+    """
+    输入(路径，Context为三元组)相同的行只预测第一行，其余的行在done中标记，不再读图和forward
+
+    :return: {第一行: [(重复的行, label, 路径)]}
+    """
+    first, copies = {}, {}
+    for row, (path, label, context) in enumerate(tqdm(data.rows(), desc='Dedup')):
+        if done[row]:
+            continue
+        key = hashlib.sha1('|'.join(context if data.num_inputs == 3 else [path]).encode()).digest()
+        if key in first:
+            copies.setdefault(first[key], []).append((row, map_label(label, data.num_classes), path))
+            done[row] = True
+        else:
+            first[key] = row
+    print('Duplicate rows:', sum(len(v) for v in copies.values()))
+    return copies
+
+
+def cached_rows(data, done, cache, result, chunk_size=1024):
+    """
+    先把缓存中已有的行直接写入结果并在done中标记，之后的DataLoader只读未命中的图
+
+    :return: {row: key}，未命中的行
+    """
+    misses, chunk, count = {}, [], [0]
+
+    def flush():
+        hits = cache.get([key for _, key, _, _ in chunk])
+        rows = [(row, label, path, hits[key][0]) for row, key, label, path in chunk if key in hits]
+        misses.update((row, key) for row, key, _, _ in chunk if key not in hits)
+        if rows:
+            logits = torch.from_numpy(np.stack([x[3] for x in rows]))
+            result.write([x[0] for x in rows], [x[1] for x in rows], functional.softmax(logits, dim=1).numpy(),
+                         [x[2] for x in rows])
+            done[[x[0] for x in rows]] = True
+            count[0] += len(rows)
+        chunk.clear()
+
+    with result:
+        for row, (path, label, context) in enumerate(tqdm(data.rows(), desc='Cache lookup')):
+            if done[row]:
+                continue
+            chunk.append((row, cache.key(context if data.num_inputs == 3 else path),
+                          map_label(label, data.num_classes), path))
+            if len(chunk) == chunk_size:
+                flush()
+        flush()
+    print('Cache hits:', count[0], 'misses:', len(misses))
+    return misses
+
+
+def predict(*csv_paths, **kwargs):
+    """
+    对任意的csv(每行为 路径[,label])做预测，结果边算边追加到result_file，重新运行时跳过已经写入的行。
+    图片流式读取，但每一行仍在内存中占用done的1个字节；dedup时另外保存每个不同输入的hash，
+    use_cache时保存每个未命中行的key(各约100字节)，行数很多时关闭这两项或把csv拆开运行
+
+    python predict.py a.csv b.csv --arch=ResNet18 --load_model_path=xxx.pth --result_file=xxx.csv(或.bin) [--tta=4]
+    """
+    config.parse(kwargs)
+    csv_paths = list(csv_paths) if csv_paths else config.test_paths
+    spec = get_spec(config.arch)
+    output = config.result_file if config.result_file else \
+        os.path.splitext(config.load_model_path)[0] + '_predictions.csv'
+    result = (BinaryResult if output.endswith('.bin') else CSVResult)(output, config.num_classes)
+
+    # ============================================= Prepare Model ============================================
+    model = load_inference_model(config.arch, config.load_model_path, config.num_classes,
+                                 device='cuda' if config.use_gpu else 'cpu', quantized=config.quantized,
+                                 backend=config.quantize_backend, use_frozen=config.use_frozen)
+    config.use_gpu = config.use_gpu and not config.quantized  # int8算子只在CPU上运行
+    get_score = tta_score(lambda m, x: unpack_score(m(*adapt_inputs(config.arch, x))), config.tta)
+    cache = PredictionCache(config.cache_path, config.cache_max_mb).bind(
+        config.load_model_path, model, model_head(model), useRGB=spec.channels == 3, padding=config.padding,
+        tta=config.tta) if config.use_cache else None
+
+    # ============================================= Prepare Data =============================================
+    num_rows = count_rows(csv_paths)
+    done = result.scored(num_rows)
+    print('Rows:', num_rows, 'Already scored:', int(done.sum()))
+
+    data = Manifest_Dataset(csv_paths, num_classes=config.num_classes, num_inputs=spec.num_inputs,
+                            useRGB=spec.channels == 3, padding=config.padding, done=done)
+    if config.dedup:
+        result.copies = duplicate_rows(data, done)
+    misses = cached_rows(data, done, cache, result) if cache is not None else {}
+    if done.all():
+        return
+    dataloader = DataLoader(data, batch_size=config.eval_batch_size, num_workers=config.num_workers,
+                            pin_memory=config.use_gpu)
+
+    # ================================================ Predict ===============================================
+    with torch.inference_mode(), result, tqdm(total=num_rows - int(done.sum())) as progress:
+        for row, image, label, image_path in dataloader:
+            if config.use_gpu:
+                image = tuple(x.cuda(non_blocking=True) for x in image) if isinstance(image, (tuple, list)) \
+                    else image.cuda(non_blocking=True)
+            if cache is not None:
+                cache.reset()
+            score = get_score(model, image).float().cpu()
+            if cache is not None:
+                cache.put([misses.pop(int(r)) for r in row], score.numpy(), cache.take(len(row)).numpy())
+            result.write(row.numpy(), label.numpy(), functional.softmax(score, dim=1).numpy(), image_path)
+            progress.update(len(row))
+
+    print('Predictions ' + output + ' have been saved!')
+
+
+if __name__ == '__main__':
+    fire.Fire(predict)
@@ -0,0 +1,114 @@
+# coding: utf-8
+
+import os
+import time
+import fire
+import torch
+import numpy as np
+
+from tqdm import tqdm
+from torch.utils.data import DataLoader
+
+from config import config
+from dataset import Manifest_Dataset
+from models import get_spec, load_inference_model, adapt_inputs
+from utils import RetrievalIndex, write_csv
+from embedding import embedding_dir, read_labels, feature_hook
+
+
+def index_dir():
+    return os.path.join(embedding_dir(), 'index')
+
+
+def build(**kwargs):
+    """
+    用embedding.py export得到的倒数第二层特征建立检索索引，保存在<embedding_dir>/index
+
+    python embedding.py export dataset/train_VB.csv --arch=ResNet18 --load_model_path=xxx.pth --embedding_dir=xxx
+    python retrieval.py build --load_model_path=xxx.pth --embedding_dir=xxx
+    """
+    config.parse(kwargs)
+    features = np.load(os.path.join(embedding_dir(), 'features.npy'), mmap_mode='r')
+    start = time.perf_counter()
+    index = RetrievalIndex.build(index_dir(), features, nlist=config.retrieval_nlist, m=config.retrieval_m)
+    print(f'Index of {len(index)} vectors ({index.meta}) built in {time.perf_counter() - start:.1f}s')
+
+
+def query(*csv_paths, **kwargs):
+    """
+    对csv(每行为 路径[,label])中的每一块脊骨检索索引中最相似的top_k个病例，结果保存为result_file
+
+    python retrieval.py query a.csv --arch=ResNet18 --load_model_path=xxx.pth --embedding_dir=xxx [--retrieval_exact=True]
+    """
+    config.parse(kwargs)
+    spec = get_spec(config.arch)
+    device = 'cuda' if config.use_gpu else 'cpu'
+    index = RetrievalIndex(index_dir())
+    paths, labels, _ = read_labels(embedding_dir())
+
+    model = load_inference_model(config.arch, config.load_model_path, config.num_classes, device=device,
+                                 use_frozen=False)  # 冻结的推理图无法挂hook
+    handle, captured = feature_hook(model)
+    data = Manifest_Dataset(list(csv_paths) if csv_paths else config.test_paths, num_classes=config.num_classes,
+                            num_inputs=spec.num_inputs, useRGB=spec.channels == 3, padding=config.padding)
+    dataloader = DataLoader(data, batch_size=config.eval_batch_size, num_workers=config.num_workers,
+                            pin_memory=device == 'cuda')
+
+    results, search_time = [], 0
+    with torch.inference_mode():
+        for row, image, label, image_path in tqdm(dataloader):
+            captured.clear()
+            image = tuple(x.to(device) for x in image) if isinstance(image, (tuple, list)) else image.to(device)
+            model(*adapt_inputs(config.arch, image))
+
+            start = time.perf_counter()
+            if config.retrieval_exact:
+                scores, neighbors = index.exact(captured[0].float().cpu().numpy(), k=config.top_k)
+            else:
+                scores, neighbors = index.search(captured[0].float().cpu().numpy(), k=config.top_k,
+                                                 nprobe=config.nprobe, rerank=config.rerank)
+            search_time += time.perf_counter() - start
+
+            for q, (path, l) in enumerate(zip(image_path, label.tolist())):
+                results.extend([(path, l, rank + 1, paths[n], int(labels[n]), round(float(s), 4))
+                                for rank, (n, s) in enumerate(zip(neighbors[q], scores[q])) if n >= 0])
+    handle.remove()
+
+    output = config.result_file if config.result_file else os.path.join(embedding_dir(), 'retrieval.csv')
+    write_csv(output, tag=['query', 'label', 'rank', 'neighbor', 'neighbor_label', 'similarity'], content=results)
+    num_queries = len(results) // config.top_k if results else 0
+    print(f'Search: {1000 * search_time / max(num_queries, 1):.3f} ms/query')
+    print('Retrieval results ' + output + ' have been saved!')
+
+
+def bench(num_queries=1000, **kwargs):
+    """
+    用索引中的特征加噪声作为查询，比较精确检索和IVF-PQ检索的耗时与recall@top_k
+
+    python retrieval.py bench --load_model_path=xxx.pth --embedding_dir=xxx
+    """
+    config.parse(kwargs)
+    index = RetrievalIndex(index_dir())
+    rng = np.random.RandomState(0)
+    queries = np.asarray(index.vectors[np.sort(rng.choice(len(index), min(num_queries, len(index)), replace=False))],
+                         dtype=np.float32)
+    queries += rng.normal(scale=0.01, size=queries.shape).astype(np.float32)
+
+    start = time.perf_counter()
+    _, truth = index.exact(queries, k=config.top_k)
+    exact_ms = 1000 * (time.perf_counter() - start) / len(queries)
+    for rerank in [0, config.rerank]:
+        start = time.perf_counter()
+        _, found = index.search(queries, k=config.top_k, nprobe=config.nprobe, rerank=rerank)
+        ivf_ms = 1000 * (time.perf_counter() - start) / len(queries)
+        recall = np.mean([len(np.intersect1d(t, f)) / len(t) for t, f in zip(truth, found)])
+        print(f'exact: {exact_ms:.3f} ms/query, IVF-PQ(nprobe={config.nprobe}, rerank={rerank}): '
+              f'{ivf_ms:.3f} ms/query, recall@{config.top_k}: {recall:.4f}')
+
+
+if __name__ == '__main__':
+    fire.Fire({
+        'build': build,
+        'query': query,
+        'bench': bench
+    })
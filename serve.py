@@ -0,0 +1,226 @@
+# coding: utf-8
+
+import os
+import json
+import time
+import queue
+import random
+import threading
+import fire
+import torch
+import numpy as np
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import request as urllib_request
+from torch.nn import functional as F
+from torchvision.transforms import functional
+
+from config import config
+from dataset import load_image, load_context, read_manifest
+from models import get_spec, load_inference_model, adapt_inputs, unpack_score
+
+
+class Batcher(object):
+    """
+    把并发请求中的脊骨合并成batch：收到第一张图后最多等max_latency_ms，或凑满max_batch_size后立刻forward
+
+    :param model: eval模式下的模型
+    :param arch: 模型名，用于adapt_inputs
+    """
+    def __init__(self, model, arch, max_batch_size=32, max_latency_ms=10, device='cpu', history=1000):
+        self.model = model
+        self.arch = arch
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000
+        self.device = device
+        self.queue = queue.Queue()
+        self.batches = deque(maxlen=history)  # (batch_size, 排队时间ms, forward时间ms)
+        self.count = {'requests': 0, 'images': 0, 'batches': 0, 'errors': 0}
+        self.lock = threading.Lock()  # count / batches由HTTP的各个线程和batch线程共同修改
+
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, images):
+        """:param images: 一块脊骨的输入，Tensor或Tensor三元组(Context)  :return: Future，结果为概率"""
+        future = Future()
+        self.queue.put((images, future, time.perf_counter()))
+        return future
+
+    def collect(self):
+        items = [self.queue.get()]
+        deadline = items[0][2] + self.max_latency
+        while len(items) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:  # 超时后仍取走队列中已有的图，forward较慢时batch会自动变大
+                items.append(self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def loop(self):
+        while True:
+            items = self.collect()
+            start = time.perf_counter()
+            try:
+                images = [x for x, _, _ in items]
+                if isinstance(images[0], tuple):
+                    image = tuple(torch.stack(x) for x in zip(*images))
+                else:
+                    image = torch.stack(images)
+                inputs = tuple(x.to(self.device) for x in adapt_inputs(self.arch, image))
+                with torch.inference_mode():
+                    probs = F.softmax(unpack_score(self.model(*inputs)).float(), dim=1).cpu().numpy()
+                for (_, future, _), p in zip(items, probs):
+                    future.set_result(p)
+            except Exception as e:
+                with self.lock:
+                    self.count['errors'] += 1
+                for _, future, _ in items:
+                    future.set_exception(e)
+            end = time.perf_counter()
+            with self.lock:
+                self.batches.append((len(items), (start - items[0][2]) * 1000, (end - start) * 1000))
+                self.count['batches'] += 1
+                self.count['images'] += len(items)
+
+    def metrics(self):
+        with self.lock:
+            batches = np.array(self.batches) if self.batches else np.zeros((1, 3))
+            count = dict(self.count)
+        return dict(count, queue_depth=self.queue.qsize(),
+                    mean_batch_size=round(float(batches[:, 0].mean()), 2),
+                    wait_p50_ms=round(float(np.percentile(batches[:, 1], 50)), 3),
+                    wait_p90_ms=round(float(np.percentile(batches[:, 1], 90)), 3),
+                    batch_p50_ms=round(float(np.percentile(batches[:, 2], 50)), 3),
+                    batch_p90_ms=round(float(np.percentile(batches[:, 2], 90)), 3))
+
+
+def preprocess(paths, num_inputs, useRGB=True, padding=True):
+    """
+    与VB_Dataset / ContextVB_Dataset相同的读图和pad到224
+
+    :param paths: 单块脊骨的路径列表；Context模型时为一个病人按顺序排列的全部脊骨
+    :return: 每块脊骨的输入，Context模型时为(上一块, 本身, 下一块)，第一块 / 最后一块以自身作为上一块 / 下一块
+    """
+    if num_inputs != 3:
+        return [functional.to_tensor(load_image(path, useRGB=useRGB, padding=padding)) for path in paths]
+    # 上下两块按中间一块的大小缩放后再pad，每块脊骨作为中间一块和相邻块时的输入不同，需要分别读
+    contexts = [(paths[max(i - 1, 0)], paths[i], paths[min(i + 1, len(paths) - 1)]) for i in range(len(paths))]
+    return [tuple(functional.to_tensor(x) for x in load_context(context, useRGB=useRGB, padding=padding))
+            for context in contexts]
+
+
+def make_handler(batcher, spec):
+    class Handler(BaseHTTPRequestHandler):
+        """
+        POST /predict  {"paths": [...]}，返回 {"paths": [...], "probs": [[...], ...], "predict": [...]}
+        GET /metrics   每个batch的大小、排队时间、forward时间和当前队列长度
+        """
+        def send_json(self, code, content):
+            body = json.dumps(content).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                self.send_json(200, batcher.metrics())
+            else:
+                self.send_json(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path != '/predict':
+                return self.send_json(404, {'error': 'not found'})
+            try:
+                if self.headers['Content-Length'] is None:
+                    raise ValueError('missing Content-Length')
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                paths = body['paths'] if isinstance(body, dict) else None
+                if not isinstance(paths, list) or not all(isinstance(x, str) for x in paths):
+                    raise TypeError('body must be {"paths": [str, ...]}')
+                images = preprocess(paths, spec.num_inputs, useRGB=spec.channels == 3, padding=config.padding)
+            except (KeyError, ValueError, TypeError, OSError) as e:
+                return self.send_json(400, {'error': str(e)})
+
+            with batcher.lock:
+                batcher.count['requests'] += 1
+            try:
+                probs = [future.result() for future in [batcher.submit(x) for x in images]]
+            except Exception as e:  # forward出错时batch线程把异常设到future上
+                return self.send_json(500, {'error': str(e)})
+            self.send_json(200, {'paths': paths, 'probs': [p.tolist() for p in probs],
+                                 'predict': [int(np.argmax(p)) for p in probs]})
+
+        def log_message(self, format, *args):  # 不逐条打印请求
+            pass
+
+    return Handler
+
+
+def serve(**kwargs):
+    """
+    python serve.py serve --arch=ContextResNet18 --load_model_path=xxx.pth --serve_port=8000
+    """
+    config.parse(kwargs)
+    spec = get_spec(config.arch)
+    device = 'cuda' if config.use_gpu and not config.quantized else 'cpu'
+    model = load_inference_model(config.arch, config.load_model_path, config.num_classes, device=device,
+                                 quantized=config.quantized, backend=config.quantize_backend,
+                                 use_frozen=config.use_frozen)
+
+    batcher = Batcher(model, config.arch, max_batch_size=config.eval_batch_size,
+                      max_latency_ms=config.max_batch_latency_ms, device=device)
+    server = ThreadingHTTPServer((config.serve_host, config.serve_port), make_handler(batcher, spec))
+    print(f'Serving {config.arch} on http://{config.serve_host}:{config.serve_port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+def client(*csv_paths, num_threads=8, num_requests=100, patient=False, url=None):
+    """
+    压测用的本地client，从csv中随机取图片发请求
+
+    :param patient: True时每个请求为一个病人的全部脊骨(Context模型)，否则为单块脊骨
+    """
+    url = url if url else f'http://{config.serve_host}:{config.serve_port}'
+    csv_paths = list(csv_paths) if csv_paths else config.test_paths
+    paths = [path for path, _ in read_manifest(csv_paths)]
+    patients = {}
+    for path in paths:
+        patients.setdefault(os.path.dirname(path), []).append(path)
+    patients = list(patients.values())
+
+    def send(i):
+        body = json.dumps({'paths': random.choice(patients) if patient else [random.choice(paths)]}).encode()
+        start = time.perf_counter()
+        req = urllib_request.Request(url + '/predict', data=body, headers={'Content-Type': 'application/json'})
+        with urllib_request.urlopen(req) as response:
+            response.read()
+        return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(num_threads) as executor:
+        latency = np.array(list(executor.map(send, range(num_requests))))
+    total = time.perf_counter() - start
+
+    with urllib_request.urlopen(url + '/metrics') as response:
+        metrics = json.loads(response.read())
+    print('requests/s:', round(num_requests / total, 2))
+    print('latency p50:', round(float(np.percentile(latency, 50)), 3), 'ms',
+          'p90:', round(float(np.percentile(latency, 90)), 3), 'ms',
+          'p99:', round(float(np.percentile(latency, 99)), 3), 'ms')
+    print('server:', metrics)
+
+
+if __name__ == '__main__':
+    fire.Fire({
+        'serve': serve,
+        'client': client
+    })
@@ -0,0 +1,52 @@
+# coding: utf-8
+
+import numpy as np
+import torch
+
+from utils import PredictionCache
+
+
+def make_cache(tmp_path, max_mb=1):
+    checkpoint = tmp_path / 'model.pth'
+    checkpoint.write_bytes(b'checkpoint')
+    cache = PredictionCache(str(tmp_path / 'cache.db'), max_mb=max_mb)
+    return cache, str(checkpoint)
+
+
+def test_put_get_roundtrip(tmp_path):
+    cache, checkpoint = make_cache(tmp_path)
+    image = tmp_path / 'a.png'
+    image.write_bytes(b'image')
+    bound = cache.bind(checkpoint, padding=True)
+    key = bound.key(str(image))
+    assert bound.get([key]) == {}
+
+    bound.put([key], np.array([[1., 2., 3.]]), np.array([[0.5, 0.25]]))
+    logits, features = bound.get([key])[key]
+    assert np.array_equal(logits, [1., 2., 3.]) and np.array_equal(features, [0.5, 0.25])
+
+    # 预处理参数或图片内容不同时key不同
+    assert cache.bind(checkpoint, padding=False).key(str(image)) != key
+    image.write_bytes(b'other image')
+    assert bound.key(str(image)) != key
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache, checkpoint = make_cache(tmp_path)
+    cache.max_bytes = 3 * 4 * 1024  # 3条1024维的logits
+    logits = np.zeros((1, 1024))
+    for key in ['a', 'b', 'c']:
+        cache.put([key], logits, np.zeros((1, 0)))
+    cache.get(['a'])  # a最近被使用，淘汰b
+    cache.put(['d'], logits, np.zeros((1, 0)))
+    assert sorted(cache.get(['a', 'b', 'c', 'd'])) == ['a', 'd']
+
+
+def test_take_orders_dataparallel_replicas(tmp_path):
+    cache, checkpoint = make_cache(tmp_path)
+    bound = cache.bind(checkpoint)
+    bound.device_ids = [1, 0]  # DataParallel把batch的前一半放在device_ids[0]上
+    bound.features = {torch.device('cuda', 0): torch.tensor([[2.], [3.]]),
+                      torch.device('cuda', 1): torch.tensor([[0.], [1.]])}
+    assert torch.equal(bound.take(4), torch.tensor([[0.], [1.], [2.], [3.]]))
+    assert bound.take(4).shape == (4, 0)
@@ -0,0 +1,96 @@
+# coding: utf-8
+
+import pytest
+import torch
+
+from models import build_model, example_inputs, unpack_score, LowRankLinear, decompose, factorize, prune_channels
+from models import save_frozen, load_frozen
+
+
+def outputs(model, inputs):
+    with torch.no_grad():
+        return unpack_score(model.eval()(*inputs))
+
+
+def test_lowrank_checkpoint_roundtrip(tmp_path):
+    model = build_model('AlexNet', num_classes=3)
+    lowrank = factorize(model, {'fc2': 64}, decompose(model, ['fc2']))  # fc1未分解，加载时保持不变
+    path = lowrank.save(str(tmp_path / 'lowrank.pth'))
+
+    loaded = build_model('AlexNet', num_classes=3)
+    loaded.load(path)
+    assert isinstance(loaded.fc2, LowRankLinear) and loaded.fc2.rank == 64
+    assert isinstance(loaded.fc1, torch.nn.Linear)
+    inputs = example_inputs('AlexNet', batch_size=2)
+    assert torch.allclose(outputs(loaded, inputs), outputs(lowrank, inputs))
+
+
+def test_load_does_not_change_other_models(tmp_path):
+    """各模型的层取自models/pretrained.py中的全局网络，加载结构不同的checkpoint时不能修改它们"""
+    model = build_model('AlexNet', num_classes=3)
+    model._unshare()
+    with torch.no_grad():
+        for param in model.conv1.parameters():
+            param.add_(1)
+    path = factorize(model, {'fc2': 16}).save(str(tmp_path / 'lowrank.pth'))
+
+    fresh = build_model('AlexNet', num_classes=3)
+    before = {k: v.clone() for k, v in fresh.state_dict().items()}
+    build_model('AlexNet', num_classes=3).load(path)
+    after = build_model('AlexNet', num_classes=3)
+    assert isinstance(after.fc2, torch.nn.Linear)
+    for k, v in after.state_dict().items():
+        if not k.startswith('fc3'):  # fc3每次随机初始化，其余的层来自pretrained.py
+            assert torch.equal(v, before[k]), k
+
+
+def test_teacher_load_does_not_change_student(tmp_path):
+    """distill.py在同一个进程中先加载teacher再build student，student的共享层应为原来的初始化"""
+    teacher = build_model('ContextResNet18', num_classes=3)
+    teacher._unshare()
+    with torch.no_grad():
+        teacher.bn1_1.running_mean.add_(1)  # 与ResNet18的bn1是pretrained.resnet18中的同一层，build时不重新初始化
+    path = teacher.save(str(tmp_path / 'teacher.pth'))
+
+    before = build_model('ResNet18', num_classes=3).bn1.running_mean.clone()
+    build_model('ContextResNet18', num_classes=3).load(path)
+    assert torch.equal(build_model('ResNet18', num_classes=3).bn1.running_mean, before)
+
+
+def test_pruned_checkpoint_roundtrip(tmp_path):
+    model = build_model('ResNet18', num_classes=3).eval()
+    before = {k: v.clone() for k, v in model.state_dict().items()}
+    pruned = prune_channels(model, 0.3)
+    path = pruned.save(str(tmp_path / 'pruned.pth'))
+    for k, v in model.state_dict().items():  # 不改变输入的model
+        assert torch.equal(v, before[k]), k
+
+    loaded = build_model('ResNet18', num_classes=3)
+    loaded.load(path)
+    shapes = {k: v.shape for k, v in pruned.state_dict().items()}
+    assert {k: v.shape for k, v in loaded.state_dict().items()} == shapes
+    assert sum(v.numel() for v in shapes.values()) < sum(v.numel() for v in before.values())
+    inputs = example_inputs('ResNet18', batch_size=2)
+    assert torch.allclose(outputs(loaded, inputs), outputs(pruned, inputs), atol=1e-5)
+    changed = [k for k, shape in shapes.items() if shape != before[k].shape]
+    fresh = build_model('ResNet18', num_classes=3).state_dict()  # 加载剪枝的checkpoint不改变pretrained.py中的共享层
+    assert changed and all(fresh[k].shape == before[k].shape for k in changed)
+
+
+@pytest.mark.parametrize('arch', ['PCResNet18', 'ContextShareNet', 'ResNet18'])
+def test_freeze_roundtrip(tmp_path, arch):
+    """PCResNet的两个输入、ContextShareNet的三个分支共用conv / bn，BN只能折叠一次"""
+    model = build_model(arch, num_classes=3)
+    model._unshare()
+    with torch.no_grad():  # pretrained的BN接近恒等变换，重复折叠时误差不明显
+        for module in model.modules():
+            if isinstance(module, torch.nn.BatchNorm2d):
+                module.running_mean.uniform_(-1, 1)
+                module.running_var.uniform_(0.5, 2)
+                module.weight.uniform_(0.5, 2)
+    path = model.save(str(tmp_path / 'model.pth'))
+    inputs = example_inputs(arch, batch_size=2)
+    save_frozen(model.freeze(inputs), path.replace('.pth', '_frozen.pt'))
+    frozen = load_frozen(path)
+    with torch.no_grad():
+        assert torch.allclose(unpack_score(frozen(*inputs)), outputs(model, inputs), atol=1e-3)
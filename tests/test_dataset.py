@@ -0,0 +1,31 @@
+# coding: utf-8
+
+import shutil
+import tempfile
+
+import pytest
+import torch
+
+from dataset import ContextVB_Dataset, Manifest_Dataset, make_synthetic
+
+
+@pytest.fixture
+def synthetic_root():
+    """make_synthetic的目录最多7级，pytest的tmp_path在macOS和CI上更深"""
+    root = tempfile.mkdtemp(dir='/tmp')
+    yield root
+    shutil.rmtree(root)
+
+
+def test_manifest_context_matches_contextvb(synthetic_root):
+    """上下两块脊骨与中间一块大小不同时，Manifest_Dataset的输入与训练时ContextVB_Dataset的输入相同"""
+    csv_path = [make_synthetic(synthetic_root, num_patients=2, vertebrae=5, min_size=40, max_size=300)['train_VBOri']]
+    context = ContextVB_Dataset(csv_path, phase='test', num_classes=3, usetrans=False, padding=True, balance=False)
+    manifest = list(Manifest_Dataset(csv_path, num_classes=3, num_inputs=3, padding=True))
+
+    assert len(manifest) == len(context)
+    for i, (row, images, label, path) in enumerate(manifest):
+        expected, labels, paths = context[i]
+        assert path == paths[1] and label == labels[1]
+        for x, y in zip(images, expected):
+            assert torch.equal(x, y)
@@ -0,0 +1,47 @@
+# coding: utf-8
+
+import torch
+
+from models import build_model, load_inference_model, example_inputs, unpack_score
+from ensemble import fuse_members
+
+
+def save_perturbed(arch, path, seed):
+    """保存一个所有参数都加了不同随机扰动的checkpoint"""
+    torch.manual_seed(seed)
+    model = build_model(arch, num_classes=3)
+    model._unshare()
+    with torch.no_grad():
+        for p in model.parameters():
+            p.add_(0.05 * torch.randn_like(p))
+    torch.save(model.state_dict(), path)
+    return model.state_dict()
+
+
+def test_members_keep_their_own_backbone(tmp_path):
+    paths = [str(tmp_path / 'a.pth'), str(tmp_path / 'b.pth')]
+    states = [save_perturbed('AlexNet', path, seed) for seed, path in enumerate(paths)]
+    models = [load_inference_model('AlexNet', path, 3, use_frozen=False) for path in paths]
+
+    for model, state in zip(models, states):  # 后加载的成员不能覆盖前一个成员的backbone
+        for k, v in model.state_dict().items():
+            assert torch.equal(v, state[k]), k
+
+    inputs = example_inputs('AlexNet', batch_size=2)
+    with torch.no_grad():
+        scores = [unpack_score(model(*inputs)) for model in models]
+    assert not torch.allclose(scores[0], scores[1])
+
+
+def test_fused_members_match_separate_forward(tmp_path):
+    paths = [str(tmp_path / 'a.pth'), str(tmp_path / 'b.pth')]
+    for seed, path in enumerate(paths):
+        save_perturbed('AlexNet', path, seed)
+    models = [load_inference_model('AlexNet', path, 3, use_frozen=False) for path in paths]
+
+    inputs = example_inputs('AlexNet', batch_size=2)
+    with torch.no_grad():
+        fused = fuse_members(models)(*inputs)
+        separate = torch.stack([unpack_score(model(*inputs)) for model in models])
+    assert fused.shape == (2, 2, 3)
+    assert torch.allclose(fused, separate, atol=1e-4)
@@ -0,0 +1,94 @@
+# coding: utf-8
+
+import numpy as np
+import torch
+
+from sklearn.metrics import roc_auc_score, average_precision_score
+
+from utils.metrics import Predictions, RankStats, ROCMeter, bootstrap_ci, confusion_metrics
+
+
+def make_predictions(probs, labels, paths=None):
+    probs = torch.as_tensor(probs, dtype=torch.float)
+    predictions = Predictions(len(labels), probs.size(1))
+    predictions.add(probs.log(), torch.as_tensor(labels), paths if paths else [f'p{i}/VB{i}.png' for i in range(len(labels))])
+    return predictions
+
+
+def test_bootstrap_2class_se_sp():
+    # 阈值0.5：正类全部判对(SE = 1)，负类全部判错(SP = 0)，每个replicate都相同
+    p1 = [0.9, 0.8, 0.7, 0.6, 0.55, 0.52]
+    labels = [1, 1, 1, 0, 0, 0]
+    ci = bootstrap_ci(make_predictions([[1 - p, p] for p in p1], labels), num_replicates=50, threshold=0.5)
+    assert ci['SE'] == [1.0, 1.0]
+    assert ci['SP'] == [0.0, 0.0]
+    assert ci['AUC'] == [1.0, 1.0]
+
+
+def test_bootstrap_2class_mixed():
+    # 2个正样本判对1个，4个负样本判对3个：SE = 0.5，SP = 0.75，按病人重采样的区间包含点估计
+    p1 = [0.9, 0.3, 0.2, 0.1, 0.4, 0.6]
+    labels = [1, 1, 0, 0, 0, 0]
+    ci = bootstrap_ci(make_predictions([[1 - p, p] for p in p1], labels), num_replicates=500, by='patient', threshold=0.5)
+    assert ci['SE'][0] <= 0.5 <= ci['SE'][1]
+    assert ci['SP'][0] <= 0.75 <= ci['SP'][1]
+    assert ci['SP'] != ci['SE']
+
+
+def test_bootstrap_3class_matches_confusion_metrics():
+    rng = np.random.RandomState(0)
+    labels = rng.randint(3, size=60)
+    probs = rng.dirichlet(np.ones(3), size=60)
+    probs[np.arange(60), labels] += 0.5
+    probs /= probs.sum(1, keepdims=True)
+    predictions = make_predictions(probs, labels)
+    accuracy, sp, se = confusion_metrics(predictions.cm)
+    ci = bootstrap_ci(predictions, num_replicates=500)
+    assert ci['accuracy'][0] <= accuracy <= ci['accuracy'][1]
+    for c in range(3):
+        assert ci[f'se{c}'][0] <= se[c] <= ci[f'se{c}'][1]
+        assert ci[f'sp{c}'][0] <= sp[c] <= ci[f'sp{c}'][1]
+
+
+def test_rank_stats_matches_sklearn():
+    rng = np.random.RandomState(0)
+    scores = np.round(rng.rand(200), 2)  # 有相同的score
+    positive = rng.rand(200) < 0.3
+    weights = rng.randint(0, 3, size=(4, 200)).astype(np.float64)
+    auc, ap = RankStats(scores, positive)(weights)
+    for i, w in enumerate(weights):
+        assert np.isclose(auc[i], roc_auc_score(positive, scores, sample_weight=w))
+        assert np.isclose(ap[i], average_precision_score(positive, scores, sample_weight=w))
+
+
+def test_roc_meter_matches_sklearn():
+    rng = np.random.RandomState(0)
+    labels = rng.randint(0, 2, 2000)
+    scores = np.clip(rng.normal(0.4 + 0.2 * labels, 0.15), 0, 1)
+    meter = ROCMeter(bins=10000)
+    meter.add(torch.from_numpy(scores), torch.from_numpy(labels))
+    auc, _, _ = meter.value()
+    assert abs(auc - roc_auc_score(labels, scores)) <= meter.error() + 1e-9
+
+    # 阈值在格子边界上，该阈值下的SE / SP是精确的
+    sp, se, threshold = meter.best()
+    predict = scores >= threshold
+    assert np.isclose(se, predict[labels == 1].mean()) and np.isclose(sp, 1 - predict[labels == 0].mean())
+
+
+def test_roc_meter_merge_and_weights():
+    rng = np.random.RandomState(1)
+    labels = rng.randint(0, 2, 500)
+    scores = rng.rand(500)
+    whole, first, second = ROCMeter(bins=100), ROCMeter(bins=100), ROCMeter(bins=100)
+    whole.add(scores, labels)
+    first.add(scores[:200], labels[:200])
+    second.add(scores[200:], labels[200:])
+    first += second
+    assert np.array_equal(whole.hist, first.hist)
+
+    # 权重为2与重复一次相同
+    weighted, repeated = ROCMeter(bins=100), ROCMeter(bins=100)
+    weighted.add(scores, labels, weights=np.full(500, 2.))
+    repeated.add(np.r_[scores, scores], np.r_[labels, labels])
+    assert np.array_equal(weighted.hist, repeated.hist)
@@ -0,0 +1,38 @@
+# coding: utf-8
+
+import pytest
+import torch
+
+from torch.nn import functional as F
+
+from utils import VIEWS, expand, tta_score
+
+
+def test_expand_orders_by_view():
+    image = torch.arange(2 * 1 * 2 * 2, dtype=torch.float).view(2, 1, 2, 2)
+    batch = expand(image, 4)
+    assert batch.shape == (8, 1, 2, 2)
+    assert torch.equal(batch[:2], image)
+    assert torch.equal(batch[2:4], image.flip(-1))
+    assert torch.equal(batch[4:6], image.flip(-2))
+    assert torch.equal(batch[6:], image.flip(-2, -1))
+
+    # Context模型的三块脊骨做同样的变换
+    triple = expand((image, image + 1, image + 2), 2)
+    assert all(torch.equal(x - i, triple[0]) for i, x in enumerate(triple))
+
+
+def test_tta_score_averages_view_probabilities():
+    def get_score(model, image):
+        return model(image.flatten(1))
+
+    model = torch.nn.Linear(16, 3)
+    image = torch.rand(5, 1, 4, 4)
+    with torch.no_grad():
+        score = tta_score(get_score, 4)(model, image)
+        expected = torch.stack([F.softmax(get_score(model, image.flip(dims)), dim=1)
+                                for dims in [(), (-1,), (-2,), (-2, -1)]]).mean(0)
+    assert torch.allclose(F.softmax(score, dim=1), expected, atol=1e-6)
+    assert tta_score(get_score, 1) is get_score
+    with pytest.raises(ValueError):
+        tta_score(get_score, len(VIEWS) + 1)
@@ -9,17 +9,17 @@ from tqdm import tqdm
 from pprint import pprint
 from torch.utils.data import DataLoader
 from torch.nn import functional
-from torchnet import meter
-from sklearn.metrics import roc_curve, roc_auc_score
 
 from config import config
 from dataset import VB_Dataset, ContextVB_Dataset
-from models import ContextNet
-from models import FocalLoss, LabelSmoothing
-from utils import Visualizer, write_csv, write_json, draw_ROC
+from models import ContextResNet18
+from models import FocalLoss, LabelSmoothing, build_model, model_head
+from utils import Visualizer, write_csv, write_json, draw_ROC, Timeline
+from utils import inference, roc_2class, metrics_2class, confusion_metrics, metrics_3class, bootstrap_ci, ROCMeter, PredictionCache
 
 
 def iter_train(**kwargs):
+    from torchnet import meter  # 只有训练时用到
     config.parse(kwargs)
 
     # ============================================ Visualization =============================================
@@ -56,9 +56,18 @@ def iter_train(**kwargs):
 
     train_dataloader = DataLoader(train_data, batch_size=config.batch_size, shuffle=True, num_workers=config.num_workers)
     val_dataloader = DataLoader(val_data, batch_size=config.batch_size, shuffle=False, num_workers=config.num_workers)
+    timeline = Timeline(config.timeline, trace_file=config.timeline_file, sync=config.use_gpu)
+    timeline.attach(train_dataloader_1)
+    timeline.attach(train_dataloader_2)
+    timeline.attach(train_dataloader_3)
+    timeline.attach(train_dataloader)
+    timeline.attach(val_dataloader)
 
     # ============================================= Prepare Model ============================================
-    model = ContextNet(num_classes=config.num_classes)
+    if config.arch:  # 命令行指定的模型优先
+        model = build_model(config.arch, num_classes=config.num_classes)
+    else:
+        model = ContextResNet18(num_classes=config.num_classes)  # 输出(score, diff1, diff2)
     print(model)
 
     if config.load_model_path:
@@ -105,7 +114,7 @@ def iter_train(**kwargs):
         process_record = {'loss': [],  # 用于记录实验过程中的曲线，便于画曲线图
                           'train_sp0': [], 'train_se0': [], 'train_sp1': [], 'train_se1': [], 'train_sp2': [], 'train_se2': [],
                           'val_sp0': [], 'val_se0': [], 'val_sp1': [], 'val_se1': [], 'val_sp2': [], 'val_se2': [],
-                          'train_mAP': [], 'val_mAP': []}
+                          'train_mAUC': [], 'val_mAUC': [], 'train_mAP': [], 'val_mAP': []}
     else:
         raise ValueError
 
@@ -117,47 +126,54 @@ def iter_train(**kwargs):
     train_iter_3 = iter(train_dataloader_3)
     model.train()
     while iteration < config.max_iter:
-        try:
-            image1, label1, image_path1 = next(train_iter_1)
-            image2, label2, image_path2 = next(train_iter_2)
-            image3, label3, image_path3 = next(train_iter_3)
-        except:
-            train_iter_1 = iter(train_dataloader_1)
-            train_iter_2 = iter(train_dataloader_2)
-            train_iter_3 = iter(train_dataloader_3)
-            image1, label1, image_path1 = next(train_iter_1)
-            image2, label2, image_path2 = next(train_iter_2)
-            image3, label3, image_path3 = next(train_iter_3)
+        with timeline.span('data'):
+            try:
+                image1, label1, image_path1 = next(train_iter_1)
+                image2, label2, image_path2 = next(train_iter_2)
+                image3, label3, image_path3 = next(train_iter_3)
+            except:
+                train_iter_1 = iter(train_dataloader_1)
+                train_iter_2 = iter(train_dataloader_2)
+                train_iter_3 = iter(train_dataloader_3)
+                image1, label1, image_path1 = next(train_iter_1)
+                image2, label2, image_path2 = next(train_iter_2)
+                image3, label3, image_path3 = next(train_iter_3)
 
         iteration += 1
 
         # ------------------------------------ prepare input ------------------------------------
         if config.use_gpu:
-            image1 = image1.cuda()
-            image2 = image2.cuda()
-            image3 = image3.cuda()
-            label1 = label1.cuda()
-            label2 = label2.cuda()
-            label3 = label3.cuda()
+            with timeline.span('h2d'):
+                image1 = image1.cuda()
+                image2 = image2.cuda()
+                image3 = image3.cuda()
+                label1 = label1.cuda()
+                label2 = label2.cuda()
+                label3 = label3.cuda()
 
         # ---------------------------------- go through the model --------------------------------
-        score, diff1, diff2 = model(image1, image2, image3)
+        with timeline.span('forward'):
+            score, diff1, diff2 = model(image1, image2, image3)
 
         # ----------------------------------- backpropagate -------------------------------------
         # 两支之间的feature加入L2 norm
-        optimizer.zero_grad()
-        loss = criterion(score, label2)
-        mse1_2 = MSELoss(diff1, torch.abs(label2 - label1).float())
-        mse2_3 = MSELoss(diff2, torch.abs(label2 - label3).float())
-        total_loss = loss + 0.1 * (mse1_2 + mse2_3)
-        total_loss.backward()
-        optimizer.step()
+        with timeline.span('loss'):
+            optimizer.zero_grad()
+            loss = criterion(score, label2)
+            mse1_2 = MSELoss(diff1, torch.abs(label2 - label1).float())
+            mse2_3 = MSELoss(diff2, torch.abs(label2 - label3).float())
+            total_loss = loss + 0.1 * (mse1_2 + mse2_3)
+        with timeline.span('backward'):
+            total_loss.backward()
+        with timeline.span('optimizer'):
+            optimizer.step()
 
         # ------------------------------------ record loss ------------------------------------
-        loss_meter.add(loss.item())
-        mse_meter1_2.add(mse1_2.item())
-        mse_meter2_3.add(mse2_3.item())
-        total_loss_meter.add(total_loss.item())
+        with timeline.span('metrics'):
+            loss_meter.add(loss.item())
+            mse_meter1_2.add(mse1_2.item())
+            mse_meter2_3.add(mse2_3.item())
+            total_loss_meter.add(total_loss.item())
 
         if iteration % config.print_freq == 0:
             tqdm.write(f"iter: [{iteration}/{config.max_iter}] {config.save_model_name[:-4]} ==================================")
@@ -165,21 +181,23 @@ def iter_train(**kwargs):
             # *************************************** validate ***************************************
             if config.num_classes == 2:  # 2分类
                 model.eval()
-                train_cm, train_AUC, train_sp, train_se, train_T, train_accuracy = val_2class(model, train_dataloader, train_dist)
-                val_cm, val_AUC, val_sp, val_se, val_T, val_accuracy = val_2class(model, val_dataloader, val_dist)
+                with timeline.span('eval'):
+                    train_cm, train_AUC, train_sp, train_se, train_T, train_accuracy = val_2class(model, train_dataloader, train_dist)
+                    val_cm, val_AUC, val_sp, val_se, val_T, val_accuracy = val_2class(model, val_dataloader, val_dist)
                 model.train()
 
                 # ------------------------------------ save model ------------------------------------
                 # if np.average(val_se) > previous_avgse:  # 当测试集上的平均sensitivity升高时保存模型
                 if val_AUC > previous_AUC:  # 当测试集上的AUC升高时保存模型
-                    if config.parallel:
-                        if not os.path.exists(os.path.join('checkpoints', save_model_dir, save_model_name[:-4])):
-                            os.makedirs(os.path.join('checkpoints', save_model_dir, save_model_name[:-4]))
-                        model.module.save(os.path.join('checkpoints', save_model_dir, save_model_name[:-4], save_model_name))
-                    else:
-                        if not os.path.exists(os.path.join('checkpoints', save_model_dir, save_model_name[:-4])):
-                            os.makedirs(os.path.join('checkpoints', save_model_dir, save_model_name[:-4]))
-                        model.save(os.path.join('checkpoints', save_model_dir, save_model_name[:-4], save_model_name))
+                    with timeline.span('checkpoint'):
+                        if config.parallel:
+                            if not os.path.exists(os.path.join('checkpoints', save_model_dir, save_model_name[:-4])):
+                                os.makedirs(os.path.join('checkpoints', save_model_dir, save_model_name[:-4]))
+                            model.module.save(os.path.join('checkpoints', save_model_dir, save_model_name[:-4], save_model_name))
+                        else:
+                            if not os.path.exists(os.path.join('checkpoints', save_model_dir, save_model_name[:-4])):
+                                os.makedirs(os.path.join('checkpoints', save_model_dir, save_model_name[:-4]))
+                            model.save(os.path.join('checkpoints', save_model_dir, save_model_name[:-4], save_model_name))
                     # previous_avgse = np.average(val_se)
                     previous_AUC = val_AUC
                     save_iter = iteration
@@ -218,20 +236,22 @@ def iter_train(**kwargs):
 
             elif config.num_classes == 3:  # 3分类
                 model.eval()
-                train_cm, train_mAP, train_sp, train_se, train_accuracy = val_3class(model, train_dataloader, train_data_scale)
-                val_cm, val_mAP, val_sp, val_se, val_accuracy = val_3class(model, val_dataloader, val_data_scale)
+                with timeline.span('eval'):
+                    train_cm, train_mAP, train_sp, train_se, train_mAUC, train_accuracy = val_3class(model, train_dataloader, train_data_scale)
+                    val_cm, val_mAP, val_sp, val_se, val_mAUC, val_accuracy = val_3class(model, val_dataloader, val_data_scale)
                 model.train()
 
                 # ------------------------------------ save model ------------------------------------
                 if val_mAP > previous_mAP:  # 当测试集上的AUC升高时保存模型
-                    if config.parallel:
-                        if not os.path.exists(os.path.join('checkpoints', save_model_dir, save_model_name[:-4])):
-                            os.makedirs(os.path.join('checkpoints', save_model_dir, save_model_name[:-4]))
-                        model.module.save(os.path.join('checkpoints', save_model_dir, save_model_name[:-4], save_model_name))
-                    else:
-                        if not os.path.exists(os.path.join('checkpoints', save_model_dir, save_model_name[:-4])):
-                            os.makedirs(os.path.join('checkpoints', save_model_dir, save_model_name[:-4]))
-                        model.save(os.path.join('checkpoints', save_model_dir, save_model_name[:-4], save_model_name))
+                    with timeline.span('checkpoint'):
+                        if config.parallel:
+                            if not os.path.exists(os.path.join('checkpoints', save_model_dir, save_model_name[:-4])):
+                                os.makedirs(os.path.join('checkpoints', save_model_dir, save_model_name[:-4]))
+                            model.module.save(os.path.join('checkpoints', save_model_dir, save_model_name[:-4], save_model_name))
+                        else:
+                            if not os.path.exists(os.path.join('checkpoints', save_model_dir, save_model_name[:-4])):
+                                os.makedirs(os.path.join('checkpoints', save_model_dir, save_model_name[:-4]))
+                            model.save(os.path.join('checkpoints', save_model_dir, save_model_name[:-4], save_model_name))
                     previous_mAP = val_mAP
                     save_iter = iteration
 
@@ -243,6 +263,7 @@ def iter_train(**kwargs):
                 process_record['train_se1'].append(train_se[1])
                 process_record['train_sp2'].append(train_sp[2])
                 process_record['train_se2'].append(train_se[2])
+                process_record['train_mAUC'].append(float(train_mAUC))
                 process_record['train_mAP'].append(float(train_mAP))
                 process_record['val_sp0'].append(val_sp[0])
                 process_record['val_se0'].append(val_se[0])
@@ -250,6 +271,7 @@ def iter_train(**kwargs):
                 process_record['val_se1'].append(val_se[1])
                 process_record['val_sp2'].append(val_sp[2])
                 process_record['val_se2'].append(val_se[2])
+                process_record['val_mAUC'].append(float(val_mAUC))
                 process_record['val_mAP'].append(float(val_mAP))
 
                 # vis.plot_many({'mse': mse_meter.value()[0], 'total_loss': total_loss_meter.value()[0]})
@@ -276,6 +298,7 @@ def iter_train(**kwargs):
                 print('train_se0:', round(train_se[0], 4), 'train_se1:', round(train_se[1], 4), 'train_se2:', round(train_se[2], 4))
                 print('val_sp0:', round(val_sp[0], 4), 'val_sp1:', round(val_sp[1], 4), 'val_sp2:', round(val_sp[2], 4))
                 print('val_se0:', round(val_se[0], 4), 'val_se1:', round(val_se[1], 4), 'val_se2:', round(val_se[2], 4))
+                print('train_mAUC:', train_mAUC, 'val_mAUC:', val_mAUC)
                 print('train_mAP:', train_mAP, 'val_mAP:', val_mAP, 'mSP:', round(sum(val_sp)/3, 5), 'mSE:', round(sum(val_se)/3, 5))
                 print('train_cm:')
                 print(train_cm)
@@ -284,101 +307,34 @@ def iter_train(**kwargs):
                 print('Best mAP:', previous_mAP)
 
             loss_meter.reset()
+            if timeline.enabled:
+                print(timeline.report())
 
         # ------------------------------------ save record ------------------------------------
         if os.path.exists(os.path.join('checkpoints', save_model_dir, save_model_name.split('.')[0])):
-            write_json(file=os.path.join('checkpoints', save_model_dir, save_model_name.split('.')[0], 'process_record.json'), content=process_record)
+            with timeline.span('checkpoint'):
+                write_json(file=os.path.join('checkpoints', save_model_dir, save_model_name.split('.')[0], 'process_record.json'), content=process_record)
 
     # vis.log(f"Best Iter: {save_iter}")
     print("Best Iter:", save_iter)
+    timeline.save()
 
 
-def val_2class(model, dataloader, dist):
-    # ============================ Prepare Metrics ==========================
-    # val_cm = meter.ConfusionMeter(config.num_classes)
-    # val_AUC = meter.AUCMeter()
-    y_true, y_scores = [], []
-
-    softmax = functional.softmax
-
-    # ================================ Validate ==============================
-    for i, (image, label, image_path) in tqdm(enumerate(dataloader)):
-
-        # ******************* prepare input and go through the model *******************
-        if config.use_gpu:
-            image = image.cuda()
-            label = label.cuda()
-        image.requires_grad = False
-        label.requires_grad = False
-
-        score, _, _, _ = model(image, image)
-
-        # *********************** confusion matrix and AUC ***********************
-        # val_cm.add(softmax(score, dim=1).data, label.data)
-        positive_score = np.array([item[1] for item in softmax(score, dim=1).data.cpu().numpy().tolist()])
-        # val_AUC.add(positive_score, label.data)
-        y_true.extend(label.data.cpu().numpy().tolist())  # 用于sklearn计算AUC和ROC
-        y_scores.extend(positive_score.tolist())
-
-    # ************************** TPR, FPR, AUC ******************************
-    SKL_FPR, SKL_TPR, SKL_Thresholds = roc_curve(y_true, y_scores)
-    SKL_AUC = roc_auc_score(np.array(y_true), np.array(y_scores), average='weighted')
+def get_score(model, image):
+    score, *_ = model(*image)  # 三块脊骨，第一个输出为分类score
+    return score
 
-    # ******************** Best SE, SP, Thresh, Matrix ***********************
-    best_index = np.argmax(SKL_TPR - SKL_FPR, axis=0)
-    best_SE, best_SP, best_T = SKL_TPR[best_index], 1 - SKL_FPR[best_index], SKL_Thresholds[best_index]
-    best_confusion_matrix = [[int(round(dist['0'] * best_SP)), int(round(dist['0'] * (1 - best_SP)))],
-                             [int(round(dist['1'] * (1 - best_SE))), int(round(dist['1'] * best_SE))]]
 
-    # *********************** accuracy and sensitivity ***********************
-    val_accuracy = 100. * sum([best_confusion_matrix[c][c] for c in range(config.num_classes)]) / np.sum(best_confusion_matrix)
-    # val_se = [100. * best_confusion_matrix[i][i] / np.sum(best_confusion_matrix[i]) for i in range(config.num_classes)]
-
-    return best_confusion_matrix, SKL_AUC, best_SP, best_SE, best_T, val_accuracy
+def val_2class(model, dataloader, dist):
+    predictions = inference(model, dataloader, get_score, config.num_classes, use_gpu=config.use_gpu,
+                            batch_size=config.eval_batch_size, roc_bins=config.roc_bins)
+    return metrics_2class(predictions, dist)
 
 
 def val_3class(model, dataloader, data_scale):
-    # ============================ Prepare Metrics ==========================
-    val_cm = meter.ConfusionMeter(config.num_classes)
-    val_mAP = meter.mAPMeter()
-
-    softmax = functional.softmax
-
-    # ================================ Validate ==============================
-    for i, (image, label, image_path) in tqdm(enumerate(dataloader)):
-
-        # ******************* prepare input and go through the model *******************
-        if config.use_gpu:
-            last_image, cur_image, next_image = image[0].cuda(), image[1].cuda(), image[2].cuda()
-            last_label, cur_label, next_label = label[0].cuda(), label[1].cuda(), label[2].cuda()
-        else:
-            last_image, cur_image, next_image = image[0], image[1], image[2]
-            last_label, cur_label, next_label = label[0], label[1], label[2]
-
-        last_image.requires_grad = False
-        cur_image.requires_grad = False
-        next_image.requires_grad = False
-        last_label.requires_grad = False
-        cur_label.requires_grad = False
-        next_label.requires_grad = False
-
-        score, _, _ = model(last_image, cur_image, next_image)
-
-        # *********************** confusion matrix and mAP ***********************
-        one_hot = torch.zeros(cur_label.size(0), 3).scatter_(1, cur_label.data.cpu().unsqueeze(1), 1)
-
-        val_cm.add(softmax(score, dim=1).data, cur_label.data)
-        val_mAP.add(softmax(score, dim=1).data, one_hot)
-
-    # *********************** accuracy and sensitivity ***********************
-    val_cm = val_cm.value()
-    val_accuracy = 100. * sum([val_cm[c][c] for c in range(config.num_classes)]) / val_cm.sum()
-    val_sp = [100. * (val_cm.sum() - val_cm.sum(0)[i] - val_cm.sum(1)[i] + val_cm[i][i]) / (val_cm.sum() - val_cm.sum(1)[i])
-              for i in range(config.num_classes)]
-    val_se = [100. * val_cm[i][i] / val_cm.sum(1)[i] for i in range(config.num_classes)]
-    val_cm = val_cm / np.expand_dims(np.array(data_scale), axis=1)  # 计算指标时按照balance后的matrix来算，展示的时候还原
-
-    return val_cm.astype(dtype=np.int32), val_mAP.value().numpy(), val_sp, val_se, val_accuracy
+    predictions = inference(model, dataloader, get_score, config.num_classes, use_gpu=config.use_gpu,
+                            batch_size=config.eval_batch_size)
+    return metrics_3class(predictions, data_scale)
 
 
 def test_2class(**kwargs):
@@ -393,7 +349,10 @@ def test_2class(**kwargs):
     print('Test Image:', test_data.__len__())
 
     # ============================================= Prepare Model ============================================
-    model = ContextNet(num_classes=config.num_classes)
+    if config.arch:  # 命令行指定的模型优先
+        model = build_model(config.arch, num_classes=config.num_classes)
+    else:
+        model = ContextResNet18(num_classes=config.num_classes)  # 输出(score, diff1, diff2)
     print(model)
 
     if config.load_model_path:
@@ -407,63 +366,30 @@ def test_2class(**kwargs):
         model = torch.nn.DataParallel(model, device_ids=list(range(config.num_of_gpu)))
     model.eval()
 
-    # =========================================== Prepare Metrics =====================================
-    test_cm = meter.ConfusionMeter(config.num_classes)
-    test_AUC = meter.AUCMeter()
-    softmax = functional.softmax
-    results = []
-    y_true, y_scores = [], []
-
     # =========================================== Test ============================================
-    for i, (image, label, image_path) in tqdm(enumerate(test_dataloader)):
-        # ******************* prepare input and go through the model *******************
-        if config.use_gpu:
-            last_image, cur_image, next_image = image[0].cuda(), image[1].cuda(), image[2].cuda()
-            last_label, cur_label, next_label = label[0].cuda(), label[1].cuda(), label[2].cuda()
-        else:
-            last_image, cur_image, next_image = image[0], image[1], image[2]
-            last_label, cur_label, next_label = label[0], label[1], label[2]
-
-        last_image.requires_grad = False
-        cur_image.requires_grad = False
-        next_image.requires_grad = False
-        last_label.requires_grad = False
-        cur_label.requires_grad = False
-        next_label.requires_grad = False
-
-        # score = model(last_image, cur_image, next_image)
-        score, diff1, diff2 = model(last_image, cur_image, next_image)
-
-        # *************************** confusion matrix and AUC *************************
-        test_cm.add(softmax(score, dim=1).data, cur_label.data)
-        positive_score = np.array([item[1] for item in softmax(score, dim=1).data.cpu().numpy().tolist()])
-        test_AUC.add(positive_score, cur_label.data)  # torchnet计算AUC和ROC
-
-        y_true.extend(cur_label.data.cpu().numpy().tolist())  # 用于sklearn计算AUC和ROC
-        y_scores.extend(positive_score.tolist())
-
-        # ******************************** record prediction results ******************************
-        for l, p, ip in zip(cur_label.detach(), softmax(score, dim=1).detach(), image_path):
-            if p[1] < 0.5:
-                results.append((ip, int(l), 0, round(float(p[0]), 4), round(float(p[1]), 4)))
-            else:
-                results.append((ip, int(l), 1, round(float(p[0]), 4), round(float(p[1]), 4)))
+    cache = PredictionCache(config.cache_path, config.cache_max_mb).bind(
+        config.load_model_path, model, model_head(model), useRGB=config.useRGB, padding=config.padding,
+        tta=config.tta) if config.use_cache and config.load_model_path else None
+    predictions = inference(model, test_dataloader, get_score, config.num_classes, use_gpu=config.use_gpu,
+                            batch_size=config.eval_batch_size, tta=config.tta, cache=cache)
+    probs = predictions.probs.numpy()
+
+    # ******************************** record prediction results ******************************
+    results = [(ip, int(l), int(p[1] >= 0.5), round(float(p[0]), 4), round(float(p[1]), 4))
+               for ip, l, p in zip(predictions.paths, predictions.labels, probs)]
 
     # ************************** TPR, FPR, AUC ******************************
-    SKL_FPR, SKL_TPR, SKL_Thresholds = roc_curve(y_true, y_scores)
-    SKL_AUC = roc_auc_score(np.array(y_true), np.array(y_scores), average='weighted')
+    SKL_FPR, SKL_TPR, SKL_Thresholds, SKL_AUC, best_index = roc_2class(predictions)
 
-    TNet_AUC, TNet_TPR, TNet_FPR = test_AUC.value()
+    test_AUC = ROCMeter(config.roc_bins if config.roc_bins else 10000)
+    test_AUC.add(probs[:, 1], predictions.labels)  # 直方图计算AUC和ROC
+    Hist_AUC, Hist_TPR, Hist_FPR = test_AUC.value()
 
     # ******************** Best SE, SP, Thresh, Matrix ***********************
-    best_index = np.argmax(SKL_TPR - SKL_FPR, axis=0)
-    best_SE, best_SP, best_T = SKL_TPR[best_index], 1 - SKL_FPR[best_index], SKL_Thresholds[best_index]
-    best_confusion_matrix = [[int(round(test_dist['0'] * best_SP)), int(round(test_dist['0'] * (1 - best_SP)))],
-                             [int(round(test_dist['1'] * (1 - best_SE))), int(round(test_dist['1'] * best_SE))]]
+    best_confusion_matrix, _, best_SP, best_SE, best_T, _ = metrics_2class(predictions, test_dist)
 
     # *********************** accuracy and sensitivity ***********************
-    test_accuracy = 100. * sum([test_cm.value()[c][c] for c in range(config.num_classes)]) / np.sum(test_cm.value())
-    test_se = [100. * test_cm.value()[i][i] / np.sum(test_cm.value()[i]) for i in range(config.num_classes)]
+    test_accuracy, _, test_se = confusion_metrics(predictions.cm)
 
     # ================================ Save and Print Prediction Results ===========================
     if config.result_file:
@@ -473,11 +399,18 @@ def test_2class(**kwargs):
 
     print('test_acc:', test_accuracy)
     print('test_avgse:', round(np.average(test_se), 4), 'train_se0:', round(test_se[0], 4), 'train_se1:', round(test_se[1], 4))
-    print('SKL_AUC:', SKL_AUC, 'TNet_AUC:', TNet_AUC)
+    print('SKL_AUC:', SKL_AUC, 'Hist_AUC:', Hist_AUC, '(error <=', round(test_AUC.error(), 6), ')')
     print('Best_SE:', best_SE, 'Best_SP:', best_SP, 'Best_Threshold:', best_T)
     print('test_cm:')
     print(best_confusion_matrix)
 
+    # ============================= Bootstrap Confidence Intervals =============================
+    if config.bootstrap:  # 按病人 / 脊骨重采样的95%置信区间
+        test_ci = bootstrap_ci(predictions, config.bootstrap, by=config.bootstrap_by, threshold=best_T)
+        write_json(os.path.join('results', config.load_model_path.split('/')[-1][:-4] + '_ci.json'), test_ci)
+        for name, interval in test_ci.items():
+            print(f'test_{name} 95% CI:', interval)
+
 
 def test_3class(**kwargs):
     config.parse(kwargs)
@@ -493,7 +426,10 @@ def test_3class(**kwargs):
     print('Test Data Distribution:', test_dist)
 
     # ============================================= Prepare Model ============================================
-    model = ContextNet(num_classes=config.num_classes)
+    if config.arch:  # 命令行指定的模型优先
+        model = build_model(config.arch, num_classes=config.num_classes)
+    else:
+        model = ContextResNet18(num_classes=config.num_classes)  # 输出(score, diff1, diff2)
     print(model)
 
     if config.load_model_path:
@@ -507,55 +443,21 @@ def test_3class(**kwargs):
         model = torch.nn.DataParallel(model, device_ids=[x for x in range(config.num_of_gpu)])
     model.eval()
 
-    # ============================ Prepare Metrics ==========================
-    test_cm = meter.ConfusionMeter(config.num_classes)
-    test_mAP = meter.mAPMeter()
-    results = []
-
-    softmax = functional.softmax
-
     # ================================== Test ===============================
-    for i, (image, label, image_path) in tqdm(enumerate(test_dataloader)):
-
-        # ******************* prepare input and go through the model *******************
-        if config.use_gpu:
-            last_image, cur_image, next_image = image[0].cuda(), image[1].cuda(), image[2].cuda()
-            last_label, cur_label, next_label = label[0].cuda(), label[1].cuda(), label[2].cuda()
-        else:
-            last_image, cur_image, next_image = image[0], image[1], image[2]
-            last_label, cur_label, next_label = label[0], label[1], label[2]
-
-        last_image.requires_grad = False
-        cur_image.requires_grad = False
-        next_image.requires_grad = False
-        last_label.requires_grad = False
-        cur_label.requires_grad = False
-        next_label.requires_grad = False
-
-        score, diff1, diff2 = model(last_image, cur_image, next_image)
-
-        # *********************** confusion matrix and mAP ***********************
-        one_hot = torch.zeros(cur_label.size(0), 3).scatter_(1, cur_label.data.cpu().unsqueeze(1), 1)
-
-        test_cm.add(softmax(score, dim=1).data, cur_label.data)
-        test_mAP.add(softmax(score, dim=1).data, one_hot)
-
-        # ******************************** record prediction results ******************************
-        for l, p, ip in zip(cur_label.detach(), softmax(score, dim=1).detach(), image_path):
-            if p[0] > p[1] and p[0] > p[2]:
-                results.append((ip, int(l), 0, round(float(p[0]), 4), round(float(p[1]), 4), round(float(p[2]), 4)))
-            elif p[1] > p[0] and p[1] > p[2]:
-                results.append((ip, int(l), 1, round(float(p[0]), 4), round(float(p[1]), 4), round(float(p[2]), 4)))
-            else:
-                results.append((ip, int(l), 2, round(float(p[0]), 4), round(float(p[1]), 4), round(float(p[2]), 4)))
+    cache = PredictionCache(config.cache_path, config.cache_max_mb).bind(
+        config.load_model_path, model, model_head(model), useRGB=config.useRGB, padding=config.padding,
+        tta=config.tta) if config.use_cache and config.load_model_path else None
+    predictions = inference(model, test_dataloader, get_score, config.num_classes, use_gpu=config.use_gpu,
+                            batch_size=config.eval_batch_size, tta=config.tta, cache=cache,
+                            dedup=True)  # upsample重复的样本只forward一次
+    probs = predictions.probs.numpy()
+
+    # ******************************** record prediction results ******************************
+    results = [(ip, int(l), int(np.argmax(p)), round(float(p[0]), 4), round(float(p[1]), 4), round(float(p[2]), 4))
+               for ip, l, p in zip(predictions.paths, predictions.labels, probs)]
 
     # ================================== accuracy and sensitivity ==================================
-    test_cm = test_cm.value()
-    test_accuracy = 100. * sum([test_cm[c][c] for c in range(config.num_classes)]) / test_cm.sum()
-    test_sp = [100. * (test_cm.sum() - test_cm.sum(0)[i] - test_cm.sum(1)[i] + test_cm[i][i]) / (test_cm.sum() - test_cm.sum(1)[i])
-               for i in range(config.num_classes)]
-    test_se = [100. * test_cm[i][i] / test_cm.sum(1)[i] for i in range(config.num_classes)]
-    test_cm = test_cm / np.expand_dims(np.array(test_scale), axis=1)  # 计算指标时按照balance后的matrix来算，展示的时候还原
+    test_cm, test_mAP, test_sp, test_se, test_mAUC, test_accuracy = metrics_3class(predictions, test_scale)
 
     # ================================ Save and Print Prediction Results ===========================
     if config.result_file:
@@ -564,10 +466,17 @@ def test_3class(**kwargs):
     print('test_acc:', test_accuracy)
     print('test_sp0:', test_sp[0], 'test_sp1:', test_sp[1], 'test_sp2:', test_sp[2])
     print('test_se0:', test_se[0], 'test_se1:', test_se[1], 'test_se2:', test_se[2])
-    print('test_mAP:', test_mAP.value().numpy())
+    print('test_mAP:', test_mAP)
     print('test_cm:')
     print(test_cm.astype(dtype=np.int32))
 
+    # ============================= Bootstrap Confidence Intervals =============================
+    if config.bootstrap:  # 按病人 / 脊骨重采样的95%置信区间
+        test_ci = bootstrap_ci(predictions, config.bootstrap, by=config.bootstrap_by)
+        write_json(os.path.join('results', config.load_model_path.split('/')[-1][:-4] + '_ci.json'), test_ci)
+        for name, interval in test_ci.items():
+            print(f'test_{name} 95% CI:', interval)
+
 
 if __name__ == '__main__':
     fire.Fire({
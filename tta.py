@@ -0,0 +1,60 @@
+# coding: utf-8
+
+import os
+import time
+import fire
+
+from config import config
+from models import load_inference_model, adapt_inputs, unpack_score
+from utils import inference, roc_2class, mean_ap, mean_auc, confusion_metrics, write_csv, write_json
+from compress import build_dataloader
+
+
+def report(**kwargs):
+    """
+    不同view个数下的测试指标和每张图的耗时，gain和cost都相对于单个view，结果保存为<checkpoint>_tta.csv / .json
+
+    python tta.py report --arch=ResNet18 --load_model_path=xxx.pth --tta_list=[1,2,4,8]
+    """
+    config.parse(kwargs)
+    device = 'cuda' if config.use_gpu and not config.quantized else 'cpu'
+    model = load_inference_model(config.arch, config.load_model_path, config.num_classes, device=device,
+                                 quantized=config.quantized, backend=config.quantize_backend,
+                                 use_frozen=config.use_frozen)
+    dataloader = build_dataloader(config.test_paths)
+
+    def get_score(m, x):
+        return unpack_score(m(*adapt_inputs(config.arch, x)))
+
+    rows = []
+    for k in [1] + [k for k in config.tta_list if k != 1]:  # 单个view是gain和cost的基准，不在tta_list中时也先计算
+        start = time.perf_counter()
+        predictions = inference(model, dataloader, get_score, config.num_classes, use_gpu=device == 'cuda',
+                                batch_size=config.eval_batch_size, tta=k)
+        per_image_ms = (time.perf_counter() - start) * 1000 / predictions.count
+
+        row = {'tta': k, 'accuracy': round(float(confusion_metrics(predictions.cm)[0]), 4),
+               'per_image_ms': round(per_image_ms, 3)}
+        if config.num_classes == 2:
+            row['AUC'] = round(float(roc_2class(predictions)[3]), 4)
+        else:
+            row['mAP'] = round(float(mean_ap(predictions)), 4)
+            row['mAUC'] = round(float(mean_auc(predictions)), 4)
+        rows.append(row)
+
+    metric = 'AUC' if config.num_classes == 2 else 'mAP'
+    baseline = rows[0]
+    for row in rows:
+        row[metric + '_gain'] = round(row[metric] - baseline[metric], 4)
+        row['cost'] = round(row['per_image_ms'] / baseline['per_image_ms'], 2)
+        print(row)
+
+    save_path = os.path.splitext(config.load_model_path)[0] + '_tta'
+    write_csv(file=save_path + '.csv', tag=list(rows[0].keys()), content=[list(row.values()) for row in rows])
+    write_json(file=save_path + '.json', content=rows)
+
+
+if __name__ == '__main__':
+    fire.Fire({
+        'report': report
+    })
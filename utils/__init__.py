@@ -1,2 +1,31 @@
-from .visualize import Visualizer
-from .utils import write_csv, write_json, draw_ROC
+from importlib import import_module
+
+# 导出的名字 -> 所在的子模块。子模块在第一次访问时才import(PEP 562的模块__getattr__)，
+# 如只用write_csv时不会import sklearn / visdom / matplotlib
+EXPORTS = {
+    'Visualizer': 'visualize',
+    'write_csv': 'utils', 'write_json': 'utils', 'draw_ROC': 'utils',
+    'measure_latency': 'latency',
+    'Timeline': 'timeline',
+    'Predictions': 'metrics', 'roc_2class': 'metrics', 'metrics_2class': 'metrics', 'confusion_metrics': 'metrics',
+    'mean_auc': 'metrics', 'mean_ap': 'metrics', 'metrics_3class': 'metrics',
+    'unique_samples': 'metrics', 'bootstrap_ci': 'metrics', 'ROCMeter': 'metrics',
+    'inference': 'evaluate',
+    'VIEWS': 'tta', 'expand': 'tta', 'tta_score': 'tta',
+    'PredictionCache': 'cache', 'BoundCache': 'cache',
+    'GradCAM': 'gradcam',
+    'CAMWriter': 'cam_archive', 'CAMArchive': 'cam_archive',
+    'RetrievalIndex': 'retrieval',
+}
+
+
+def __getattr__(name):
+    if name not in EXPORTS:
+        raise AttributeError(f'module {__name__} has no attribute {name}')
+    value = getattr(import_module('.' + EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(EXPORTS))
@@ -0,0 +1,138 @@
+# coding: utf-8
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import torch
+import numpy as np
+
+
+def file_hash(path, chunk_size=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class PredictionCache(object):
+    """
+    磁盘上的预测缓存(单个sqlite文件)，key = sha1(checkpoint内容, 预处理参数, 图片内容)，保存logits和倒数第二层特征。
+    总大小超过max_mb时按最近使用时间淘汰
+
+    :param path: sqlite文件
+    :param max_mb: 缓存的大小上限
+    """
+    def __init__(self, path, max_mb=1024):
+        if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        self.max_bytes = max_mb * (1 << 20)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime REAL, size INTEGER, hash TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS predictions '
+                        '(key TEXT PRIMARY KEY, logits BLOB, features BLOB, nbytes INTEGER, atime REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS predictions_atime ON predictions (atime)')
+        self.nbytes = self.db.execute('SELECT COALESCE(SUM(nbytes), 0) FROM predictions').fetchone()[0]
+
+    def file_hash(self, path):
+        """图片内容的hash，按(路径, mtime, 大小)记住，文件没有改动时不再重新读取"""
+        stat = os.stat(path)
+        row = self.db.execute('SELECT hash FROM files WHERE path = ? AND mtime = ? AND size = ?',
+                              (path, stat.st_mtime, stat.st_size)).fetchone()
+        if row:
+            return row[0]
+        digest = file_hash(path)
+        self.db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)', (path, stat.st_mtime, stat.st_size, digest))
+        return digest
+
+    def bind(self, checkpoint, model=None, head=None, **prep):
+        return BoundCache(self, checkpoint, model, head, **prep)
+
+    def get(self, keys):
+        """:return: {key: (logits, features)}"""
+        hits, now = {}, time.time()
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self.db.execute(f'SELECT key, logits, features FROM predictions WHERE key IN '
+                                   f'({",".join("?" * len(chunk))})', chunk).fetchall()
+            for key, logits, features in rows:
+                hits[key] = (np.frombuffer(logits, dtype=np.float32), np.frombuffer(features, dtype=np.float16))
+            self.db.executemany('UPDATE predictions SET atime = ? WHERE key = ?', [(now, key) for key, _, _ in rows])
+        self.db.commit()
+        return hits
+
+    def put(self, keys, logits, features):
+        """:param logits: (N, num_classes)  :param features: (N, D)，D可以为0"""
+        rows, now = [], time.time()
+        for key, l, f in zip(keys, np.asarray(logits, dtype=np.float32), np.asarray(features, dtype=np.float16)):
+            rows.append((key, l.tobytes(), f.tobytes(), l.nbytes + f.nbytes, now))
+        self.db.executemany('INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?)', rows)
+        self.nbytes += sum(row[3] for row in rows)
+        self.evict()
+        self.db.commit()
+
+    def evict(self):
+        if self.nbytes <= self.max_bytes:
+            return
+        self.nbytes = self.db.execute('SELECT COALESCE(SUM(nbytes), 0) FROM predictions').fetchone()[0]
+        removed = []
+        for key, nbytes in self.db.execute('SELECT key, nbytes FROM predictions ORDER BY atime'):
+            if self.nbytes <= self.max_bytes * 0.9:  # 多删一些，避免每个batch都触发淘汰
+                break
+            removed.append((key,))
+            self.nbytes -= nbytes
+        self.db.executemany('DELETE FROM predictions WHERE key = ?', removed)
+
+
+class BoundCache(object):
+    """
+    绑定到一个checkpoint和一组预处理参数的缓存，并在分类层上挂forward pre-hook取倒数第二层特征。
+    DataParallel时每个GPU上的replica各调用一次hook，按device_ids的顺序拼回整个batch
+
+    :param head: 分类层的名字(models.model_head)，为None时只缓存logits
+    :param prep: 影响输出的预处理参数，如useRGB、padding、tta
+    """
+    def __init__(self, cache, checkpoint, model=None, head=None, **prep):
+        self.cache = cache
+        self.features = {}  # device -> 这个device上的一段batch的特征
+        self.handle = None
+        self.device_ids = getattr(model, 'device_ids', None) if isinstance(model, torch.nn.DataParallel) else None
+        prep['scripted'] = isinstance(getattr(model, 'module', model), torch.jit.ScriptModule)  # int8 / 冻结的推理图
+        self.prefix = hashlib.sha1((cache.file_hash(checkpoint) + json.dumps(prep, sort_keys=True)).encode()).hexdigest()
+        if model is not None and head is not None:
+            self.handle = getattr(model, 'module', model).get_submodule(head).register_forward_pre_hook(self.hook)
+
+    def hook(self, module, inputs):
+        device = inputs[0].device  # DataParallel时各replica在不同的线程中调用，每个device只写自己的key
+        if device not in self.features:  # PC模型一次forward调用两次分类层，第一次对应分类score
+            self.features[device] = inputs[0].detach().flatten(1)
+
+    def key(self, paths):
+        """:param paths: 一张图的路径，或Context模型的三元组"""
+        paths = [paths] if isinstance(paths, str) else paths
+        return hashlib.sha1('|'.join([self.prefix] + [self.cache.file_hash(p) for p in paths]).encode()).hexdigest()
+
+    def get(self, keys):
+        return self.cache.get(keys)
+
+    def reset(self):
+        self.features = {}
+
+    def take(self, n):
+        """:return: 上一次forward的特征(n, D)，TTA时对K个view取平均"""
+        features, self.features = self.features, {}
+        if not features:
+            return torch.zeros(n, 0)
+        order = sorted(features, key=lambda d: self.device_ids.index(d.index) if self.device_ids else 0)
+        features = torch.cat([features[d].float().cpu() for d in order])  # DataParallel按device_ids的顺序切分batch
+        return features.view(-1, n, features.size(1)).mean(0)
+
+    def put(self, keys, logits, features):
+        self.cache.put(keys, logits, features)
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.remove()
+        self.cache.db.commit()
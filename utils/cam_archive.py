@@ -0,0 +1,118 @@
+# coding: utf-8
+
+import os
+import csv
+import json
+import numpy as np
+
+
+class CAMWriter(object):
+    """
+    将CAM写入一个目录：每chunk_size张图的float16 CAM压缩保存为一个chunk_xxxxx.npz，
+    index.csv记录每张图所在的chunk和位置，meta.json记录模型、目标层等信息。
+    已经写入的图再次写入时直接跳过(upsample有重复的图片，中断后重新运行也不会重复计算)
+
+    :param path: 输出目录
+    :param names: 每张图的CAM个数及名字，如['layer2_1', 'layer2_2', 'layer2_3']
+    :param meta: 额外写入meta.json的信息
+    """
+    def __init__(self, path, names, chunk_size=256, **meta):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.buffer, self.rows = [], []
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        index = os.path.join(path, 'index.csv')
+        self.written = set(read_index(path)) if os.path.exists(index) else set()
+        self.chunk = len([f for f in os.listdir(path) if f.startswith('chunk_')])
+        self.index = open(index, 'a', newline='')
+        self.writer = csv.writer(self.index)
+        if not self.written:
+            self.writer.writerow(['path', 'inputs', 'chunk', 'offset', 'label', 'predict', 'prob'])
+
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(dict(meta, names=list(names)), f, indent=2)
+
+    def __contains__(self, path):
+        return path in self.written
+
+    def add(self, path, cams, label, prob, inputs=None):
+        """
+        :param cams: (K, H, W)，K为names的个数
+        :param prob: (num_classes,)的概率
+        :param inputs: 每个CAM对应的输入图片路径，默认都为path
+        """
+        if path in self.written:
+            return
+        self.written.add(path)
+        inputs = inputs if inputs is not None else [path] * len(cams)
+        self.rows.append([path, '|'.join(inputs), self.chunk, len(self.buffer), int(label), int(np.argmax(prob)),
+                          ' '.join(f'{p:.4f}' for p in prob)])
+        self.buffer.append(np.asarray(cams, dtype=np.float16))
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        np.savez_compressed(os.path.join(self.path, f'chunk_{self.chunk:05d}.npz'), cams=np.stack(self.buffer))
+        self.writer.writerows(self.rows)  # chunk写完之后再写index，中断时不会留下指向不存在chunk的记录
+        self.index.flush()
+        self.buffer, self.rows = [], []
+        self.chunk += 1
+
+    def close(self):
+        self.flush()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_index(path):
+    """:return: {图片路径: index.csv中的一行(dict)}"""
+    with open(os.path.join(path, 'index.csv'), newline='') as f:
+        return {row['path']: row for row in csv.DictReader(f)}
+
+
+class CAMArchive(object):
+    """
+    读取CAMWriter写出的目录，按图片路径取CAM，最近使用的一个chunk保留在内存中
+
+    :param path: CAMWriter的输出目录
+    """
+    def __init__(self, path):
+        self.path = path
+        self.index = read_index(path)
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.loaded, self.cams = None, None
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, path):
+        return path in self.index
+
+    def chunks(self):
+        """:return: {chunk序号: [图片路径]}，按chunk分组读取时每个chunk只解压一次"""
+        groups = {}
+        for path, row in self.index.items():
+            groups.setdefault(int(row['chunk']), []).append(path)
+        return groups
+
+    def load(self, chunk):
+        if chunk != self.loaded:
+            with np.load(os.path.join(self.path, f'chunk_{chunk:05d}.npz')) as f:
+                self.cams = f['cams']
+            self.loaded = chunk
+        return self.cams
+
+    def __getitem__(self, path):
+        """:return: (K, H, W)的float32 CAM"""
+        row = self.index[path]
+        return self.load(int(row['chunk']))[int(row['offset'])].astype(np.float32)
@@ -0,0 +1,86 @@
+# coding: utf-8
+
+import torch
+
+from tqdm import tqdm
+from torch.utils.data import DataLoader, Subset
+
+from .metrics import Predictions, unique_samples
+from .tta import tta_score
+
+
+def center(x):
+    """ContextVB_Dataset的label和路径为三元组，取中间一块脊骨"""
+    return x[1] if isinstance(x, (tuple, list)) and isinstance(x[0], (tuple, list, torch.Tensor)) else x
+
+
+def center_item(x):
+    """与center相同，用于dataset中的单个样本"""
+    return x[1] if isinstance(x, (tuple, list)) else x
+
+
+def inference(model, dataloader, get_score, num_classes, use_gpu=False, batch_size=None, tta=1, cache=None,
+              dedup=False, roc_bins=0):
+    """
+    在inference_mode下跑完整个dataloader，不建立autograd图，结果写入预分配的Predictions
+
+    :param model: eval模式下的模型
+    :param dataloader: 只使用其中的dataset、num_workers和worker_init_fn
+    :param get_score: fn(model, image) -> score，image为dataloader给出的Tensor或Tensor元组
+    :param batch_size: 与训练的batch_size无关，为None时沿用dataloader的batch_size
+    :param tta: 每张图的view个数(utils/tta.py)，forward的batch为batch_size * tta
+    :param cache: utils/cache.py中的BoundCache，命中的图不再读图和forward，只计算未命中的
+    :param dedup: upsample重复的样本只forward一次，结果再按原来的顺序展开，指标与不去重时相同
+    :param roc_bins: 大于0时2分类的ROC同时按batch累加到直方图(Predictions.roc)
+    :return: Predictions
+    """
+    dataset = dataloader.dataset
+    images, labels = dataset.images, dataset.labels
+    get_score = tta_score(get_score, tta)
+
+    if dedup:
+        unique, inverse, _ = unique_samples(images)
+        images, labels = [images[i] for i in unique], [labels[i] for i in unique]
+        dataset = Subset(dataset, unique)
+    predictions = Predictions(len(dataset), num_classes, roc_bins)
+
+    if cache is not None:
+        keys = [cache.key(paths) for paths in tqdm(images, desc='Hashing')]
+        hits = cache.get(keys)
+        misses = [i for i, key in enumerate(keys) if key not in hits]
+        scores = torch.empty(len(dataset), num_classes)
+        for i, key in enumerate(keys):
+            if key in hits:
+                scores[i] = torch.from_numpy(hits[key][0].copy())
+        print('Cache hits:', len(keys) - len(misses), 'misses:', len(misses))
+        dataset = Subset(dataset, misses)
+
+    if cache is not None or dedup or (batch_size and batch_size != dataloader.batch_size):
+        dataloader = DataLoader(dataset, batch_size=batch_size if batch_size else dataloader.batch_size,
+                                shuffle=False, num_workers=dataloader.num_workers, pin_memory=use_gpu,
+                                worker_init_fn=dataloader.worker_init_fn)
+
+    with torch.inference_mode():
+        start = 0
+        for image, label, image_path in tqdm(dataloader):
+            if use_gpu:
+                image = tuple(x.cuda(non_blocking=True) for x in image) if isinstance(image, (tuple, list)) \
+                    else image.cuda(non_blocking=True)
+            if cache is None:
+                score = get_score(model, image)
+                predictions.add(score.float().cpu(), center(label), center(image_path))
+                continue
+
+            # 未命中的图：forward之后写回缓存，分类层hook得到的特征一起保存
+            cache.reset()
+            score = get_score(model, image).float().cpu()
+            index = misses[start:start + score.size(0)]
+            start += score.size(0)
+            scores[index] = score
+            cache.put([keys[i] for i in index], score.numpy(), cache.take(score.size(0)).numpy())
+
+    if cache is not None:  # 按dataset原来的顺序写入，与不使用缓存时的结果一致
+        predictions.add(scores, torch.tensor([center_item(label) for label in labels]),
+                        [center_item(paths) for paths in images])
+
+    return predictions.select(inverse) if dedup else predictions
@@ -0,0 +1,78 @@
+# coding: utf-8
+
+import torch
+from torch.nn import functional as F
+
+
+class GradCAM(object):
+    """
+    基于hook的Grad-CAM：在任意命名的层上记录forward的输出，一个batch只做一次forward和一次backward。
+    不依赖features / classifier结构，支持Context/PC/Dual等多输入模型：
+    各分支独立的层(如ContextResNet18的layer2_1/2/3、DualVgg16的conv5_1/2)各得到一个CAM，
+    各分支共享的层(如PCResNet18的layer4)在一次forward中被调用几次，就按调用顺序得到几个CAM。
+    CAM针对第一个输出(分类score)，与其无关的分支(如PC/Dual模型只进入out_y的一支)得到全0的CAM
+
+    :param model: eval模式下的模型
+    :param layers: 目标层在named_modules()中的名字，如['layer4']、['layer2_1', 'layer2_2', 'layer2_3']
+    """
+    def __init__(self, model, layers):
+        self.model = model
+        self.layers = [layers] if isinstance(layers, str) else list(layers)
+        self.activations = {}
+
+        modules = dict(model.named_modules())
+        for name in self.layers:
+            if name not in modules:
+                raise ValueError(f'{type(model).__name__} has no layer {name}')
+        self.handles = [modules[name].register_forward_hook(self.hook(name)) for name in self.layers]
+
+    def hook(self, name):
+        def save(module, inputs, output):
+            self.activations.setdefault(name, []).append(output)
+        return save
+
+    def remove(self):
+        for handle in self.handles:
+            handle.remove()
+
+    def __call__(self, inputs, target=None, size=None):
+        """
+        :param inputs: forward的输入元组
+        :param target: 为None时取预测的类别，否则为int或(N,)的Tensor
+        :param size: CAM的大小，默认与第一个输入相同
+        :return: score, {layer: [(N, H, W)的CAM，按该层的调用顺序]}，每张图归一化到[0, 1]
+        """
+        self.activations = {}
+        # 参数不需要梯度时，让输入需要梯度，目标层的输出才会在autograd图中；反向只算到目标层为止
+        inputs = tuple(x.detach().requires_grad_() for x in inputs)
+        with torch.enable_grad():
+            output = self.model(*inputs)
+            score = output[0] if isinstance(output, (tuple, list)) else output  # 多输出模型的第一个输出为分类score
+            if target is None:
+                index = score.argmax(dim=1)
+            else:
+                index = torch.as_tensor(target, device=score.device).expand(score.size(0))
+            # 各样本之间互不影响(eval模式)，对选中的logit求和后一次backward即得到每张图各自的梯度
+            selected = score.gather(1, index.view(-1, 1)).sum()
+            for name in self.layers:
+                if name not in self.activations:
+                    raise RuntimeError(f'Layer {name} is not called in forward')
+            activations = [a for name in self.layers for a in self.activations[name]]
+            # 所有层、所有分支一起求梯度；与score无关的分支(如PC模型的第二支)梯度为None
+            gradients = torch.autograd.grad(selected, activations, allow_unused=True)
+            gradients = iter([torch.zeros_like(a) if g is None else g for a, g in zip(activations, gradients)])
+
+        size = size if size else inputs[0].shape[-2:]
+        cams = {name: [self.cam(a.detach(), next(gradients), size) for a in self.activations[name]]
+                for name in self.layers}
+        self.activations = {}
+        return score.detach(), cams
+
+    @staticmethod
+    def cam(activation, gradient, size):
+        weights = gradient.mean(dim=(2, 3), keepdim=True)  # 每个通道的权重为梯度的全局平均
+        cam = F.relu((weights * activation).sum(dim=1, keepdim=True))
+        cam = F.interpolate(cam, size=size, mode='bilinear', align_corners=False).squeeze(1)
+        low = cam.flatten(1).min(dim=1)[0].view(-1, 1, 1)
+        high = cam.flatten(1).max(dim=1)[0].view(-1, 1, 1)
+        return (cam - low) / (high - low).clamp(min=1e-8)
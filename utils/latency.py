@@ -0,0 +1,40 @@
+# coding: utf-8
+
+import time
+import torch
+import numpy as np
+
+
+def measure_latency(model, inputs, warmup=3, repeats=20, backward=False):
+    """
+    测量一次forward(或forward + backward)的耗时
+
+    :param model: 任意可调用的模型(eager / TorchScript / GraphModule)
+    :param inputs: tuple of Tensor
+    :param backward: True时对分类score求和后backward，测量训练一步(不含optimizer)的耗时
+    :return: dict, 单位为毫秒，throughput为每秒的图片数
+    """
+    cuda = any(x.is_cuda for x in inputs)
+    times = []
+    with torch.enable_grad() if backward else torch.no_grad():
+        for i in range(warmup + repeats):
+            if cuda:
+                torch.cuda.synchronize()
+            start = time.perf_counter()
+            output = model(*inputs)
+            if backward:
+                model.zero_grad(set_to_none=True)
+                (output[0] if isinstance(output, (tuple, list)) else output).sum().backward()
+            if cuda:
+                torch.cuda.synchronize()
+            if i >= warmup:
+                times.append(time.perf_counter() - start)
+
+    times = np.array(times) * 1000
+    batch_size = inputs[0].size(0)
+    return {'batch_size': batch_size,
+            'mean_ms': round(float(times.mean()), 3),
+            'p50_ms': round(float(np.percentile(times, 50)), 3),
+            'p90_ms': round(float(np.percentile(times, 90)), 3),
+            'per_image_ms': round(float(times.mean()) / batch_size, 3),
+            'throughput': round(1000. * batch_size / float(times.mean()), 2)}
@@ -0,0 +1,298 @@
+# coding: utf-8
+
+import os
+import torch
+import numpy as np
+
+
+def unique_samples(images):
+    """
+    upsample得到的重复样本只保留第一次出现的一份，按路径(Context为三元组)的hash去重
+
+    :param images: dataset.images
+    :return: index(唯一样本在dataset中的下标), inverse(dataset中每个样本对应index中的位置), weights(每个唯一样本的重复次数)
+    """
+    first, index, inverse, weights = {}, [], [], []
+    for i, paths in enumerate(images):
+        key = paths if isinstance(paths, str) else tuple(paths)
+        if key not in first:
+            first[key] = len(index)
+            index.append(i)
+            weights.append(0)
+        inverse.append(first[key])
+        weights[first[key]] += 1
+    return index, inverse, weights
+
+
+class Predictions(object):
+    """
+    预分配的输出buffer，evaluate时每个batch的结果直接写入，confusion matrix随batch累加
+
+    :param num_samples: 数据集大小
+    :param num_classes: 类别数
+    :param roc_bins: 大于0时2分类的ROC同时累加到ROCMeter，metrics_2class用直方图计算
+    """
+    def __init__(self, num_samples, num_classes, roc_bins=0):
+        self.num_classes = num_classes
+        self.count = 0
+        self.roc = ROCMeter(roc_bins) if roc_bins and num_classes == 2 else None
+        self._scores = torch.empty(num_samples, num_classes)
+        self._probs = torch.empty(num_samples, num_classes)
+        self._labels = torch.empty(num_samples, dtype=torch.long)
+        self.paths = []
+        self.cm = np.zeros((num_classes, num_classes), dtype=np.int64)  # 行为label，列为预测，与ConfusionMeter一致
+
+    def add(self, score, label, paths=()):
+        n = score.size(0)
+        prob = torch.softmax(score.float(), dim=1)
+        self._scores[self.count:self.count + n] = score
+        self._probs[self.count:self.count + n] = prob
+        self._labels[self.count:self.count + n] = label
+        self.cm += np.bincount(label.numpy() * self.num_classes + prob.argmax(dim=1).numpy(),
+                               minlength=self.num_classes ** 2).reshape(self.num_classes, self.num_classes)
+        if self.roc is not None:
+            self.roc.add(prob[:, 1], label)
+        self.paths.extend(paths)
+        self.count += n
+
+    def select(self, index):
+        """按下标取出(可以重复)的结果，如去重后的结果按inverse还原为upsample后的顺序"""
+        index = torch.as_tensor(index, dtype=torch.long)
+        result = Predictions(len(index), self.num_classes, self.roc.bins if self.roc is not None else 0)
+        result.add(self.scores[index], self.labels[index], [self.paths[i] for i in index.tolist()] if self.paths else ())
+        return result
+
+    @property
+    def scores(self):
+        """logits"""
+        return self._scores[:self.count]
+
+    @property
+    def probs(self):
+        return self._probs[:self.count]
+
+    @property
+    def labels(self):
+        return self._labels[:self.count]
+
+
+def roc_2class(predictions):
+    """
+    :return: FPR, TPR, Thresholds, AUC, SE + SP最大的点的下标
+    """
+    from sklearn.metrics import roc_curve, roc_auc_score
+
+    y_true, y_scores = predictions.labels.numpy(), predictions.probs[:, 1].numpy()
+    FPR, TPR, Thresholds = roc_curve(y_true, y_scores)
+    AUC = roc_auc_score(y_true, y_scores, average='weighted')
+    return FPR, TPR, Thresholds, AUC, np.argmax(TPR - FPR, axis=0)
+
+
+def metrics_2class(predictions, dist):
+    """
+    :param dist: 数据集的类别分布，用于还原最优阈值下的confusion matrix
+    :return: best_confusion_matrix, AUC, best_SP, best_SE, best_T, accuracy
+    """
+    if predictions.roc is not None:  # 用直方图计算，不对全部score排序
+        AUC = predictions.roc.value()[0]
+        best_SP, best_SE, best_T = predictions.roc.best()
+    else:
+        FPR, TPR, Thresholds, AUC, best_index = roc_2class(predictions)
+        best_SE, best_SP, best_T = TPR[best_index], 1 - FPR[best_index], Thresholds[best_index]
+    best_confusion_matrix = [[int(round(dist['0'] * best_SP)), int(round(dist['0'] * (1 - best_SP)))],
+                             [int(round(dist['1'] * (1 - best_SE))), int(round(dist['1'] * best_SE))]]
+    accuracy = 100. * sum([best_confusion_matrix[c][c] for c in range(2)]) / np.sum(best_confusion_matrix)
+    return best_confusion_matrix, AUC, best_SP, best_SE, best_T, accuracy
+
+
+class ROCMeter(object):
+    """
+    流式的2分类ROC：正 / 负样本的positive score各累加一个bins格的直方图，内存为O(bins)，与样本数无关。
+    多个进程(DDP)或多个分块的meter可以直接相加合并，不需要收集原始score。
+    阈值取在格子的边界上，该阈值下的SE / SP是精确的，最优阈值的精度为1 / bins；
+    AUC按梯形计算(同一格内的正负样本对算一半)，误差不超过error()
+
+    :param bins: 直方图格数，score在[0, 1]内
+    """
+    def __init__(self, bins=10000):
+        self.bins = bins
+        self.reset()
+
+    def reset(self):
+        self.hist = np.zeros((2, self.bins))  # 第0行为负样本，第1行为正样本
+
+    def add(self, scores, labels, weights=None):
+        """
+        :param scores: (N,)的positive概率，Tensor或ndarray
+        :param labels: (N,)的0 / 1
+        :param weights: 每个样本的权重，默认为1
+        """
+        scores = scores.cpu().numpy() if torch.is_tensor(scores) else np.asarray(scores)
+        labels = labels.cpu().numpy() if torch.is_tensor(labels) else np.asarray(labels)
+        index = np.clip((scores * self.bins).astype(np.int64), 0, self.bins - 1)
+        self.hist += np.bincount(labels.astype(np.int64) * self.bins + index, weights,
+                                 minlength=2 * self.bins).reshape(2, self.bins)
+
+    def __iadd__(self, other):
+        self.hist += other.hist
+        return self
+
+    def all_reduce(self):
+        """DDP时各进程的直方图求和，之后每个进程的value()都是全部数据上的结果"""
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            hist = torch.from_numpy(self.hist)
+            torch.distributed.all_reduce(hist)
+            self.hist = hist.numpy()
+        return self
+
+    def roc(self):
+        """:return: FPR, TPR, Thresholds，阈值从高到低，score >= 阈值判为正样本"""
+        neg, pos = self.hist[:, ::-1].cumsum(1)
+        FPR = np.r_[0., neg / max(neg[-1], 1e-12)]
+        TPR = np.r_[0., pos / max(pos[-1], 1e-12)]
+        Thresholds = np.r_[np.inf, np.arange(self.bins - 1, -1, -1) / self.bins]
+        return FPR, TPR, Thresholds
+
+    def value(self):
+        """:return: AUC, TPR, FPR，与torchnet的AUCMeter一致"""
+        FPR, TPR, _ = self.roc()
+        return float(np.sum((FPR[1:] - FPR[:-1]) * (TPR[1:] + TPR[:-1]) / 2)), TPR, FPR
+
+    def best(self):
+        """:return: SE + SP最大的阈值处的SP, SE, 阈值"""
+        FPR, TPR, Thresholds = self.roc()
+        best_index = np.argmax(TPR - FPR)
+        return 1 - FPR[best_index], TPR[best_index], Thresholds[best_index]
+
+    def error(self):
+        """:return: AUC误差的上界，即落在同一格内的正负样本对的比例的一半"""
+        neg, pos = self.hist
+        return float(0.5 * np.dot(neg, pos) / max(neg.sum() * pos.sum(), 1e-12))
+
+
+def confusion_metrics(cm):
+    """
+    :return: accuracy, 每一类的SP, 每一类的SE(均为百分数)
+    """
+    accuracy = 100. * np.trace(cm) / cm.sum()
+    sp = [100. * (cm.sum() - cm.sum(0)[i] - cm.sum(1)[i] + cm[i][i]) / (cm.sum() - cm.sum(1)[i]) for i in range(len(cm))]
+    se = [100. * cm[i][i] / cm.sum(1)[i] for i in range(len(cm))]
+    return accuracy, sp, se
+
+
+def mean_auc(predictions):
+    """每一类one-vs-rest的AUC的平均"""
+    from sklearn.metrics import roc_auc_score
+
+    y_true, y_scores = predictions.labels.numpy(), predictions.probs.numpy()
+    return np.mean([roc_auc_score(y_true == c, y_scores[:, c], average='weighted') for c in range(predictions.num_classes)])
+
+
+def mean_ap(predictions):
+    from torchnet import meter
+
+    mAP = meter.mAPMeter()
+    mAP.add(predictions.probs, torch.eye(predictions.num_classes)[predictions.labels])
+    return mAP.value().numpy()
+
+
+def metrics_3class(predictions, data_scale):
+    """
+    :param data_scale: balance时每一类的倍数，计算指标时按照balance后的matrix来算，展示的时候还原
+    :return: confusion_matrix, mAP, SP, SE, mAUC, accuracy
+    """
+    accuracy, sp, se = confusion_metrics(predictions.cm)
+    cm = predictions.cm / np.expand_dims(np.array(data_scale), axis=1)
+    return cm.astype(dtype=np.int32), mean_ap(predictions), sp, se, mean_auc(predictions), accuracy
+
+
+def bootstrap_weights(groups, base, num_replicates, rng):
+    """
+    有放回地抽取组(病人或单个样本)，每个replicate中样本的权重 = 所在组被抽中的次数 * base
+
+    :param groups: 每个样本所属组的下标
+    :param base: 每个样本原本的权重(upsample的重复次数)
+    :return: (num_replicates, N)
+    """
+    num_groups = groups.max() + 1
+    draws = rng.randint(num_groups, size=(num_replicates, num_groups))
+    counts = np.bincount((np.arange(num_replicates)[:, None] * num_groups + draws).ravel(),
+                         minlength=num_replicates * num_groups).reshape(num_replicates, num_groups)
+    return counts[:, groups] * base
+
+
+class RankStats(object):
+    """
+    一个类别的score只排序一次，相同的score合为一组，之后每批replicate只需要按组累加权重
+
+    :param scores: (N,)
+    :param positive: (N,) bool
+    """
+    def __init__(self, scores, positive):
+        self.order = np.argsort(scores, kind='mergesort')
+        sorted_scores = scores[self.order]
+        self.starts = np.flatnonzero(np.r_[True, sorted_scores[1:] != sorted_scores[:-1]])
+        self.positive = positive[self.order]
+
+    def __call__(self, W):
+        """:return: 每个replicate的(AUC, AP)，AP与sklearn的average_precision_score一致"""
+        W = W[:, self.order]
+        wpos = np.add.reduceat(W * self.positive, self.starts, axis=1)
+        wneg = np.add.reduceat(W * ~self.positive, self.starts, axis=1)
+        P, N = wpos.sum(1), wneg.sum(1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # AUC：每个正样本的score高于多少负样本，相同score算一半
+            auc = (wpos * (np.cumsum(wneg, axis=1) - wneg + 0.5 * wneg)).sum(1) / (P * N)
+            # AP：从高到低每个阈值处的precision，按该阈值处的正样本权重加权
+            tp = P[:, None] - np.cumsum(wpos, axis=1) + wpos
+            fp = N[:, None] - np.cumsum(wneg, axis=1) + wneg
+            ap = (wpos * np.divide(tp, tp + fp, out=np.zeros_like(tp), where=tp + fp > 0)).sum(1) / P  # 没有被抽中的组不计入
+        return auc, ap
+
+
+def bootstrap_ci(predictions, num_replicates=1000, by='vertebra', threshold=None, alpha=0.05, seed=0, chunk_size=200):
+    """
+    bootstrap置信区间，所有replicate用权重矩阵一起计算，不逐个调用sklearn。
+    upsample重复的样本先合并为一个，重复次数作为权重，与metrics_3class的balance后的指标一致
+
+    :param by: 'vertebra'按单个脊骨重采样，'patient'按病人(图片所在目录)重采样
+    :param threshold: 2分类计算SE / SP的阈值(如metrics_2class的best_T)，为None时取概率最大的类别
+    :return: {指标: [下限, 上限]}，2分类为AUC / SE / SP，3分类为mAUC / mAP / accuracy / SE / SP(百分数，与confusion_metrics一致)
+    """
+    unique, _, weights = unique_samples(predictions.paths)
+    probs, labels = predictions.probs.numpy()[unique], predictions.labels.numpy()[unique]
+    base = np.asarray(weights, dtype=np.float64)
+    if by == 'patient':
+        groups = np.unique([os.path.dirname(predictions.paths[i]) for i in unique], return_inverse=True)[1]
+    elif by == 'vertebra':
+        groups = np.arange(len(unique))
+    else:
+        raise ValueError
+
+    num_classes = predictions.num_classes
+    classes = [1] if num_classes == 2 else range(num_classes)
+    ranks = [RankStats(probs[:, c], labels == c) for c in classes]
+    predict = (probs[:, 1] >= threshold).astype(np.int64) if num_classes == 2 and threshold is not None else probs.argmax(1)
+    hit = np.stack([(labels == c) & (predict == c) for c in range(num_classes)] +
+                   [(labels != c) & (predict != c) for c in range(num_classes)] + [labels == predict], axis=1)
+    total = np.stack([labels == c for c in range(num_classes)] + [labels != c for c in range(num_classes)] +
+                     [np.ones_like(labels, dtype=bool)], axis=1)
+
+    rng = np.random.RandomState(seed)
+    replicates = []
+    for start in range(0, num_replicates, chunk_size):
+        W = bootstrap_weights(groups, base, min(chunk_size, num_replicates - start), rng)
+        auc, ap = zip(*[rank(W) for rank in ranks])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rates = (W @ hit) / (W @ total)  # 每一类的SE、SP和accuracy
+        replicates.append(np.column_stack([np.mean(auc, axis=0), np.mean(ap, axis=0), rates]))
+    replicates = np.concatenate(replicates)
+
+    low, high = np.nanpercentile(replicates, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+    interval = lambda i, scale=1: [round(float(low[i]) * scale, 4), round(float(high[i]) * scale, 4)]
+    if num_classes == 2:  # 正类(1)的SE和SP；负类的SP就是正类的SE
+        return {'AUC': interval(0), 'SE': interval(2 + 1), 'SP': interval(2 + num_classes + 1)}
+    ci = {'mAUC': interval(0), 'mAP': interval(1), 'accuracy': interval(2 + 2 * num_classes, 100)}
+    ci.update({f'se{c}': interval(2 + c, 100) for c in range(num_classes)})
+    ci.update({f'sp{c}': interval(2 + num_classes + c, 100) for c in range(num_classes)})
+    return ci
@@ -0,0 +1,170 @@
+# coding: utf-8
+
+import os
+import json
+import numpy as np
+
+
+def normalize(x):
+    """每一行L2归一化，归一化之后内积即为cosine相似度，按内积排序与按L2距离排序一致"""
+    x = np.asarray(x, dtype=np.float32)
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+
+def assign(x, centroids, chunk_size=8192):
+    """:return: 每一行最近(内积最大)的中心"""
+    return np.concatenate([np.argmax(x[i:i + chunk_size] @ centroids.T, axis=1) for i in range(0, len(x), chunk_size)])
+
+
+def nearest(x, centroids, chunk_size=8192):
+    """:return: 每一行L2距离最近的中心(PQ的子空间中向量未归一化，不能用内积)"""
+    norms = (centroids ** 2).sum(1)
+    return np.concatenate([np.argmin(norms - 2 * x[i:i + chunk_size] @ centroids.T, axis=1)
+                           for i in range(0, len(x), chunk_size)])
+
+
+def kmeans(x, k, iters=20, spherical=False, seed=0):
+    """
+    numpy实现的k-means
+
+    :param spherical: True时中心归一化，按内积分配(用于归一化之后的特征)
+    :return: (k, d)的中心
+    """
+    rng = np.random.RandomState(seed)
+    centroids = x[rng.choice(len(x), k, replace=len(x) < k)].copy()
+    for _ in range(iters):
+        labels = assign(x, centroids) if spherical else nearest(x, centroids)
+        counts = np.bincount(labels, minlength=k)
+        empty = counts == 0
+        # 按簇排序后用reduceat分段求和，比np.add.at快得多
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        centroids[~empty] = np.add.reduceat(x[np.argsort(labels, kind='stable')], starts[~empty]) / counts[~empty, None]
+        centroids[empty] = x[rng.choice(len(x), int(empty.sum()))]  # 空的簇重新随机取点
+        if spherical:
+            centroids = normalize(centroids)
+    return centroids
+
+
+def topk(scores, k):
+    """:return: 每一行分数最大的k个下标(从大到小)"""
+    k = min(k, scores.shape[1])
+    index = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, index, axis=1), axis=1)
+    return np.take_along_axis(index, order, axis=1)
+
+
+class RetrievalIndex(object):
+    """
+    归一化特征上的相似病例检索，保存为一个目录，所有数组用np.load(mmap_mode='r')按需读入：
+    vectors.npy(float16原始特征，精确检索和重排序)、centroids.npy(IVF的粗聚类中心)、
+    codebooks.npy(残差的PQ码本)、codes.npy(uint8 PQ编码，按倒排表顺序存放)、order.npy、offsets.npy
+
+    :param path: 索引目录
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        load = lambda name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+        self.vectors, self.codes, self.order = load('vectors'), load('codes'), load('order')
+        self.centroids, self.codebooks = np.asarray(load('centroids')), np.asarray(load('codebooks'))
+        self.offsets = np.asarray(load('offsets'))
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @staticmethod
+    def build(path, features, nlist=None, m=32, ksub=256, train_size=65536, seed=0):
+        """
+        :param features: (N, D)的特征，可以是np.memmap
+        :param nlist: 倒排表个数，默认约为4 * sqrt(N)
+        :param m: PQ子空间个数，D需要能被m整除
+        """
+        if not os.path.exists(path):
+            os.makedirs(path)
+        n, d = features.shape
+        nlist = nlist if nlist else max(1, min(int(4 * np.sqrt(n)), n))
+        rng = np.random.RandomState(seed)
+        train = normalize(features[np.sort(rng.choice(n, min(n, train_size), replace=False))])
+
+        # 粗聚类：归一化特征上的spherical k-means
+        centroids = kmeans(train, nlist, spherical=True, seed=seed)
+        # 残差在m个子空间上分别做k-means得到PQ码本，每个码字64个样本已经足够
+        residual = train - centroids[assign(train, centroids)]
+        sub = residual[:ksub * 64].reshape(min(len(train), ksub * 64), m, d // m)
+        codebooks = np.stack([kmeans(np.ascontiguousarray(sub[:, j]), min(ksub, len(sub)), seed=seed) for j in range(m)])
+
+        vectors = np.lib.format.open_memmap(os.path.join(path, 'vectors.npy'), mode='w+', dtype=np.float16, shape=(n, d))
+        lists = np.empty(n, dtype=np.int64)
+        codes = np.empty((n, m), dtype=np.uint8)
+        for start in range(0, n, 65536):  # 分块编码，不需要把全部特征读入内存
+            x = normalize(features[start:start + 65536])
+            vectors[start:start + len(x)] = x
+            lists[start:start + len(x)] = assign(x, centroids)
+            sub = (x - centroids[lists[start:start + len(x)]]).reshape(len(x), m, d // m)
+            for j in range(m):
+                codes[start:start + len(x), j] = nearest(np.ascontiguousarray(sub[:, j]), codebooks[j])
+        vectors.flush()
+
+        order = np.argsort(lists, kind='stable')  # 同一个倒排表的编码连续存放
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(lists, minlength=nlist))])
+        np.save(os.path.join(path, 'centroids.npy'), centroids.astype(np.float32))
+        np.save(os.path.join(path, 'codebooks.npy'), codebooks.astype(np.float32))
+        np.save(os.path.join(path, 'codes.npy'), codes[order])
+        np.save(os.path.join(path, 'order.npy'), order)
+        np.save(os.path.join(path, 'offsets.npy'), offsets)
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'size': n, 'dim': d, 'nlist': nlist, 'm': m, 'ksub': int(codebooks.shape[1])}, f)
+        return RetrievalIndex(path)
+
+    def exact(self, queries, k=10, chunk_size=65536):
+        """
+        精确检索：分块读入float16特征做矩阵乘法，合并各块的top-k
+
+        :return: (相似度, 下标)，均为(Q, k)
+        """
+        queries = normalize(queries)
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_index = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(self), chunk_size):
+            scores = queries @ np.asarray(self.vectors[start:start + chunk_size], dtype=np.float32).T
+            index = topk(scores, k)
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, index, axis=1)], axis=1)
+            best_index = np.concatenate([best_index, index + start], axis=1)
+            keep = topk(best_scores, k)
+            best_scores, best_index = np.take_along_axis(best_scores, keep, axis=1), np.take_along_axis(best_index, keep, axis=1)
+        return best_scores, best_index
+
+    def search(self, queries, k=10, nprobe=16, rerank=0):
+        """
+        IVF-PQ近似检索：只扫描最近的nprobe个倒排表，用查表(ADC)计算 q·(中心 + 残差) 的近似内积
+
+        :param rerank: 大于0时取近似分数最高的rerank个候选，再用原始特征精确重排序
+        :return: (相似度, 下标)，候选不足k个时下标为-1
+        """
+        queries = normalize(queries)
+        m, dsub = self.codebooks.shape[0], self.codebooks.shape[2]
+        coarse = queries @ self.centroids.T
+        probes = topk(coarse, nprobe)
+        # 每个查询一张(m, ksub)的表：子空间内查询向量与各码字的内积，所有倒排表共用
+        tables = np.einsum('qjd,jkd->qjk', queries.reshape(len(queries), m, dsub), self.codebooks)
+
+        result_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        result_index = np.full((len(queries), k), -1, dtype=np.int64)
+        for q in range(len(queries)):
+            spans = [(self.offsets[l], self.offsets[l + 1], l) for l in probes[q] if self.offsets[l + 1] > self.offsets[l]]
+            if not spans:
+                continue
+            positions = np.concatenate([np.arange(a, b) for a, b, _ in spans])
+            base = np.concatenate([np.full(b - a, coarse[q, l], dtype=np.float32) for a, b, l in spans])
+            scores = base + tables[q][np.arange(m), np.asarray(self.codes[positions])].sum(1)
+
+            candidates = topk(scores[None], max(k, rerank))[0]
+            index, scores = np.asarray(self.order[positions[candidates]]), scores[candidates]
+            if rerank:
+                scores = np.asarray(self.vectors[index], dtype=np.float32) @ queries[q]
+                keep = topk(scores[None], k)[0]
+                index, scores = index[keep], scores[keep]
+            index, scores = index[:k], scores[:k]
+            result_scores[q, :len(index)], result_index[q, :len(index)] = scores, index
+        return result_scores, result_index
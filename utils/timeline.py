@@ -0,0 +1,141 @@
+# coding: utf-8
+
+import os
+import json
+import glob
+import time
+import shutil
+import functools
+import numpy as np
+import torch
+
+
+class _NullSpan(object):
+    """Timeline关闭时span()返回的空context manager，所有span共用一个"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span(object):
+    __slots__ = ['timeline', 'name', 'start']
+
+    def __init__(self, timeline, name):
+        self.timeline, self.name = timeline, name
+
+    def __enter__(self):
+        if self.timeline.sync:
+            torch.cuda.synchronize()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        if self.timeline.sync:  # CUDA异步执行，不同步时forward的时间会算到之后第一个需要结果的span上
+            torch.cuda.synchronize()
+        self.timeline.record(self.name, self.start, time.perf_counter())
+        return False
+
+
+def trace_worker(directory, worker_id):
+    """DataLoader的worker_init_fn：打开worker中dataset的StageTimer，把各阶段写入directory下的jsonl"""
+    dataset = torch.utils.data.get_worker_info().dataset
+    while isinstance(dataset, torch.utils.data.Subset):  # inference中去重 / 缓存时用的Subset
+        dataset = dataset.dataset
+    if hasattr(dataset, 'timer'):
+        dataset.timer.trace(os.path.join(directory, f'{os.getpid()}.jsonl'), f'loader worker {worker_id}')
+
+
+class Timeline(object):
+    """
+    训练循环的分阶段计时：with timeline.span('forward'): ...
+    每个阶段记录每一步的耗时，summary()给出各阶段的p50 / p90 / max和占墙上时间的比例；
+    trace_file不为空时同时记录Chrome trace(chrome://tracing或ui.perfetto.dev打开)，attach的DataLoader的
+    worker中dataset各阶段(decode / resize / augment ...)按worker进程分别显示。
+    关闭时span()直接返回NULL_SPAN，每个span的开销只有一次函数调用
+
+    :param enabled: 是否计时
+    :param trace_file: Chrome trace的保存路径，None时不记录trace
+    :param sync: 每个span前后torch.cuda.synchronize()，用GPU训练时才能得到各阶段真实的耗时
+    """
+    def __init__(self, enabled=False, trace_file=None, sync=False):
+        self.enabled = enabled or bool(trace_file)
+        self.trace_file = trace_file
+        self.sync = sync and self.enabled and torch.cuda.is_available()
+        self.spans = {}
+        self.durations = {}  # 阶段名 -> 上次summary之后每次的秒数
+        self.events = []
+        self.since = time.perf_counter()
+        self.worker_dir = os.path.splitext(trace_file)[0] + '_workers' if trace_file else None
+        if self.worker_dir:
+            shutil.rmtree(self.worker_dir, ignore_errors=True)
+            os.makedirs(self.worker_dir)
+
+    def span(self, name):
+        if not self.enabled:
+            return NULL_SPAN
+        if name not in self.spans:
+            self.spans[name] = _Span(self, name)
+        return self.spans[name]
+
+    def record(self, name, start, end):
+        self.durations.setdefault(name, []).append(end - start)
+        if self.trace_file:
+            self.events.append({'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': 0,
+                                'ts': round(start * 1e6, 1), 'dur': round((end - start) * 1e6, 1)})
+
+    def attach(self, dataloader):
+        """记录trace时，同时记录dataloader中dataset各阶段的耗时(dataset需要有StageTimer，见dataset/timer.py)"""
+        if not self.trace_file or not hasattr(dataloader.dataset, 'timer'):
+            return
+        if dataloader.num_workers == 0:
+            dataloader.dataset.timer.trace(os.path.join(self.worker_dir, f'{os.getpid()}.jsonl'), 'loader (main process)')
+        elif dataloader.worker_init_fn is None:
+            dataloader.worker_init_fn = functools.partial(trace_worker, self.worker_dir)
+
+    def summary(self):
+        """
+        上次summary之后各阶段的统计，之后清空
+
+        :return: {阶段名: {count, p50_ms, p90_ms, max_ms, total_s, share}}，share为占墙上时间的比例
+        """
+        now = time.perf_counter()
+        wall = now - self.since
+        result = {}
+        for name, durations in self.durations.items():
+            durations = np.array(durations) * 1000
+            result[name] = {'count': len(durations),
+                            'p50_ms': round(float(np.percentile(durations, 50)), 3),
+                            'p90_ms': round(float(np.percentile(durations, 90)), 3),
+                            'max_ms': round(float(durations.max()), 3),
+                            'total_s': round(float(durations.sum()) / 1000, 3),
+                            'share': round(float(durations.sum()) / 1000 / wall, 4)}
+        self.durations = {}
+        self.since = now
+        return result
+
+    def report(self):
+        """:return: summary()的多行文本，没有记录时为空字符串"""
+        lines = [f'{name:>12}: p50 {s["p50_ms"]:.2f} ms, p90 {s["p90_ms"]:.2f} ms, max {s["max_ms"]:.2f} ms, '
+                 f'{100 * s["share"]:.1f}% of wall time ({s["count"]} calls)' for name, s in self.summary().items()]
+        return '\n'.join(lines)
+
+    def save(self):
+        """训练结束时调用：把主进程和各worker的事件合并写入trace_file，删除worker的临时文件"""
+        if not self.trace_file:
+            return
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': 0, 'args': {'name': 'train loop'}}]
+        events += self.events
+        for path in sorted(glob.glob(os.path.join(self.worker_dir, '*.jsonl'))):
+            with open(path) as f:
+                events.extend(json.loads(line) for line in f if line.strip())
+        if os.path.dirname(self.trace_file) and not os.path.exists(os.path.dirname(self.trace_file)):
+            os.makedirs(os.path.dirname(self.trace_file))
+        with open(self.trace_file, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        shutil.rmtree(self.worker_dir, ignore_errors=True)
+        print('Timeline trace ' + self.trace_file + ' has been saved!')
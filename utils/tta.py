@@ -0,0 +1,54 @@
+# coding: utf-8
+
+import torch
+from torch.nn import functional as F
+from torchvision.transforms import functional
+
+# 与训练时的RandomHorizontalFlip / RandomVerticalFlip / RandomRotation(30)对应的确定性变换，取前K个
+VIEWS = ['identity', 'hflip', 'vflip', 'hvflip', 'rotate15', 'rotate-15', 'rotate30', 'rotate-30']
+
+
+def view(x, name):
+    """:param x: (N, C, H, W)的Tensor"""
+    if name == 'identity':
+        return x
+    elif name == 'hflip':
+        return x.flip(-1)
+    elif name == 'vflip':
+        return x.flip(-2)
+    elif name == 'hvflip':
+        return x.flip(-2, -1)
+    elif name.startswith('rotate'):
+        return functional.rotate(x, float(name[len('rotate'):]))
+    else:
+        raise ValueError(name)
+
+
+def expand(image, k):
+    """
+    在Tensor上做K种变换并拼成一个K倍大小的batch，不重新读图
+
+    :param image: Tensor，或Context模型的三元组(三块脊骨做同样的变换)
+    :return: 与image结构相同，batch维为 K * N，按view排列
+    """
+    if isinstance(image, (tuple, list)):
+        return tuple(expand(x, k) for x in image)
+    return torch.cat([view(image, name) for name in VIEWS[:k]])
+
+
+def tta_score(get_score, k):
+    """
+    把get_score(model, image)包装成K个view一次forward、softmax取平均的版本
+
+    :return: fn(model, image) -> 平均概率的log，softmax之后即为平均概率，可以直接交给Predictions
+    """
+    if k <= 1:
+        return get_score
+    if k > len(VIEWS):
+        raise ValueError(f'tta should be no more than {len(VIEWS)}')
+
+    def score(model, image):
+        n = (image[0] if isinstance(image, (tuple, list)) else image).size(0)
+        probs = F.softmax(get_score(model, expand(image, k)).float(), dim=1)
+        return probs.view(k, n, -1).mean(0).log()
+    return score
@@ -3,10 +3,6 @@
 import csv
 import json
 
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-
 
 def write_csv(file, tag, content):
     """
@@ -36,6 +32,10 @@ def write_json(file, content):
 
 
 def draw_ROC(tpr, fpr, best_index, tangent=False, save_path=None):
+    import matplotlib  # 只在画图时才import，不拖慢命令行的启动
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
     plt.title('ROC')
     plt.xlabel('1 - SP')
     plt.ylabel('SE')
@@ -1,34 +1,68 @@
 # coding: utf-8
 
-import visdom
+import os
 import time
+import json
+import queue
+import atexit
+import threading
 import numpy as np
 
 
 class Visualizer(object):
     """
-    ???visdom???????????????`self.vis.function`
-    ?????visdom??
-    """
+    对visdom的封装，plot / log / img只把事件放入队列(每次调用为微秒级)，由后台线程按interval批量发送：
+    同一个窗口的多个点合并为一次vis.line，log只发送新增的文本(append)。
+    连不上visdom服务器(或发送失败)时改为写入本地文件<log_dir>/<env>.jsonl，图片保存为npy。
+    仍然可以通过`self.vis.function`调用visdom的原生接口
 
-    def __init__(self, env='default', **kwargs):
-        self.vis = visdom.Visdom(env=env, **kwargs)
+    :param env: visdom的env，也是本地文件的名字
+    :param log_dir: 本地文件的目录
+    :param interval: 后台线程两次发送之间最多攒多少秒的事件
+    """
 
-        # ?????????????
-        # ????loss',23? ?loss??23??
+    def __init__(self, env='default', log_dir='logs', interval=0.5, **kwargs):
+        # 画的第几个数，相当于横坐标
+        # 比如（'loss',23） 即loss的第23个点
         self.index = {}
-        self.log_text = ''
+        self.log_dir = log_dir
+        self.interval = interval
+        self.queue = queue.Queue()
+        self.sender = None
+        self.reinit(env, **kwargs)
+        atexit.register(self.close)
 
     def reinit(self, env='default', **kwargs):
         """
-        ??visdom???
+        修改visdom的配置，之前队列中的事件先按原来的配置发送完
         """
-        self.vis = visdom.Visdom(env=env, **kwargs)
+        if self.sender is not None:
+            self.close()
+        self.env = env
+        self.created = set()  # 已经建立的text窗口，之后的log都append
+        self.vis = None
+        try:
+            import visdom  # visdom只在建立Visualizer时才import
+        except ImportError:  # 没有安装visdom时只写本地文件
+            visdom = None
+        if visdom is not None:
+            kwargs.setdefault('use_incoming_socket', False)
+            kwargs.setdefault('raise_exceptions', True)  # 默认只打印错误，发送失败时需要抛出异常才能改写本地文件
+            try:  # raise_exceptions时连不上服务器在建立时就会抛出异常
+                vis = visdom.Visdom(env=env, **kwargs)
+                if vis.check_connection():
+                    self.vis = vis
+            except Exception:
+                pass
+        if self.vis is None:
+            print('Visdom server is not available, logs are written to ' + os.path.join(self.log_dir, env + '.jsonl'))
+        self.sender = threading.Thread(target=self.run, daemon=True)
+        self.sender.start()
         return self
 
     def plot_many(self, d):
         """
-        ??plot??
+        一次plot多个
         @params d: dict (name,value) i.e. ('loss',0.11)
         """
         for k, v in d.items():
@@ -43,12 +77,7 @@ class Visualizer(object):
         self.plot('loss',1.00)
         """
         x = self.index.get(name, 0)
-        self.vis.line(Y=np.array([y]), X=np.array([x]),
-                      win=name,
-                      opts=dict(title=name),
-                      update=None if x == 0 else 'append',
-                      **kwargs
-                      )
+        self.queue.put(('line', name, x, y, kwargs))
         self.index[name] = x + 1
 
     def img(self, name, img_, **kwargs):
@@ -57,23 +86,87 @@ class Visualizer(object):
         self.img('input_imgs',t.Tensor(3,64,64))
         self.img('input_imgs',t.Tensor(100,1,64,64))
         self.img('input_imgs',t.Tensor(100,3,64,64),nrows=10)
-        ???don?t ~~self.img('input_imgs',t.Tensor(100,64,64),nrows=10)~~???
+        ！！！don‘t ~~self.img('input_imgs',t.Tensor(100,64,64),nrows=10)~~！！！
         """
-        self.vis.images(img_.cpu().numpy(),
-                        win=name,
-                        opts=dict(title=name),
-                        **kwargs
-                        )
+        x = self.index.get(name, 0)
+        self.queue.put(('images', name, x, img_.detach().cpu().numpy(), kwargs))
+        self.index[name] = x + 1
 
     def log(self, info, win='log_text'):
         """
         self.log({'loss':1,'lr':0.0001})
         """
+        self.queue.put(('text', win, None, '[{time}] {info} <br>'.format(time=time.strftime('%m%d_%H%M%S'), info=info), {}))
+
+    def flush(self):
+        """等待队列中已有的事件全部发送完"""
+        self.queue.join()
+
+    def close(self):
+        if self.sender is not None and self.sender.is_alive():
+            self.queue.put(None)
+            self.sender.join()
+        self.sender = None
+
+    def run(self):
+        while True:
+            events = [self.queue.get()]
+            if events[0] is not None:
+                time.sleep(self.interval)  # 攒一批事件一起发送
+            while events[-1] is not None:
+                try:
+                    events.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.send([e for e in events if e is not None])
+            finally:
+                for _ in events:
+                    self.queue.task_done()
+            if events[-1] is None:
+                return
+
+    def send(self, events):
+        if self.vis is not None:
+            try:
+                return self.send_visdom(events)
+            except Exception as e:  # 服务器断开之后的事件都写入本地文件
+                print(f'Visdom send failed ({e}), logs are written to ' + os.path.join(self.log_dir, self.env + '.jsonl'))
+                self.vis = None
+        self.send_file(events)
+
+    def send_visdom(self, events):
+        lines, texts = {}, {}
+        for kind, win, x, y, kwargs in events:
+            if kind == 'line':
+                lines.setdefault(win, ([], [], kwargs))
+                lines[win][0].append(x)
+                lines[win][1].append(float(y))
+            elif kind == 'text':
+                texts[win] = texts.get(win, '') + y
+            else:
+                self.vis.images(y, win=win, opts=dict(title=win), **kwargs)
+        for win, (X, Y, kwargs) in lines.items():
+            self.vis.line(Y=np.array(Y), X=np.array(X), win=win, opts=dict(title=win),
+                          update=None if X[0] == 0 else 'append', **kwargs)
+        for win, text in texts.items():
+            self.vis.text(text, win, append=win in self.created)
+            self.created.add(win)
 
-        self.log_text += ('[{time}] {info} <br>'.format(
-            time=time.strftime('%m%d_%H%M%S'),
-            info=info))
-        self.vis.text(self.log_text, win)
+    def send_file(self, events):
+        if not os.path.exists(self.log_dir):
+            os.makedirs(self.log_dir)
+        with open(os.path.join(self.log_dir, self.env + '.jsonl'), 'a') as f:
+            for kind, win, x, y, _ in events:
+                if kind == 'images':
+                    path = os.path.join(self.log_dir, f'{self.env}_{win}_{x}.npy')
+                    np.save(path, y)
+                    y = path
+                elif kind == 'line':
+                    y = float(y)
+                f.write(json.dumps({'type': kind, 'win': win, 'x': x, 'value': y}, ensure_ascii=False) + '\n')
 
     def __getattr__(self, name):
+        if name == 'vis':
+            raise AttributeError(name)
         return getattr(self.vis, name)